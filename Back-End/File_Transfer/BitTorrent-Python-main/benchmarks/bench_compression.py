@@ -0,0 +1,129 @@
+"""
+Downloads of compressible and incompressible files, with and without compression of the pieces.
+
+One seeder serves two files to one downloader: log lines (text compresses
+well) and random bytes (it doesn't, the sample check must skip it). The
+seeder sends at -rate bytes/s (its datagrams are delayed as by a slow link,
+0 for the loopback as it is). Each file is downloaded with COMPRESSION off and
+on; it reports the time of each download and the bytes the downloader received.
+
+    $ python3 benchmarks/bench_compression.py -size 10000000 -rate 20000000 0
+"""
+import os
+import sys
+import argparse
+import asyncio
+import contextlib
+import itertools
+import random
+import shutil
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+import piece_codecs
+from node import Node
+from utils import generate_random_port
+
+# downloaders of every run get a directory of their own
+DOWNLOADER_IDS = itertools.count(101)
+
+
+def log_lines(size: int) -> bytes:
+    rng = random.Random(0)
+    lines = []
+    total = 0
+    while total < size:
+        line = (f"2026-10-17T{rng.randrange(24):02}:{rng.randrange(60):02}:{rng.randrange(60):02}.{rng.randrange(1000):03}Z "
+                f"{rng.choice(['INFO', 'INFO', 'INFO', 'DEBUG', 'WARNING'])} node{rng.randrange(100)} "
+                f"sent piece {rng.randrange(10000)} of file{rng.randrange(50)}.bin "
+                f"to 10.0.{rng.randrange(256)}.{rng.randrange(256)}:{rng.randrange(1024, 65536)} "
+                f"in {rng.random() * 20:.3f} ms\n").encode()
+        lines.append(line)
+        total += len(line)
+    return b"".join(lines)[:size]
+
+
+def throttle(endpoint, rate: float):
+    '''Delays the datagrams the endpoint sends as if they went through a link of rate bytes/s'''
+    loop = asyncio.get_running_loop()
+    send = endpoint.send
+    free_at = 0.0
+
+    def slow_send(data, addr):
+        nonlocal free_at
+        data = data if isinstance(data, (bytes, bytearray)) else b"".join(data)
+        free_at = max(free_at, loop.time()) + len(data) / rate
+        loop.call_at(free_at, send, data, addr)
+
+    endpoint.send = slow_send
+    endpoint.send_many = lambda datagrams, addr: [slow_send(data, addr) for data in datagrams]
+
+
+def count_received(endpoint, received: list):
+    datagram_received = endpoint.datagram_received
+
+    def counted_datagram_received(data, addr):
+        received[0] += len(data)
+        datagram_received(data, addr)
+
+    endpoint.datagram_received = counted_datagram_received
+
+
+async def run(size: int, rate: float) -> bool:
+    files = {"logs.txt": log_lines(size), "random.bin": os.urandom(size)}
+    seeder = Node(node_id=1, port=generate_random_port())
+    await seeder.start()
+    for filename, blob in files.items():
+        with open(f"{config.directory.node_files_dir}node1/{filename}", "wb") as f:
+            f.write(blob)
+        seeder.files.append(filename)
+        await seeder.set_send_mode(filename)
+    if rate:
+        throttle(seeder.endpoint, rate)
+    owner = ({'node_id': seeder.node_id, 'addr': ('127.0.0.1', seeder.endpoint.port)}, 0)
+
+    print(f"link of {f'{rate / 1e6:.0f} MB/s' if rate else 'loopback'}, files of {size / 1e6:.1f} MB "
+          f"(codecs: {', '.join(piece_codecs.CODEC_NAMES[c] for c in piece_codecs.available_codecs())})",
+          file=sys.stderr)
+    passed = True
+    for filename, blob in files.items():
+        for compression in (False, True):
+            piece_codecs.config.constants.COMPRESSION = compression
+            node_id = next(DOWNLOADER_IDS)
+            downloader = Node(node_id=node_id, port=generate_random_port())
+            await downloader.start()
+            received = [0]
+            count_received(downloader.endpoint, received)
+            start_time = time.perf_counter()
+            await downloader.split_file_owners(file_owners=[owner], filename=filename)
+            seconds = time.perf_counter() - start_time
+            path = f"{config.directory.node_files_dir}node{node_id}/{filename}"
+            intact = os.path.isfile(path) and open(path, "rb").read() == blob
+            passed &= intact
+            print(f"  {filename:<11} compression {'on ' if compression else 'off'} {seconds:6.2f}s "
+                  f"{size / seconds / 1e6:6.1f} MB/s  {received[0] / 1e6:6.2f} MB received  {'intact' if intact else 'FAILED'}",
+                  file=sys.stderr)
+            downloader.endpoint.close()
+    seeder.endpoint.close()
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-size', type=int, default=10_000_000, help='bytes of each file')
+    parser.add_argument('-rate', type=float, nargs='+', default=[20_000_000, 0],
+                        help='bytes/s the seeder sends at, 0 for no limit')
+    args = parser.parse_args()
+
+    # the nodes write their files and logs in the current directory
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            passed = all([asyncio.run(run(size=args.size, rate=rate)) for rate in args.rate])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(0 if passed else 1)
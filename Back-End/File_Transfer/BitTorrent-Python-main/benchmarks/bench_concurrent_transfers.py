@@ -0,0 +1,96 @@
+"""
+Concurrent downloads served by one node.
+
+One seeder node serves a file to many downloader nodes at the same time, all
+of them running on one event loop in this process. It reports the aggregate
+throughput and the threads and file descriptors of the process, which no
+longer grow with the number of transfers. The exit status is non-zero if a
+download is incomplete or corrupted.
+
+The pieces are as large as a loopback datagram allows; -datagram caps the
+datagrams to see what the piece size costs (e.g. 1472 for an ethernet path).
+
+    $ python3 benchmarks/bench_concurrent_transfers.py -downloaders 200 -size 1000000
+    $ python3 benchmarks/bench_concurrent_transfers.py -downloaders 20 -size 10000000 -datagram 1472 8972 65507
+"""
+import os
+import sys
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+from node import Node
+from utils import generate_random_port
+
+
+def open_fds() -> int:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:
+        return -1
+
+
+async def run(downloaders: int, size: int, datagram: int = None) -> bool:
+    blob = os.urandom(size)
+    seeder = Node(node_id=1, port=generate_random_port())
+    await seeder.start()
+    with open(f"{config.directory.node_files_dir}node1/blob.bin", "wb") as f:
+        f.write(blob)
+    seeder.files.append("blob.bin")
+    await seeder.set_send_mode("blob.bin")
+    owner = ({'node_id': seeder.node_id, 'addr': ('127.0.0.1', seeder.endpoint.port)}, 0)
+
+    nodes = [Node(node_id=100 + i, port=generate_random_port()) for i in range(downloaders)]
+    for n in nodes:
+        # in a real swarm each of them is a process of its own, here they share the hashing threads
+        n.hash_pool.shutdown()
+        n.hash_pool = seeder.hash_pool
+        n.path_mtu.max_datagram_size = datagram
+        await n.start()
+    threads_before, fds_before = threading.active_count(), open_fds()
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(n.split_file_owners(file_owners=[owner], filename="blob.bin") for n in nodes))
+    seconds = time.perf_counter() - start_time
+
+    digest = hashlib.sha256(blob).digest()
+    intact = 0
+    for n in nodes:
+        path = f"{config.directory.node_files_dir}node{n.node_id}/blob.bin"
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                intact += hashlib.sha256(f.read()).digest() == digest
+    print(f"{downloaders} downloads of {size} bytes with datagrams of {datagram or 'any'} bytes in {seconds:.2f}s: "
+          f"{downloaders * size / seconds / 1e6:.1f} MB/s aggregate, {intact}/{downloaders} intact", file=sys.stderr)
+    print(f"threads: {threads_before} -> {threading.active_count()}, "
+          f"open fds: {fds_before} -> {open_fds()}", file=sys.stderr)
+    for n in [seeder] + nodes:
+        n.endpoint.close()
+    return intact == downloaders
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-downloaders', type=int, default=100, help='nodes downloading the file at the same time')
+    parser.add_argument('-size', type=int, default=1_000_000, help='bytes of the file')
+    parser.add_argument('-datagram', type=int, nargs='+', default=[None], help='largest datagrams sent, in bytes')
+    args = parser.parse_args()
+
+    # the nodes write their files and logs in the current directory
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            passed = all([asyncio.run(run(downloaders=args.downloaders, size=args.size, datagram=datagram))
+                          for datagram in args.datagram])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,107 @@
+"""
+Bytes downloaded for a new version of a file the downloader has an old version of.
+
+The downloader holds a file; the seeder has a new version of it, with some
+bytes inserted, removed and overwritten here and there. The new version is
+downloaded with and without content-defined chunk reuse (CHUNK_DEDUP, see
+chunk_store.py). It reports the piece bytes received, the time, and whether
+the downloaded file is intact.
+
+    $ python3 benchmarks/bench_dedup.py -size 20000000 -edits 20
+"""
+import os
+import sys
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import random
+import shutil
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+import node as node_module
+from node import Node
+from utils import generate_random_port
+
+
+def new_version(old: bytes, edits: int, rng: random.Random) -> bytes:
+    data = bytearray(old)
+    for _ in range(edits):
+        offset = rng.randrange(len(data))
+        length = rng.randrange(1, 4096)
+        kind = rng.choice(("insert", "remove", "overwrite"))
+        if kind == "insert":
+            data[offset: offset] = os.urandom(length)
+        elif kind == "remove":
+            del data[offset: offset + length]
+        else:
+            data[offset: offset + length] = os.urandom(len(data[offset: offset + length]))
+    return bytes(data)
+
+
+async def run(old: bytes, new: bytes, dedup: bool) -> bool:
+    node_module.config.constants.CHUNK_DEDUP = dedup
+    seeder = Node(node_id=1, port=generate_random_port())
+    await seeder.start()
+    with open(f"{config.directory.node_files_dir}node1/data-v2.bin", "wb") as f:
+        f.write(new)
+    seeder.files.append("data-v2.bin")
+    await seeder.set_send_mode("data-v2.bin")
+    owner = ({'node_id': seeder.node_id, 'addr': ('127.0.0.1', seeder.endpoint.port)}, 0)
+
+    node_id = 3 if dedup else 2
+    downloader = Node(node_id=node_id, port=generate_random_port())
+    with open(f"{config.directory.node_files_dir}node{node_id}/data-v1.bin", "wb") as f:
+        f.write(old)
+    downloader.files.append("data-v1.bin")
+    await downloader.start()
+    if dedup:
+        # the downloader has been up for a while: its files are indexed
+        await downloader.indexing
+
+    received = 0
+    datagram_received = downloader.endpoint.datagram_received
+
+    def counted_datagram_received(data, addr):
+        nonlocal received
+        received += len(data)
+        datagram_received(data, addr)
+
+    downloader.endpoint.datagram_received = counted_datagram_received
+    start_time = time.perf_counter()
+    await downloader.split_file_owners(file_owners=[owner], filename="data-v2.bin")
+    seconds = time.perf_counter() - start_time
+
+    path = f"{config.directory.node_files_dir}node{node_id}/data-v2.bin"
+    intact = False
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            intact = hashlib.sha256(f.read()).digest() == hashlib.sha256(new).digest()
+    print(f"chunk reuse {'on ' if dedup else 'off'}: {received / 1e6:7.2f} MB received in {seconds:.2f}s, "
+          f"{'intact' if intact else 'CORRUPTED'}", file=sys.stderr)
+    for n in (seeder, downloader):
+        n.endpoint.close()
+    return intact
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-size', type=int, default=20_000_000, help='bytes of the file')
+    parser.add_argument('-edits', type=int, default=20, help='edits between the two versions')
+    args = parser.parse_args()
+
+    old = os.urandom(args.size)
+    new = new_version(old, args.edits, random.Random(0))
+    # the nodes write their files and logs in the current directory
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            passed = all([asyncio.run(run(old, new, dedup=dedup)) for dedup in (False, True)])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(0 if passed else 1)
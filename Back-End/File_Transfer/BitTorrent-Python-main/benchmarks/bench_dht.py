@@ -0,0 +1,193 @@
+"""
+Load of the tracker and latency of the searches, with the tracker and with the DHT, against the number of nodes.
+
+The tracker runs in a child process (in a temporary directory, so that its
+database and logs don't touch the real ones), and the nodes in -procs worker
+processes, each of them running its share of the nodes on one event loop. A
+node is an endpoint and its DHT, the parts of Node which announce and search
+the files. For every node count, in each mode:
+- the nodes enter the torrent (REGISTER); with the DHT they then join it
+  (BOOTSTRAP and a lookup of their own key) and look up their key once more,
+  as they do periodically,
+- every node announces FILES_PER_NODE files of its own: to the tracker (OWN),
+  or as records on the DHT,
+- every node searches SEARCHES_PER_NODE files of random other nodes,
+  SEARCH_CONCURRENCY at a time per process.
+It reports the requests the tracker handled in the whole run, the latency of
+the searches, the requests a DHT search sends to the nodes, and the searches
+which found the owner of their file.
+
+    $ python3 benchmarks/bench_dht.py -nodes 50 200 800 -procs 4
+"""
+import os
+import sys
+import argparse
+import asyncio
+import contextlib
+import multiprocessing
+import random
+import shutil
+import statistics
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+from dht import DHT
+from endpoint import Endpoint
+from messages.node2tracker import Node2Tracker
+from shard_map import ShardMap
+from utils import generate_random_port
+import tracker
+
+FILES_PER_NODE = 2
+SEARCHES_PER_NODE = 4
+SEARCH_CONCURRENCY = 16
+JOIN_CONCURRENCY = 32
+
+
+def run_tracker(work_dir: str, shard_map: ShardMap, handled):
+    os.chdir(work_dir)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        t = tracker.Tracker(shard_index=0, shard_map=shard_map)
+        handle_node_request = t.handle_node_request
+
+        def counted_handle_node_request(data: bytes, addr: tuple):
+            with handled.get_lock():
+                handled.value += 1
+            handle_node_request(data=data, addr=addr)
+
+        t.handle_node_request = counted_handle_node_request
+        t.listen()
+
+
+async def gather_bounded(limit: int, coros):
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(bounded(coro) for coro in coros))
+
+
+async def simulate_nodes(node_ids: list, nodes: int, use_dht: bool, registry: tuple, barrier) -> dict:
+    loop = asyncio.get_running_loop()
+    modes = config.tracker_requests_mode
+    endpoints = {}
+    dhts = {}
+    for node_id in node_ids:
+        endpoint = Endpoint(port=generate_random_port(), on_request=lambda msg, addr, node_id=node_id: dhts[node_id].handle(msg, addr))
+        await endpoint.open()
+        endpoints[node_id] = endpoint
+        dhts[node_id] = DHT(endpoint=endpoint, node_id=node_id, registry=registry)
+
+    async def wait_barrier():
+        # the event loop keeps answering the requests of the other processes meanwhile
+        await loop.run_in_executor(None, barrier.wait)
+
+    # 1. the nodes enter the torrent, and join the DHT
+    for node_id in node_ids:
+        endpoints[node_id].send(Node2Tracker(node_id=node_id, mode=modes.REGISTER, filename="").encode(), registry)
+    await wait_barrier()
+    if use_dht:
+        await gather_bounded(JOIN_CONCURRENCY, (dhts[node_id].bootstrap() for node_id in node_ids))
+        await wait_barrier()
+        await gather_bounded(JOIN_CONCURRENCY, (dhts[node_id].lookup(dhts[node_id].key) for node_id in node_ids))
+    await wait_barrier()
+
+    # 2. they announce their files, and search files of the others
+    for node_id in node_ids:
+        for j in range(FILES_PER_NODE):
+            filename = f"file{node_id}-{j}"
+            if use_dht:
+                await dhts[node_id].announce(filename)
+            else:
+                endpoints[node_id].send(Node2Tracker(node_id=node_id, mode=modes.OWN, filename=filename).encode(),
+                                        registry)
+    await wait_barrier()
+    # the announcements to the tracker are not answered, it may still be handling them
+    await asyncio.sleep(0.5)
+
+    rand = random.Random(node_ids[0])
+    latencies = []
+    found = 0
+    rpcs = []
+
+    async def search(node_id: int, owner_id: int):
+        nonlocal found
+        filename = f"file{owner_id}-{rand.randrange(FILES_PER_NODE)}"
+        rpc_count = dhts[node_id].rpc_count
+        start_time = time.perf_counter()
+        if use_dht:
+            owners = await dhts[node_id].find_owners(filename)
+        else:
+            reply = await endpoints[node_id].request(Node2Tracker(node_id=node_id, mode=modes.NEED, filename=filename),
+                                                     registry)
+            owners = [(owner['node_id'], owner['addr']) for owner, _ in reply['search_result']] if reply else []
+        latencies.append(time.perf_counter() - start_time)
+        rpcs.append(dhts[node_id].rpc_count - rpc_count)
+        found += any(owner_node_id == owner_id for owner_node_id, _ in owners)
+
+    searches = [(node_id, rand.choice([other for other in range(nodes) if other != node_id]))
+                for node_id in node_ids for _ in range(SEARCHES_PER_NODE)]
+    await gather_bounded(SEARCH_CONCURRENCY, (search(node_id, owner_id) for node_id, owner_id in searches))
+    await wait_barrier()
+    for endpoint in endpoints.values():
+        endpoint.close()
+    return {"latencies": latencies, "found": found, "rpcs": rpcs}
+
+
+def run_worker(node_ids: list, nodes: int, use_dht: bool, registry: tuple, barrier, results):
+    results.put(asyncio.run(simulate_nodes(node_ids, nodes, use_dht, registry, barrier)))
+
+
+def measure(nodes: int, procs: int, use_dht: bool) -> dict:
+    work_dir = tempfile.mkdtemp()
+    registry = ("localhost", generate_random_port())
+    handled = multiprocessing.Value("q", 0)
+    tracker_process = multiprocessing.Process(target=run_tracker, args=(work_dir, ShardMap([registry]), handled),
+                                              daemon=True)
+    tracker_process.start()
+    time.sleep(0.5)
+
+    barrier = multiprocessing.Barrier(procs)
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_worker,
+                                       args=(list(range(i, nodes, procs)), nodes, use_dht, registry, barrier, results))
+               for i in range(procs)]
+    for worker in workers:
+        worker.start()
+    try:
+        worker_results = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+    finally:
+        tracker_process.terminate()
+        tracker_process.join()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    latencies = sorted(latency for r in worker_results for latency in r["latencies"])
+    return {"tracker": handled.value,
+            "p50": latencies[len(latencies) // 2] * 1000,
+            "p95": latencies[int(len(latencies) * 0.95)] * 1000,
+            "rpcs": statistics.mean(rpc for r in worker_results for rpc in r["rpcs"]),
+            "found": sum(r["found"] for r in worker_results) / len(latencies) * 100}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-nodes', type=int, nargs='+', default=[50, 200, 800])
+    parser.add_argument('-procs', type=int, default=4, help='worker processes which run the nodes')
+    args = parser.parse_args()
+
+    header = (f"{'nodes':>6}{'mode':>9}{'tracker reqs':>14}{'per node':>10}"
+              f"{'p50 ms':>9}{'p95 ms':>9}{'reqs/search':>13}{'found':>8}")
+    print(header)
+    print("-" * len(header))
+    for nodes in args.nodes:
+        for use_dht in (False, True):
+            r = measure(nodes=nodes, procs=args.procs, use_dht=use_dht)
+            print(f"{nodes:>6}{'dht' if use_dht else 'tracker':>9}{r['tracker']:>14}{r['tracker'] / nodes:>10.1f}"
+                  f"{r['p50']:>9.2f}{r['p95']:>9.2f}{r['rpcs']:>13.1f}{r['found']:>7.1f}%")
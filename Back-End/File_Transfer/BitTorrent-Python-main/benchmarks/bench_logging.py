@@ -0,0 +1,74 @@
+"""
+Cost per call of the logging of the transfer hot paths.
+
+It compares the old utils.log (which checked and opened the log file and
+printed on every call), the buffered log() and the rate-limited progress log
+which replaced the log of every sent piece. It runs in a temporary directory
+and the terminal output is discarded.
+
+    $ python3 benchmarks/bench_logging.py -calls 20000
+"""
+import os
+import sys
+import argparse
+import contextlib
+import shutil
+import tempfile
+import time
+from datetime import datetime
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+import utils
+
+
+def unbuffered_log(node_id: int, content: str, is_tracker=False) -> None:
+    '''The utils.log before the buffered logger'''
+    if not os.path.exists(config.directory.logs_dir):
+        os.makedirs(config.directory.logs_dir)
+    now = datetime.now()
+    current_time = now.strftime("%H:%M:%S")
+    content = f"[{current_time}]  {content}\n"
+    print(content)
+    node_logs_filename = config.directory.logs_dir + 'node' + str(node_id) + '.log'
+    if not os.path.exists(node_logs_filename):
+        with open(node_logs_filename, 'w') as f:
+            f.write(content)
+    else:
+        with open(node_logs_filename, 'a') as f:
+            f.write(content)
+
+
+def measure(calls: int, call) -> float:
+    start_time = time.perf_counter()
+    for idx in range(calls):
+        call(idx)
+    return (time.perf_counter() - start_time) / calls * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-calls', type=int, default=20000)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    progress = utils.ProgressLog(node_id=1, total=args.calls, describe=lambda sent, total: f"{sent}/{total} sent")
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results = {
+                "unbuffered log": measure(args.calls, lambda idx: unbuffered_log(1, f"The {idx}/{args.calls} has been sent!")),
+                "buffered log": measure(args.calls, lambda idx: utils.log(1, f"The {idx}/{args.calls} has been sent!")),
+                "progress log": measure(args.calls, lambda idx: progress.step()),
+            }
+            # lets the writer thread finish its batch before leaving the directory
+            time.sleep(2 * config.constants.LOG_FLUSH_INTERVAL)
+            utils.logger.flush()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for name, cost in results.items():
+        print(f"{name:<16}{cost:>10.2f} us/call")
@@ -0,0 +1,120 @@
+"""
+Downloads from a swarm where one owner is much slower than the others.
+
+Four seeders own the same files; one of them sends at -slow_rate bytes/s
+(its datagrams are delayed as by a slow link), and it has the highest send
+frequency, so ranking the owners by send frequency always picks it. The
+same file is downloaded:
+- with the owners ranked by send frequency, as before peer_stats.py,
+- by a node which knows nothing about the peers yet: it measures them while it
+  downloads, and the slow one leaves its blocks to the others,
+- by that node again (another file): the slow peer is not chosen anymore.
+It reports the time of each download and the bytes each owner sent.
+
+    $ python3 benchmarks/bench_peer_selection.py -size 10000000 -slow_rate 2000000
+"""
+import os
+import sys
+import argparse
+import asyncio
+import contextlib
+import shutil
+import tempfile
+import time
+from collections import defaultdict
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+from node import Node
+from utils import generate_random_port
+
+SEEDERS = 4
+SLOW_SEEDER = 1
+
+
+def throttle(endpoint, rate: float):
+    '''Delays the datagrams the endpoint sends as if they went through a link of rate bytes/s'''
+    loop = asyncio.get_running_loop()
+    send = endpoint.send
+    free_at = 0.0
+
+    def slow_send(data, addr):
+        nonlocal free_at
+        data = data if isinstance(data, (bytes, bytearray)) else b"".join(data)
+        free_at = max(free_at, loop.time()) + len(data) / rate
+        loop.call_at(free_at, send, data, addr)
+
+    endpoint.send = slow_send
+    endpoint.send_many = lambda datagrams, addr: [slow_send(data, addr) for data in datagrams]
+
+
+async def download(downloader: Node, owners: list, filename: str, label: str):
+    sent = defaultdict(int)
+    receive_chunk = downloader.receive_chunk
+
+    async def counted_receive_chunk(filename, range, file_owner):
+        is_received = await receive_chunk(filename, range, file_owner)
+        if is_received:
+            sent[file_owner[0]['node_id']] += range[1] - range[0]
+        return is_received
+
+    downloader.receive_chunk = counted_receive_chunk
+    start_time = time.perf_counter()
+    await downloader.split_file_owners(file_owners=owners, filename=filename)
+    seconds = time.perf_counter() - start_time
+    downloader.receive_chunk = receive_chunk
+    complete = os.path.isfile(f"{config.directory.node_files_dir}node{downloader.node_id}/{filename}")
+    shares = ", ".join(f"node{peer}{' (slow)' if peer == SLOW_SEEDER else ''}: {sent[peer] / 1e6:.1f} MB"
+                       for peer in sorted(sent))
+    print(f"{label:<28}{seconds:6.2f}s  {'complete' if complete else 'FAILED'}  {shares}", file=sys.stderr)
+    return complete
+
+
+async def run(size: int, slow_rate: float) -> bool:
+    files = {"file-a.bin": os.urandom(size), "file-b.bin": os.urandom(size)}
+    seeders = []
+    for node_id in range(1, SEEDERS + 1):
+        seeder = Node(node_id=node_id, port=generate_random_port())
+        await seeder.start()
+        for filename, blob in files.items():
+            with open(f"{config.directory.node_files_dir}node{node_id}/{filename}", "wb") as f:
+                f.write(blob)
+            seeder.files.append(filename)
+            await seeder.set_send_mode(filename)
+        seeders.append(seeder)
+    throttle(seeders[SLOW_SEEDER - 1].endpoint, slow_rate)
+    # the slow seeder has sent the most so far
+    owners = [({'node_id': s.node_id, 'addr': ('127.0.0.1', s.endpoint.port)}, 100 if s.node_id == SLOW_SEEDER else 10)
+              for s in seeders]
+
+    by_send_freq = Node(node_id=100, port=generate_random_port())
+    by_send_freq.peer_stats.rank = lambda owners, nbytes: sorted(owners, key=lambda x: x[1], reverse=True)
+    by_send_freq.peer_stats.is_slow = lambda peer, peers, nbytes: False
+    measured = Node(node_id=101, port=generate_random_port())
+    for n in (by_send_freq, measured):
+        await n.start()
+
+    passed = await download(by_send_freq, owners, "file-a.bin", "ranked by send frequency")
+    passed &= await download(measured, owners, "file-a.bin", "measured, first download")
+    passed &= await download(measured, owners, "file-b.bin", "measured, second download")
+    for n in seeders + [by_send_freq, measured]:
+        n.endpoint.close()
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-size', type=int, default=10_000_000, help='bytes of each file')
+    parser.add_argument('-slow_rate', type=float, default=2_000_000, help='bytes/s sent by the slow seeder')
+    args = parser.parse_args()
+
+    # the nodes write their files and logs in the current directory
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            passed = asyncio.run(run(size=args.size, slow_rate=args.slow_rate))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,96 @@
+"""
+A download interrupted by the death of its node, resumed from its bitfield or started over.
+
+In a swarm (see swarm.py) of -seeders seeders and one downloader, whose links
+send -rate bytes/s each, the downloader gets a file of -size bytes and is
+restarted (``Swarm.restart()``) once it holds -at of the pieces; it then
+downloads the file again:
+- resumed: the part file and its bitfield are kept (see download_sink.py),
+- started over: the bitfield is removed before the restart, as if the
+  download kept its progress in memory only.
+It reports the bytes the downloader received before and after the restart,
+and the time the download took after it. The exit status is non-zero if a
+file is incomplete or corrupted.
+
+    $ python3 benchmarks/bench_resume.py -size 50000000 -at 0.6
+"""
+import os
+import sys
+import argparse
+import asyncio
+import contextlib
+import shutil
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+from download_sink import BITFIELD_SUFFIX
+from swarm import Swarm
+
+
+def received_bytes(node) -> int:
+    return sum(node.received_bytes.values.values())
+
+
+async def run(size: int, seeders: int, rate: float, at: float, resume: bool) -> bool:
+    swarm = Swarm(nodes=seeders + 1, link={"rate": rate})
+    await swarm.start()
+    try:
+        blob = os.urandom(size)
+        for index in range(seeders):
+            await swarm.seed(index, "blob.bin", blob)
+        downloader = seeders
+        node = swarm.nodes[downloader]
+        start_time = time.perf_counter()
+        task = asyncio.ensure_future(swarm.download(downloader, "blob.bin"))
+        # it dies once it holds the given share of the pieces
+        while True:
+            sink = node.downloaded_files.get("blob.bin")
+            if sink is not None and sink.verifier.verified.count(1) >= at * sink.verifier.manifest.pieces_count:
+                break
+            if task.done():
+                break
+            await asyncio.sleep(0.01)
+        before = received_bytes(node)
+        seconds_before = time.perf_counter() - start_time
+        await swarm.restart(downloader, task)
+        if not resume:
+            os.remove(swarm.file_path(downloader, "blob.bin") + BITFIELD_SUFFIX)
+
+        node = swarm.nodes[downloader]
+        start_time = time.perf_counter()
+        result = await swarm.download(downloader, "blob.bin")
+        seconds_after = time.perf_counter() - start_time
+        after = received_bytes(node)
+    finally:
+        await swarm.close()
+    print(f"{'resumed' if resume else 'started over':<14}{before / 1e6:>9.1f} MB in {seconds_before:5.2f}s"
+          f"{after / 1e6:>9.1f} MB in {seconds_after:5.2f}s  {(before + after) / size * 100:6.1f}% of the file"
+          f"  {'intact' if result['intact'] else 'FAILED'}", file=sys.stderr)
+    return result["intact"]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-size', type=int, default=50_000_000, help='bytes of the file')
+    parser.add_argument('-seeders', type=int, default=2)
+    parser.add_argument('-rate', type=float, default=20_000_000, help='bytes/s sent by each node')
+    parser.add_argument('-at', type=float, default=0.6, help='share of the pieces downloaded when the node dies')
+    args = parser.parse_args()
+
+    print(f"{'':<14}{'before the restart':>24}{'after the restart':>23}  received", file=sys.stderr)
+    passed = True
+    for resume in (True, False):
+        # every run has a directory of its own, the nodes start without any file
+        work_dir = tempfile.mkdtemp(dir=os.getcwd())
+        os.chdir(work_dir)
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                passed &= asyncio.run(run(size=args.size, seeders=args.seeders, rate=args.rate, at=args.at,
+                                          resume=resume))
+        finally:
+            os.chdir("..")
+            shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,99 @@
+"""
+Downloads in a whole swarm (tracker and nodes in this process, see swarm.py) on clean and impaired paths.
+
+In every scenario a fresh swarm of -nodes nodes starts, -seeders of them
+seed a file of -size bytes, and the others download it, one every -interval
+seconds (all at once by default), and serve it as soon as they have it.
+The datagrams every node sends go through the path of the scenario. It
+reports the aggregate throughput, the percentiles of the completion times of
+the downloads, the bytes put on the wire beyond the file (headers, acks,
+retransmissions, requests) and the datagrams dropped by the path. The exit
+status is non-zero if a download is incomplete or corrupted, so it can be
+run before and after a change of the transport or of the scheduling; -json
+writes the results to compare them.
+
+    $ python3 benchmarks/bench_swarm.py -nodes 8 -size 5000000
+"""
+import os
+import sys
+import argparse
+import asyncio
+import contextlib
+import json
+import shutil
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from swarm import Swarm
+
+# name -> parameters of the path (see netem.ImpairedLink)
+SCENARIOS = {
+    "clean": {},
+    "1% loss": {"loss": 0.01},
+    "5% loss + reorder + dup": {"loss": 0.05, "reorder": 0.05, "duplicate": 0.02},
+    "10ms delay, 2ms jitter": {"delay": 0.01, "jitter": 0.002},
+    "20 MB/s links": {"rate": 20_000_000},
+}
+
+
+async def run_scenario(link: dict, nodes: int, seeders: int, size: int, interval: float, seed: int) -> dict:
+    swarm = Swarm(nodes=nodes, link=link, seed=seed)
+    await swarm.start()
+    try:
+        blob = os.urandom(size)
+        for index in range(seeders):
+            await swarm.seed(index, "blob.bin", blob)
+        script = [(i * interval, index, "blob.bin") for i, index in enumerate(range(seeders, nodes))]
+        return await swarm.run(script)
+    finally:
+        await swarm.close()
+
+
+def run(args) -> bool:
+    header = (f"{'scenario':<26}{'MB/s':>8}{'p50 s':>8}{'p90 s':>8}{'max s':>8}"
+              f"{'overhead':>10}{'dropped':>9}  result")
+    print(header)
+    print("-" * len(header))
+    results = {}
+    all_passed = True
+    for name in args.scenarios:
+        # every swarm has a directory of its own, its nodes start without any file
+        os.makedirs(str(len(results)))
+        os.chdir(str(len(results)))
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            r = asyncio.run(run_scenario(SCENARIOS[name], args.nodes, args.seeders, args.size, args.interval, args.seed))
+        os.chdir("..")
+        passed = r["intact"] == len(r["downloads"])
+        all_passed &= passed
+        results[name] = r
+        print(f"{name:<26}{r['throughput'] / 1e6:>8.1f}{r['p50']:>8.2f}{r['p90']:>8.2f}{r['max']:>8.2f}"
+              f"{r['overhead'] * 100:>9.1f}%{r['dropped']:>9}  "
+              f"{'OK' if passed else 'FAILED'} ({r['intact']}/{len(r['downloads'])})")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return all_passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-nodes', type=int, default=8, help='nodes of the swarm, seeders included')
+    parser.add_argument('-seeders', type=int, default=1)
+    parser.add_argument('-size', type=int, default=5_000_000, help='bytes of the file')
+    parser.add_argument('-interval', type=float, default=0.0, help='seconds between the starts of the downloads')
+    parser.add_argument('-scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('-seed', type=int, default=7)
+    parser.add_argument('-json', help='file the results are written to')
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    # the nodes write their files and logs in the current directory
+    work_dir = tempfile.mkdtemp(dir=os.getcwd())
+    os.chdir(work_dir)
+    try:
+        passed = run(args)
+    finally:
+        os.chdir("..")
+        shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,188 @@
+"""
+Requests per second served by the tracker, against the number of nodes.
+
+The tracker runs in child processes, one per shard on consecutive loopback
+ports (in a temporary directory, so that its database and logs don't touch
+the real ones). Every request is sent to its shard, as the nodes do (see
+shard_map.py), and the heartbeats go to the registry. For every node count, the nodes
+register and announce FILES_PER_NODE files each. Then searches are sent in a
+closed loop with WINDOW of them outstanding, while the heartbeats of all the
+nodes come in at their real rate (one per node every NODE_TIME_INTERVAL). It
+reports the searches answered per second, their latency, and how many were
+never answered.
+
+    $ python3 benchmarks/bench_tracker.py -nodes 10 100 1000 10000 -shards 1 4
+"""
+import os
+import sys
+import argparse
+import contextlib
+import multiprocessing
+import random
+import selectors
+import shutil
+import socket
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+from messages.message import Message
+from messages.node2tracker import Node2Tracker
+from shard_map import ShardMap
+import tracker
+
+FILES_PER_NODE = 10
+OWNERS_PER_FILE = 5
+CLIENT_SOCKETS = 16     # the simulated nodes share these sockets, they are told apart by their node_id
+LOST_AFTER = 1.0        # a search which is not answered within this many seconds is counted as lost
+
+
+def run_tracker(work_dir: str, shard_index: int, shard_map: ShardMap):
+    os.chdir(work_dir)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        tracker.Tracker(shard_index=shard_index, shard_map=shard_map).listen()
+
+
+def client_socket() -> socket.socket:
+    sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    sock.bind(('localhost', 0))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+    sock.setblocking(False)
+    return sock
+
+
+def send(sock: socket.socket, msg, addr: tuple) -> bool:
+    try:
+        sock.sendto(msg.encode(), addr)
+        return True
+    except BlockingIOError:
+        return False
+
+
+def barrier(sock: socket.socket, selector, addr: tuple):
+    '''
+    Waits until the shard has handled everything sent before: it handles the
+    datagrams in order, so it is done with them once it answers a search sent after them.
+    '''
+    msg = Node2Tracker(node_id=0, mode=config.tracker_requests_mode.NEED, filename="")
+    msg.req_id = 0
+    while True:
+        send(sock, msg, addr)
+        deadline = time.monotonic() + LOST_AFTER
+        while time.monotonic() < deadline:
+            for key, _ in selector.select(timeout=0.01):
+                try:
+                    data, _ = key.fileobj.recvfrom(config.constants.BUFFER_SIZE)
+                except BlockingIOError:
+                    continue
+                if Message.decode(data)["req_id"] == 0:
+                    return
+
+
+def measure(nodes: int, shards: int, seconds: float, window: int) -> dict:
+    work_dir = tempfile.mkdtemp()
+    host, port = config.constants.TRACKER_ADDR
+    shard_map = ShardMap([(host, port + i) for i in range(shards)])
+    processes = [multiprocessing.Process(target=run_tracker, args=(work_dir, i, shard_map), daemon=True)
+                 for i in range(shards)]
+    for process in processes:
+        process.start()
+    time.sleep(0.5)
+    socks = [client_socket() for _ in range(CLIENT_SOCKETS)]
+    selector = selectors.DefaultSelector()
+    for sock in socks:
+        selector.register(sock, selectors.EVENT_READ)
+    files_count = max(1, nodes * FILES_PER_NODE // OWNERS_PER_FILE)
+    modes = config.tracker_requests_mode
+    try:
+        # 1. the nodes enter the torrent and announce their files
+        for node_id in range(nodes):
+            sock = socks[node_id % CLIENT_SOCKETS]
+            send(sock, Node2Tracker(node_id=node_id, mode=modes.REGISTER, filename=""), shard_map.registry)
+            for j in range(FILES_PER_NODE):
+                filename = f"file{(node_id * FILES_PER_NODE + j) % files_count}"
+                while not send(sock, Node2Tracker(node_id=node_id, mode=modes.OWN, filename=filename),
+                               shard_map.shard_of(filename)):
+                    time.sleep(0.001)
+            if node_id % 20 == 19:
+                # announcements are not answered, so we wait for the tracker not to outrun it
+                for shard in shard_map.shards:
+                    barrier(sock, selector, shard)
+        for shard in shard_map.shards:
+            barrier(socks[0], selector, shard)
+
+        # 2. searches in a closed loop, with the heartbeats of the nodes in the background
+        rand = random.Random(1)
+        outstanding = {}    # req_id -> time it was sent
+        latencies = []
+        lost = 0
+        next_req_id = 1
+        heartbeat_interval = config.constants.NODE_TIME_INTERVAL / nodes
+        next_heartbeat = time.monotonic()
+        heartbeats = 0
+        start_time = time.monotonic()
+        end_time = start_time + seconds
+        while True:
+            now = time.monotonic()
+            if now >= end_time:
+                break
+            while len(outstanding) < window:
+                filename = f"file{rand.randrange(files_count)}"
+                msg = Node2Tracker(node_id=rand.randrange(nodes), mode=modes.NEED, filename=filename)
+                msg.req_id = next_req_id
+                if not send(socks[next_req_id % CLIENT_SOCKETS], msg, shard_map.shard_of(filename)):
+                    break
+                outstanding[next_req_id] = now
+                next_req_id += 1
+            while next_heartbeat <= now:
+                node_id = heartbeats % nodes
+                send(socks[node_id % CLIENT_SOCKETS], Node2Tracker(node_id=node_id, mode=modes.REGISTER, filename=""),
+                     shard_map.registry)
+                heartbeats += 1
+                next_heartbeat += heartbeat_interval
+            for key, _ in selector.select(timeout=0.01):
+                while True:
+                    try:
+                        data, _ = key.fileobj.recvfrom(config.constants.BUFFER_SIZE)
+                    except BlockingIOError:
+                        break
+                    sent_at = outstanding.pop(Message.decode(data)["req_id"], None)
+                    if sent_at is not None:
+                        latencies.append(time.monotonic() - sent_at)
+            now = time.monotonic()
+            for req_id in [r for r, sent_at in outstanding.items() if now - sent_at > LOST_AFTER]:
+                del outstanding[req_id]
+                lost += 1
+        elapsed = time.monotonic() - start_time
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+        for sock in socks:
+            sock.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    latencies.sort()
+    return {"rps": len(latencies) / elapsed,
+            "p50": latencies[len(latencies) // 2] * 1000 if latencies else float("nan"),
+            "p99": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float("nan"),
+            "lost": lost,
+            "heartbeats": heartbeats}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-nodes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('-shards', type=int, nargs='+', default=[1], help='numbers of tracker shards to measure')
+    parser.add_argument('-seconds', type=float, default=5, help='duration of the searches for each node count')
+    parser.add_argument('-window', type=int, default=32, help='searches outstanding at a time')
+    args = parser.parse_args()
+
+    header = f"{'shards':>7}{'nodes':>7}{'searches/s':>12}{'p50 ms':>9}{'p99 ms':>9}{'lost':>7}{'heartbeats':>12}"
+    print(header)
+    print("-" * len(header))
+    for shards in args.shards:
+        for nodes in args.nodes:
+            r = measure(nodes=nodes, shards=shards, seconds=args.seconds, window=args.window)
+            print(f"{shards:>7}{nodes:>7}{r['rps']:>12.0f}{r['p50']:>9.2f}{r['p99']:>9.2f}{r['lost']:>7}{r['heartbeats']:>12}")
@@ -0,0 +1,123 @@
+"""
+Microbenchmark of the tracker ownership index against the old list of JSON strings.
+
+Every node announces FILES_PER_NODE files, picked so that every file has about
+the same number of owners. It then reports the time per announce, per search
+(building the search result, as `Tracker.search_file` does) and per removal of
+a node, for both structures. The old removal scans every file of the torrent,
+so only a few of them are timed.
+
+    $ python3 benchmarks/bench_tracker_index.py -files 100000 -nodes 10000
+"""
+import os
+import sys
+import argparse
+import json
+import random
+import time
+from collections import defaultdict
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracker_index import OwnershipIndex
+
+FILES_PER_NODE = 50
+ADDR_HOST = '127.0.0.1'
+
+
+class JsonOwnersList:
+    """The file_owners_list of the tracker before the index, as it was used by the tracker."""
+    def __init__(self):
+        self.file_owners_list = defaultdict(list)
+
+    def add(self, filename: str, owner: tuple):
+        entry = {'node_id': owner[0], 'addr': owner[1]}
+        self.file_owners_list[filename].append(json.dumps(entry))
+        self.file_owners_list[filename] = list(set(self.file_owners_list[filename]))
+
+    def search(self, filename: str, send_freq_list: dict) -> list:
+        matched_entries = []
+        for json_entry in self.file_owners_list[filename]:
+            entry = json.loads(json_entry)
+            matched_entries.append((entry, send_freq_list[entry['node_id']]))
+        return matched_entries
+
+    def remove_owner(self, owner: tuple):
+        entry = {'node_id': owner[0], 'addr': owner[1]}
+        node_files = self.file_owners_list.copy()
+        for nf in node_files:
+            if json.dumps(entry) in self.file_owners_list[nf]:
+                self.file_owners_list[nf].remove(json.dumps(entry))
+            if len(self.file_owners_list[nf]) == 0:
+                self.file_owners_list.pop(nf)
+
+
+class IndexOwnersList:
+    def __init__(self):
+        self.index = OwnershipIndex()
+
+    def add(self, filename: str, owner: tuple):
+        self.index.add(filename=filename, owner=owner)
+
+    def search(self, filename: str, send_freq_list: dict) -> list:
+        return [({'node_id': node_id, 'addr': node_addr}, send_freq_list[node_id])
+                for node_id, node_addr in self.index.owners_of(filename)]
+
+    def remove_owner(self, owner: tuple):
+        self.index.remove_owner(owner)
+
+
+def announces(files: int, nodes: int) -> list:
+    owners = []
+    for node_id in range(nodes):
+        owner = (node_id, (ADDR_HOST, 20000 + node_id % 40000))
+        for j in range(FILES_PER_NODE):
+            owners.append((f"file{(node_id * FILES_PER_NODE + j) % files}", owner))
+    return owners
+
+
+def measure(structure, owners: list, files: int, nodes: int, searches: int, removals: int) -> dict:
+    rand = random.Random(1)
+    send_freq_list = defaultdict(int)
+
+    start_time = time.perf_counter()
+    for filename, owner in owners:
+        structure.add(filename, owner)
+    announce_time = (time.perf_counter() - start_time) / len(owners)
+
+    names = [f"file{rand.randrange(files)}" for _ in range(searches)]
+    start_time = time.perf_counter()
+    results = 0
+    for filename in names:
+        results += len(structure.search(filename, send_freq_list))
+    search_time = (time.perf_counter() - start_time) / searches
+
+    removed = [owners[node_id * FILES_PER_NODE][1] for node_id in rand.sample(range(nodes), removals)]
+    start_time = time.perf_counter()
+    for owner in removed:
+        structure.remove_owner(owner)
+    remove_time = (time.perf_counter() - start_time) / removals
+
+    return {"announce": announce_time * 1e6,
+            "search": search_time * 1e6,
+            "remove": remove_time * 1e6,
+            "owners": results / searches}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-files', type=int, default=100000)
+    parser.add_argument('-nodes', type=int, default=10000)
+    parser.add_argument('-searches', type=int, default=20000)
+    parser.add_argument('-removals', type=int, default=5, help='nodes removed from the old structure (the index removes 100 times more)')
+    args = parser.parse_args()
+
+    owners = announces(files=args.files, nodes=args.nodes)
+    print(f"{args.files} files, {args.nodes} nodes, {len(owners)} announces")
+    header = f"{'structure':<14}{'announce us':>13}{'search us':>11}{'remove us':>12}{'owners/file':>13}"
+    print(header)
+    print("-" * len(header))
+    for name, structure, removals in (("json strings", JsonOwnersList(), args.removals),
+                                      ("index", IndexOwnersList(), args.removals * 100)):
+        r = measure(structure, owners=owners, files=args.files, nodes=args.nodes,
+                    searches=args.searches, removals=min(removals, args.nodes))
+        print(f"{name:<14}{r['announce']:>13.2f}{r['search']:>11.2f}{r['remove']:>12.1f}{r['owners']:>13.1f}")
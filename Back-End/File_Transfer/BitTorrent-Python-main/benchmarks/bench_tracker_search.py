@@ -0,0 +1,148 @@
+"""
+Size and cost of the search replies of the tracker, for files with more and more owners.
+
+Every file is owned by -owners nodes, spread over a few hosts, which other
+nodes reported bandwidths and rtts for. For every number of owners it reports:
+- all at once: the reply of the search as it was before the pages, every
+  owner in one reply with a table of hosts (the datagram outgrows the MTU,
+  and then the socket buffer, with a few hundred owners),
+- top 16: the reply to a node searching as node.py does, the
+  TRACKER_SEARCH_OWNERS fastest owners by the reports,
+- full page: the reply with as many owners as fit in TRACKER_SEARCH_REPLY_SIZE,
+- pages: replies needed to get every owner by following the cursors,
+with the bytes of the reply and the time it takes (to encode it for the old
+reply, to handle the search and encode its reply for the others). Every page
+ranks the owners up to its end, so following the cursors through thousands of
+owners costs more than one reply of all of them: the nodes only ask for the
+first pages. The
+exit status is non-zero if a page doesn't fit in TRACKER_SEARCH_REPLY_SIZE or
+if the pages don't give every owner once, in the order of a full sort.
+
+    $ python3 benchmarks/bench_tracker_search.py -owners 10 100 1000 10000
+"""
+import os
+import sys
+import argparse
+import random
+import shutil
+import struct
+import tempfile
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+from messages.message import Message, HEADER
+from messages.node2tracker import Node2Tracker, ORDER_SPEED
+from messages.tracker2node import Tracker2Node
+from shard_map import ShardMap
+from tracker import Tracker
+from tracker_db import OWN
+from utils import generate_random_port, free_socket
+
+HOSTS = 8
+FILENAME = "file_A.txt"
+
+
+def legacy_reply(search_result: list) -> bytes:
+    '''
+    :return: the Tracker2Node of every owner, in its layout before the pages
+    '''
+    hosts = {}
+    entries = []
+    for owner, freq in search_result:
+        host, port = owner['addr']
+        entries.append(struct.pack("!iiHBII", owner['node_id'], freq, port, hosts.setdefault(host, len(hosts)),
+                                   min(int(owner.get('bandwidth', 0)), 0xFFFFFFFF),
+                                   min(int(owner.get('rtt', 0) * 1e6), 0xFFFFFFFF)))
+    filename = FILENAME.encode()
+    parts = [struct.pack(HEADER + "iHBH", 5, Tracker2Node.msg_type, True, 0, 0, len(filename),
+                         len(hosts), len(entries)), filename]
+    for host in hosts:
+        parts.append(bytes([len(host)]) + host.encode())
+    return b"".join(parts + entries)
+
+
+def search(tracker: Tracker, replies: list, limit: int = 0, cursor: int = 0) -> dict:
+    msg = Node2Tracker(node_id=0, mode=config.tracker_requests_mode.NEED, filename=FILENAME,
+                       order=ORDER_SPEED, limit=limit, cursor=cursor)
+    tracker.search_file(Message.decode(msg.encode()), ("127.0.0.1", 1))
+    return Message.decode(replies[-1])
+
+
+def run(owners_counts: list, seed: int) -> bool:
+    rand = random.Random(seed)
+    shard_map = ShardMap([("localhost", generate_random_port())])
+    tracker = Tracker(shard_index=0, shard_map=shard_map)
+    replies = []
+    tracker.send_segment = lambda sock, data, addr: replies.append(data)
+    size = config.constants.TRACKER_SEARCH_REPLY_SIZE
+    wanted = config.constants.TRACKER_SEARCH_OWNERS
+    passed = True
+    header = (f"{'owners':>8}{'all at once':>18}{'top ' + str(wanted):>18}{'full page':>18}{'pages':>7}"
+              f"{'all pages':>13}")
+    print(header)
+    print(f"{'':>8}" + f"{'bytes':>9}{'us':>9}" * 3 + f"{'':>7}{'us':>13}")
+    print("-" * len(header))
+    try:
+        for count in owners_counts:
+            node_id = len(tracker.send_freq_list)
+            for i in range(node_id, count):
+                tracker.apply([OWN, i, f"10.0.0.{i % HOSTS}", 20000 + i, FILENAME])
+                tracker.send_freq_list[i] = rand.randrange(100)
+                if rand.random() < 0.8:
+                    tracker.peer_reports[i] = [rand.uniform(1e6, 1e8), rand.uniform(0.001, 0.1)]
+
+            everyone = [({'node_id': node_id, 'addr': addr}, tracker.send_freq_list[node_id])
+                        for node_id, addr in tracker.file_owners_list.owners_of(FILENAME)]
+            legacy_us = min(timeit.repeat(lambda: legacy_reply(everyone), number=10, repeat=3)) / 10 * 1e6
+            legacy_bytes = len(legacy_reply(everyone))
+
+            rows = []
+            for limit in (wanted, 0):
+                rows.append(len(search(tracker, replies, limit=limit)["search_result"]))
+                rows.append(len(replies[-1]))
+                rows.append(min(timeit.repeat(lambda: search(tracker, replies, limit=limit),
+                                              number=10, repeat=3)) / 10 * 1e6)
+
+            # every owner, by following the cursors
+            def all_pages() -> list:
+                result, cursor, pages = [], 0, 0
+                while True:
+                    page = search(tracker, replies, cursor=cursor)
+                    pages += 1
+                    if len(replies[-1]) > size:
+                        raise AssertionError(f"a page of {len(replies[-1])} bytes")
+                    result.extend(owner['node_id'] for owner, _ in page["search_result"])
+                    cursor = page["next_cursor"]
+                    if not cursor:
+                        return result, pages
+            paged, pages = all_pages()
+            pages_us = min(timeit.repeat(all_pages, number=1, repeat=3)) * 1e6
+            key = tracker.search_key(ORDER_SPEED)
+            expected = [node_id for node_id, _ in sorted(tracker.file_owners_list.owners_of(FILENAME), key=key)]
+            ok = paged == expected and rows[0] == min(wanted, count)
+            passed &= ok
+            print(f"{count:>8}{legacy_bytes:>9}{legacy_us:>9.1f}{rows[1]:>9}{rows[2]:>9.1f}{rows[4]:>9}{rows[5]:>9.1f}"
+                  f"{pages:>7}{pages_us:>13.1f}  {'OK' if ok else 'FAILED'}")
+    finally:
+        tracker.db.close()
+        free_socket(tracker.tracker_socket)
+    return passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-owners', type=int, nargs='+', default=[10, 100, 1000, 10000], help='owners of the file, increasing')
+    parser.add_argument('-seed', type=int, default=7)
+    args = parser.parse_args()
+
+    # the tracker keeps its database in the current directory
+    work_dir = tempfile.mkdtemp(dir=os.getcwd())
+    os.chdir(work_dir)
+    try:
+        passed = run(sorted(args.owners), args.seed)
+    finally:
+        os.chdir("..")
+        shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(0 if passed else 1)
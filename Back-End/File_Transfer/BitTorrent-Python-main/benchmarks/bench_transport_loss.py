@@ -0,0 +1,147 @@
+"""
+Loss-injection harness of the reliable chunk transport.
+
+A chunk is transferred between two loopback sockets through ``LossySocket``
+shims which drop, duplicate and reorder the datagrams of both directions
+(pieces and acks). Every scenario checks that the received bytes are exactly
+the sent ones and reports throughput and retransmissions. The exit status is
+non-zero if any transfer is incomplete or corrupted.
+
+    $ python3 benchmarks/bench_transport_loss.py -size 20000000
+"""
+import os
+import sys
+import argparse
+import asyncio
+import hashlib
+import socket
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+from messages.message import Message
+from messages.chunk_sharing import ChunkSharing
+from messages.chunk_ack import ChunkAck
+from netem import LossySocket
+from transport import ReliableSender, ReliableReceiver, pieces_count_of
+from utils import send_datagram
+
+# (name, loss, duplicate, reorder, delay)
+SCENARIOS = [
+    ("clean", 0.0, 0.0, 0.0, 0.0),
+    ("1% loss", 0.01, 0.0, 0.0, 0.0),
+    ("5% loss", 0.05, 0.0, 0.0, 0.0),
+    ("10% loss", 0.10, 0.0, 0.0, 0.0),
+    ("5% loss + reorder + dup", 0.05, 0.02, 0.05, 0.0),
+    ("2% loss, 5ms delay", 0.02, 0.0, 0.0, 0.005),
+]
+
+
+def loopback_socket() -> socket.socket:
+    sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+    sock.bind(('localhost', 0))
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config.constants.RCV_SOCKET_BUFFER)
+    return sock
+
+
+class Inbox(asyncio.DatagramProtocol):
+    """Puts the decoded messages received by a socket into a queue"""
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        self.queue.put_nowait(Message.decode(data))
+
+
+def lossy_send(lossy: LossySocket, addr: tuple):
+    def send(data):
+        try:
+            send_datagram(sock=lossy, data=data, addr=addr)
+        except BlockingIOError:
+            pass    # the socket buffer is full: the datagram is lost, as on a real path
+    return send
+
+
+async def transfer(blob: bytes, loss: float, duplicate: float, reorder: float, delay: float, seed: int) -> dict:
+    piece_size = config.constants.CHUNK_PIECES_SIZE
+    rng = (0, len(blob))
+    pieces_count = pieces_count_of(rng, piece_size)
+    impairments = dict(loss=loss, duplicate=duplicate, reorder=reorder, delay=delay)
+    loop = asyncio.get_running_loop()
+    sender_raw, receiver_raw = loopback_socket(), loopback_socket()
+    sender_transport, sender_inbox = await loop.create_datagram_endpoint(Inbox, sock=sender_raw)
+    receiver_transport, receiver_inbox = await loop.create_datagram_endpoint(Inbox, sock=receiver_raw)
+    sender_sock = LossySocket(sender_raw, seed=seed, **impairments)
+    receiver_sock = LossySocket(receiver_raw, seed=seed + 1, **impairments)
+    view = memoryview(blob)
+    received = bytearray(len(blob))
+
+    def make_piece(idx: int) -> list:
+        start = idx * piece_size
+        return ChunkSharing(src_node_id=1, dest_node_id=2, filename="blob", range=rng,
+                            idx=idx, chunk=view[start: start + piece_size]).encode_parts()
+
+    async def on_piece(msg: dict):
+        start = msg["idx"] * piece_size
+        received[start: start + len(msg["chunk"])] = msg["chunk"]
+
+    def make_ack(cum_ack: int, sacks: list) -> bytes:
+        return ChunkAck(src_node_id=2, dest_node_id=1, filename="blob", range=rng,
+                        cum_ack=cum_ack, sacks=sacks).encode()
+
+    sender = ReliableSender(send=lossy_send(sender_sock, receiver_raw.getsockname()),
+                            inbox=sender_inbox.queue,
+                            pieces_count=pieces_count,
+                            make_piece=make_piece,
+                            make_fin=ChunkSharing(src_node_id=1, dest_node_id=2, filename="blob", range=rng).encode)
+    receiver = ReliableReceiver(send=lossy_send(receiver_sock, sender_raw.getsockname()),
+                                inbox=receiver_inbox.queue,
+                                pieces_count=pieces_count,
+                                on_piece=on_piece,
+                                make_ack=make_ack)
+    result = {}
+
+    async def serve():
+        # the sender starts once the request arrives, as a node does
+        await sender_inbox.queue.get()
+        result["sent"] = await sender.run()
+
+    serving = asyncio.ensure_future(serve())
+    start_time = time.perf_counter()
+    request = ChunkSharing(src_node_id=2, dest_node_id=1, filename="blob", range=rng).encode()
+    result["received"] = await receiver.run(request=request)
+    result["seconds"] = time.perf_counter() - start_time
+    await asyncio.gather(serving, receiver.linger())
+    result["intact"] = hashlib.sha256(received).digest() == hashlib.sha256(blob).digest()
+    result["retransmissions"] = sender.window.retransmissions_count
+    result["pieces"] = pieces_count
+    result["cwnd"] = sender.window.cwnd
+    sender_transport.close()
+    receiver_transport.close()
+    sender_sock.close()
+    receiver_sock.close()
+    return result
+
+
+def run(size: int, seed: int) -> bool:
+    blob = os.urandom(size)
+    header = f"{'scenario':<26}{'MB/s':>8}{'seconds':>9}{'retx':>7}{'retx %':>8}{'cwnd':>7}  result"
+    print(header)
+    print("-" * len(header))
+    all_passed = True
+    for name, loss, duplicate, reorder, delay in SCENARIOS:
+        r = asyncio.run(transfer(blob, loss, duplicate, reorder, delay, seed))
+        passed = r["received"] and r.get("sent", False) and r["intact"]
+        all_passed &= passed
+        print(f"{name:<26}{size / r['seconds'] / 1e6:>8.1f}{r['seconds']:>9.2f}{r['retransmissions']:>7}"
+              f"{100 * r['retransmissions'] / r['pieces']:>8.1f}{r['cwnd']:>7.1f}  {'OK' if passed else 'FAILED'}")
+    return all_passed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-size', type=int, default=10_000_000, help='bytes transferred in each scenario')
+    parser.add_argument('-seed', type=int, default=7)
+    args = parser.parse_args()
+    sys.exit(0 if run(size=args.size, seed=args.seed) else 1)
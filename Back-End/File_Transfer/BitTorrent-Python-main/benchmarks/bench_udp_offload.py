@@ -0,0 +1,105 @@
+"""
+Throughput of one transfer over loopback, with and without UDP segmentation offload.
+
+A seeder node sends a file to one downloader node, first with the datagrams
+sent and received one by one, then with UDP_GSO and UDP_GRO (see
+endpoint.py). The datagrams are capped to ethernet and jumbo frame sizes,
+where a system call per piece is what limits a transfer. It reports the
+throughput and the system calls which sent the pieces.
+
+    $ python3 benchmarks/bench_udp_offload.py -size 20000000 -datagram 1472 8972
+"""
+import os
+import sys
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import shutil
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+import endpoint
+from node import Node
+from utils import generate_random_port
+
+
+async def run(size: int, datagram: int, offload: bool) -> bool:
+    endpoint.config.constants.UDP_GSO = offload
+    endpoint.config.constants.UDP_GRO = offload
+    blob = os.urandom(size)
+    seeder = Node(node_id=1, port=generate_random_port())
+    await seeder.start()
+    with open(f"{config.directory.node_files_dir}node1/blob.bin", "wb") as f:
+        f.write(blob)
+    seeder.files.append("blob.bin")
+    await seeder.set_send_mode("blob.bin")
+    owner = ({'node_id': seeder.node_id, 'addr': ('127.0.0.1', seeder.endpoint.port)}, 0)
+
+    downloader = Node(node_id=2, port=generate_random_port())
+    downloader.path_mtu.max_datagram_size = datagram
+    await downloader.start()
+
+    # counts the system calls of the seeder: one per datagram, or one per run of them with GSO
+    syscalls = 0
+    sock = seeder.endpoint.sock
+    send_datagram = endpoint.send_datagram
+    sendmsg = sock.sendmsg
+
+    def counted_send_datagram(**kwargs):
+        nonlocal syscalls
+        syscalls += 1
+        send_datagram(**kwargs)
+
+    class CountedSocket:
+        def __getattr__(self, name):
+            return getattr(sock, name)
+
+        def sendmsg(self, *args):
+            nonlocal syscalls
+            syscalls += 1
+            return sendmsg(*args)
+
+    endpoint.send_datagram = counted_send_datagram
+    seeder.endpoint.sock = CountedSocket()
+    start_time = time.perf_counter()
+    try:
+        await downloader.split_file_owners(file_owners=[owner], filename="blob.bin")
+    finally:
+        seconds = time.perf_counter() - start_time
+        endpoint.send_datagram = send_datagram
+        seeder.endpoint.sock = sock
+
+    path = f"{config.directory.node_files_dir}node2/blob.bin"
+    intact = False
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            intact = hashlib.sha256(f.read()).digest() == hashlib.sha256(blob).digest()
+    print(f"datagrams of {datagram:>5} bytes, offload {'on ' if offload else 'off'} "
+          f"(gso={seeder.endpoint.gso}, gro={downloader.endpoint.gro}): "
+          f"{size / seconds / 1e6:7.1f} MB/s, {syscalls:>6} sends, {'intact' if intact else 'CORRUPTED'}",
+          file=sys.stderr)
+    for n in (seeder, downloader):
+        n.endpoint.close()
+    return intact
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-size', type=int, default=20_000_000, help='bytes of the file')
+    parser.add_argument('-datagram', type=int, nargs='+', default=[1472, 8972], help='largest datagrams sent, in bytes')
+    args = parser.parse_args()
+
+    # the nodes write their files and logs in the current directory
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            passed = all([asyncio.run(run(size=args.size, datagram=datagram, offload=offload))
+                          for datagram in args.datagram for offload in (False, True)])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(0 if passed else 1)
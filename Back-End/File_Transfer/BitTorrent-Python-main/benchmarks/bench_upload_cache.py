@@ -0,0 +1,133 @@
+"""
+Downloads of one popular file, with and without the caches of the uploading side (see file_cache.py).
+
+One seeder serves a file to -downloaders nodes at the same time, all of them
+running on one event loop in this process, so every chunk of the file is
+requested many times. Each run is made with the file in the page cache (warm)
+and evicted from it beforehand (cold, ``POSIX_FADV_DONTNEED``), and with:
+- no cache: the file is mapped for every chunk, and no readahead hint is given,
+- the file cache: the file stays mapped, and the ranges are read ahead,
+- the file cache and the cache of the hot pieces.
+It reports the aggregate throughput, the time the seeder spent building the
+pieces it sent, and the hits of the caches. The exit status is non-zero if a
+download is incomplete or corrupted.
+
+    $ python3 benchmarks/bench_upload_cache.py -downloaders 20 -size 20000000
+"""
+import os
+import sys
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import itertools
+import shutil
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+import file_cache
+import node as node_module
+from node import Node
+from utils import generate_random_port
+
+MODES = {"no cache": (0, 0, False),
+         "file cache": (64, 0, True),
+         "file + piece cache": (64, 64 * 1024 * 1024, True)}
+# downloaders of every run get a directory of their own
+NODE_IDS = itertools.count(100)
+
+
+def evict(path: str):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+async def run(downloaders: int, blob: bytes, mode: str, cold: bool) -> bool:
+    constants = node_module.config.constants
+    constants.FILE_CACHE_SIZE, constants.PIECE_CACHE_SIZE, file_cache.config.constants.READAHEAD_HINTS = MODES[mode]
+    # the content-defined chunks are not looked for: the downloaders have nothing to reuse
+    constants.CHUNK_DEDUP = False
+    seeder = Node(node_id=1, port=generate_random_port())
+    await seeder.start()
+    path = f"{config.directory.node_files_dir}node1/blob.bin"
+    if not os.path.isfile(path):
+        with open(path, "wb") as f:
+            f.write(blob)
+    seeder.files.append("blob.bin")
+    await seeder.set_send_mode("blob.bin")
+    if cold:
+        evict(path)
+    owner = ({'node_id': seeder.node_id, 'addr': ('127.0.0.1', seeder.endpoint.port)}, 0)
+
+    # the time the seeder spends building the pieces of the chunks it sends
+    build_seconds = 0.0
+    split_file_to_chunks = seeder.split_file_to_chunks
+
+    @contextlib.contextmanager
+    def timed_split_file_to_chunks(file_path: str, rng: tuple, piece_size: int):
+        nonlocal build_seconds
+        start_time = time.perf_counter()
+        with split_file_to_chunks(file_path=file_path, rng=rng, piece_size=piece_size) as (piece_at, version):
+            build_seconds += time.perf_counter() - start_time
+
+            def timed_piece_at(idx: int):
+                nonlocal build_seconds
+                start_time = time.perf_counter()
+                piece = piece_at(idx)
+                # the pages of a mapping are only read when the piece is sent, as the kernel copies it
+                bytes(piece[::4096])
+                build_seconds += time.perf_counter() - start_time
+                return piece
+            yield timed_piece_at, version
+
+    seeder.split_file_to_chunks = timed_split_file_to_chunks
+
+    nodes = [Node(node_id=next(NODE_IDS), port=generate_random_port()) for _ in range(downloaders)]
+    for n in nodes:
+        # in a real swarm each of them is a process of its own, here they share the hashing threads
+        n.hash_pool.shutdown()
+        n.hash_pool = seeder.hash_pool
+        await n.start()
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(n.split_file_owners(file_owners=[owner], filename="blob.bin") for n in nodes))
+    seconds = time.perf_counter() - start_time
+
+    digest = hashlib.sha256(blob).digest()
+    intact = 0
+    for n in nodes:
+        path = f"{config.directory.node_files_dir}node{n.node_id}/blob.bin"
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                intact += hashlib.sha256(f.read()).digest() == digest
+    files = seeder.file_cache
+    print(f"{'cold' if cold else 'warm'}  {mode:<20}{seconds:6.2f}s {downloaders * len(blob) / seconds / 1e6:7.1f} MB/s  "
+          f"building pieces {build_seconds * 1000:7.1f} ms  file cache {files.hits}/{files.hits + files.misses} hits, "
+          f"piece cache {seeder.piece_cache.hits} hits  {intact}/{downloaders} intact", file=sys.stderr)
+    seeder.file_cache.close()
+    for n in [seeder] + nodes:
+        n.endpoint.close()
+    return intact == downloaders
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-downloaders', type=int, default=20, help='nodes downloading the file at the same time')
+    parser.add_argument('-size', type=int, default=20_000_000, help='bytes of the file')
+    args = parser.parse_args()
+
+    # the nodes write their files and logs in the current directory
+    work_dir = tempfile.mkdtemp(dir=os.getcwd())
+    os.chdir(work_dir)
+    blob = os.urandom(args.size)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            passed = all([asyncio.run(run(downloaders=args.downloaders, blob=blob, mode=mode, cold=cold))
+                          for cold in (False, True) for mode in MODES])
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    sys.exit(0 if passed else 1)
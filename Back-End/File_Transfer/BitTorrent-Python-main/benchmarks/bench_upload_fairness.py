@@ -0,0 +1,90 @@
+"""
+Latency of small chunk requests to a node which is busy serving a bulk requester.
+
+A bulk node asks the seeder for -bulk_requests chunks at once, and meanwhile
+-small nodes ask it for one small chunk each. It is run with the seeder
+serving every request as soon as it arrives (as before upload_queue.py), and
+with the bounded fair queue: the small requests should no longer get a tiny
+share of the uplink next to the many chunks of the bulk node, and the chunks
+sent at once should no longer overflow the socket buffer of the bulk node.
+
+    $ python3 benchmarks/bench_upload_fairness.py -bulk_requests 32 -bulk_chunk 1000000 -small 4 -small_chunk 65536
+"""
+import os
+import sys
+import argparse
+import asyncio
+import contextlib
+import shutil
+import statistics
+import tempfile
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+import node as node_module
+from node import Node
+from download_sink import DownloadSink
+from utils import generate_random_port
+
+
+async def fetch(n: Node, owner: tuple, rng: tuple) -> float:
+    start_time = time.perf_counter()
+    assert await n.receive_chunk("blob.bin", rng, owner)
+    return time.perf_counter() - start_time
+
+
+async def run(args, fair: bool):
+    constants = node_module.config.constants
+    if not fair:
+        # every request is served at once, whoever it comes from
+        constants.MAX_UPLOAD_WORKERS = constants.MAX_UPLOADS_PER_REQUESTER = 1 << 30
+    size = args.bulk_requests * args.bulk_chunk
+    seeder = Node(node_id=1, port=generate_random_port())
+    await seeder.start()
+    with open(f"{config.directory.node_files_dir}node1/blob.bin", "wb") as f:
+        f.write(os.urandom(size))
+    seeder.files.append("blob.bin")
+    await seeder.set_send_mode("blob.bin")
+    owner = ({'node_id': seeder.node_id, 'addr': ('127.0.0.1', seeder.endpoint.port)}, 0)
+
+    nodes = [Node(node_id=100 + i, port=generate_random_port()) for i in range(args.small + 1)]
+    for n in nodes:
+        await n.start()
+        path = f"{config.directory.node_files_dir}node{n.node_id}/blob.bin"
+        n.downloaded_files["blob.bin"] = DownloadSink(file_path=path, file_size=size)
+    bulk, small = nodes[0], nodes[1:]
+
+    start_time = time.perf_counter()
+    bulk_task = asyncio.gather(*(fetch(bulk, owner, (i * args.bulk_chunk, (i + 1) * args.bulk_chunk))
+                                 for i in range(args.bulk_requests)))
+    await asyncio.sleep(0.01)
+    small_latencies = await asyncio.gather(*(fetch(n, owner, (0, args.small_chunk)) for n in small))
+    await bulk_task
+    seconds = time.perf_counter() - start_time
+    print(f"{'fair queue' if fair else 'unbounded':<12}small requests: median {statistics.median(small_latencies) * 1e3:7.1f} ms, "
+          f"max {max(small_latencies) * 1e3:7.1f} ms; bulk: {size / seconds / 1e6:6.1f} MB/s", file=sys.stderr)
+    for n in nodes:
+        n.downloaded_files.pop("blob.bin").close()
+    for n in [seeder] + nodes:
+        n.endpoint.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-bulk_requests', type=int, default=32, help='chunks the bulk node asks for at once')
+    parser.add_argument('-bulk_chunk', type=int, default=1_000_000, help='bytes of each of these chunks')
+    parser.add_argument('-small', type=int, default=4, help='nodes asking for a small chunk meanwhile')
+    parser.add_argument('-small_chunk', type=int, default=65536, help='bytes of the small chunks')
+    args = parser.parse_args()
+
+    # the nodes write their files and logs in the current directory
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for fair in (True, False):
+                asyncio.run(run(args, fair=fair))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,73 @@
+"""
+Microbenchmark of the struct-packed wire format against the old pickle one.
+
+For every message type it reports encode/decode time per message and the
+number of bytes put on the wire. Run it from anywhere:
+
+    $ python3 benchmarks/bench_wire_format.py
+"""
+import os
+import sys
+import pickle
+import argparse
+import timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+from messages.message import Message
+from messages.node2tracker import Node2Tracker
+from messages.node2node import Node2Node
+from messages.chunk_sharing import ChunkSharing
+from messages.tracker2node import Tracker2Node
+
+
+def sample_messages() -> dict:
+    piece = os.urandom(config.constants.CHUNK_PIECES_SIZE)
+    owners = [({'node_id': i, 'addr': ('127.0.0.1', 20000 + i)}, i % 7) for i in range(50)]
+    return {
+        "Node2Tracker": Node2Tracker(node_id=3, mode=config.tracker_requests_mode.NEED,
+                                     filename="file_A.txt"),
+        "Node2Node": Node2Node(src_node_id=3, dest_node_id=1, filename="file_A.txt",
+                               size=507324),
+        "ChunkSharing (request)": ChunkSharing(src_node_id=3, dest_node_id=1,
+                                               filename="file_A.txt", range=(0, 169108)),
+        "ChunkSharing (piece)": ChunkSharing(src_node_id=1, dest_node_id=3,
+                                             filename="file_A.txt", range=(0, 169108),
+                                             idx=12, chunk=piece),
+        "Tracker2Node (50 owners)": Tracker2Node(dest_node_id=3, search_result=owners,
+                                                 filename="file_A.txt"),
+    }
+
+
+def per_op_us(stmt, number: int) -> float:
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e6
+
+
+def run(number: int):
+    header = f"{'message':<26}{'path':<8}{'bytes':>8}{'encode us':>12}{'decode us':>12}"
+    print(header)
+    print("-" * len(header))
+    for name, msg in sample_messages().items():
+        pickled = pickle.dumps(msg.__dict__)
+        packed = msg.encode()
+        rows = [
+            ("pickle", len(pickled),
+             per_op_us(lambda: pickle.dumps(msg.__dict__), number),
+             per_op_us(lambda: pickle.loads(pickled), number)),
+            ("struct", len(packed),
+             per_op_us(msg.encode, number),
+             per_op_us(lambda: Message.decode(packed), number)),
+        ]
+        if len(msg.encode_parts()) > 1:
+            # the send path hands the parts to sendmsg() without joining them
+            rows.append(("parts", len(packed), per_op_us(msg.encode_parts, number), rows[1][3]))
+        for path, size, enc, dec in rows:
+            print(f"{name:<26}{path:<8}{size:>8}{enc:>12.2f}{dec:>12.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-number', type=int, default=20000, help='iterations per measurement')
+    args = parser.parse_args()
+    run(number=args.number)
@@ -0,0 +1,335 @@
+"""
+Content-defined chunks of the files of a node, to reuse the data a node already holds.
+
+A file is cut where a rolling hash (a gear hash) of its last bytes matches a
+mask, so the boundaries depend on the content and not on offsets: an edit in
+a file only changes the chunks around it, and the versions of a file (or a
+backup and its source) share most of their chunks, even where data has been
+inserted or removed.
+
+The chunk list of a file gives the SHA-256 digest and size of each of its
+chunks. A node computes it once and caches it next to the file as
+``<filename>.chunks``, like the piece manifest, and downloaders fetch it like
+any other file.
+
+A ``ChunkStore`` indexes the chunks of the files of a node by their digest,
+so a chunk held by several files is known once. It doesn't copy them: files
+stay whole in the node directory, where they are served from, and a chunk is
+read from the file which holds it. A download first places the chunks the
+node already holds, and only the hashed pieces they don't cover are
+requested from the peers.
+
+The gear hash is computed for every byte of a file. If numpy is installed,
+it is computed for a block of bytes at once (in log2 of the window steps,
+see ``gear_cut_candidates()``), otherwise byte by byte in Python, which is
+an order of magnitude slower; both cut the files at the same offsets.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+CHUNKS_SUFFIX = ".chunks"
+
+# a random byte -> 64-bit table, the same on every node (or their chunks would never match)
+GEAR = [int.from_bytes(hashlib.sha256(bytes([b])).digest()[:8], "big") for b in range(256)]
+MASK_64 = (1 << 64) - 1
+GEAR_WINDOW = 64        # bytes the hash depends on, the older ones are shifted out of its 64 bits
+GEAR_BLOCK = 1 << 20    # bytes hashed at once with numpy, the hashes of a block take 8 times as much memory
+
+
+def chunk_mask(avg_size: int) -> int:
+    # the top bits of the hash depend on the last 64 bytes, the bottom ones only on the last few
+    bits = max(avg_size.bit_length() - 1, 1)
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def gear_cut_candidates(data, mask: int):
+    '''
+    The hash at offset p is that of the GEAR_WINDOW bytes before it: sum(GEAR[data[p - 1 - k]] << k).
+    It is built in log2(GEAR_WINDOW) steps, each one adding to the hash of the last n bytes that of the
+    n bytes before them, shifted by n.
+
+    :return: sorted numpy array of the offsets p where the hash matches the mask (a chunk may end there)
+    '''
+    table = numpy.array(GEAR, dtype=numpy.uint64)
+    data = numpy.frombuffer(data, dtype=numpy.uint8)
+    mask = numpy.uint64(mask)
+    candidates = [numpy.empty(0, dtype=numpy.int64)]
+    for start in range(0, len(data), GEAR_BLOCK):
+        # the first hashes of a block depend on the last bytes of the previous one
+        low = max(start - GEAR_WINDOW + 1, 0)
+        hashes = table[data[low: start + GEAR_BLOCK]]
+        shift = 1
+        while shift < GEAR_WINDOW:
+            hashes[shift:] += hashes[:-shift] << numpy.uint64(shift)
+            shift *= 2
+        candidates.append(numpy.flatnonzero((hashes[start - low:] & mask) == 0) + (start + 1))
+    return numpy.concatenate(candidates)
+
+
+def chunk_boundaries(data, min_size: int, avg_size: int, max_size: int) -> list:
+    '''
+    Cuts data into content-defined chunks of min_size to max_size bytes (avg_size on average)
+
+    :param data: bytes-like object
+    :return: end offsets of the chunks
+    '''
+    mask = chunk_mask(avg_size)
+    if numpy is not None and min_size >= GEAR_WINDOW:
+        # a chunk ends at the first candidate min_size bytes after its start, where the hash covers a whole window
+        candidates = gear_cut_candidates(data, mask)
+        boundaries = []
+        start = 0
+        size = len(data)
+        while start < size:
+            end = min(start + max_size, size)
+            if end - start <= min_size:
+                boundaries.append(end)
+                break
+            i = numpy.searchsorted(candidates, start + min_size)
+            cut = int(candidates[i]) if i < len(candidates) and candidates[i] <= end else end
+            boundaries.append(cut)
+            start = cut
+        return boundaries
+    gear = GEAR
+    boundaries = []
+    start = 0
+    size = len(data)
+    while start < size:
+        end = min(start + max_size, size)
+        if end - start <= min_size:
+            boundaries.append(end)
+            break
+        # the bytes before start + min_size can't end a chunk, only the last 64 of them weigh on the hash
+        h = 0
+        cut = end
+        offset = max(start + min_size - 64, start)
+        for b in data[offset: end]:
+            h = ((h << 1) + gear[b]) & MASK_64
+            offset += 1
+            if not h & mask and offset >= start + min_size:
+                cut = offset
+                break
+        boundaries.append(cut)
+        start = cut
+    return boundaries
+
+
+class ChunkList:
+    # magic, version, file_size, chunks_count
+    layout = struct.Struct("!4sBQI")
+    chunk_layout = struct.Struct("!32sI")
+    MAGIC = b"VQBC"
+    VERSION = 1
+
+    def __init__(self, file_size: int, chunks: list):
+        '''
+        :param chunks: (digest, size) of each chunk, in the order of the file
+        '''
+        self.file_size = file_size
+        self.chunks = chunks
+
+    def offsets(self):
+        '''
+        :return: iterator of (offset, digest, size) of the chunks
+        '''
+        offset = 0
+        for digest, size in self.chunks:
+            yield offset, digest, size
+            offset += size
+
+    def encode(self) -> bytes:
+        return self.layout.pack(self.MAGIC, self.VERSION, self.file_size, len(self.chunks)) + \
+            b"".join(self.chunk_layout.pack(digest, size) for digest, size in self.chunks)
+
+    @classmethod
+    def decode(cls, data: bytes):
+        '''
+        :raises ValueError: if the data is not a chunk list, or its chunks don't add up to the file size
+        '''
+        if len(data) < cls.layout.size:
+            raise ValueError("truncated chunk list")
+        magic, version, file_size, count = cls.layout.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("not a chunk list")
+        if len(data) != cls.layout.size + count * cls.chunk_layout.size:
+            raise ValueError("truncated chunk list")
+        chunks = list(cls.chunk_layout.iter_unpack(data[cls.layout.size:]))
+        if sum(size for _, size in chunks) != file_size:
+            raise ValueError("the chunks don't add up to the file size")
+        return cls(file_size, chunks)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "rb") as f:
+            return cls.decode(f.read())
+
+    def save(self, path: str):
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(self.encode())
+        os.replace(temp_path, path)
+
+
+def chunk_file(file_path: str) -> ChunkList:
+    file_size = os.stat(file_path).st_size
+    if file_size == 0:
+        return ChunkList(0, [])
+    constants = config.constants
+    chunks = []
+    start = 0
+    with open(file_path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with mm, memoryview(mm) as view:
+        for end in chunk_boundaries(view, constants.CDC_MIN_SIZE, constants.CDC_AVG_SIZE, constants.CDC_MAX_SIZE):
+            chunks.append((hashlib.sha256(view[start: end]).digest(), end - start))
+            start = end
+    return ChunkList(file_size, chunks)
+
+
+def load_or_create_chunk_list(file_path: str) -> ChunkList:
+    '''
+    Returns the chunk list cached next to the file, or computes (and caches) it
+    if there is none or the file has changed since.
+    '''
+    chunks_path = file_path + CHUNKS_SUFFIX
+    try:
+        if os.stat(chunks_path).st_mtime_ns >= os.stat(file_path).st_mtime_ns:
+            chunk_list = ChunkList.load(chunks_path)
+            if chunk_list.file_size == os.stat(file_path).st_size:
+                return chunk_list
+    except (OSError, ValueError):
+        pass
+    chunk_list = chunk_file(file_path)
+    chunk_list.save(chunks_path)
+    return chunk_list
+
+
+def matches_file(chunk_list: ChunkList, file_path: str) -> bool:
+    '''
+    :return: whether the chunks of the list are those of the file (e.g. a list received from a peer)
+    '''
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size != chunk_list.file_size:
+            return False
+        return all(hashlib.sha256(f.read(size)).digest() == digest for digest, size in chunk_list.chunks)
+
+
+class ChunkStore:
+    """
+    Index of the chunks held in the files of a node directory, by their digest.
+
+    The index only says where a chunk may be read: a file can change after it
+    has been indexed, so ``read()`` checks the chunk against its digest, and
+    tries the other files which hold it if it doesn't match. Only the stale
+    location is forgotten, and its file is indexed again by the next
+    ``refresh()``.
+
+    The files are indexed on a thread pool while downloads read the store from
+    another, so it is guarded by a lock.
+
+    :param files_dir: directory of the files of the node
+    """
+    def __init__(self, files_dir: str):
+        self.files_dir = files_dir
+        self.lock = threading.Lock()
+        self.locations = {}     # digest -> [(filename, offset, size)], one location per file holding the chunk
+        self.indexed = {}       # filename -> (mtime of the file when it was indexed, digests of its chunks)
+
+    def add(self, filename: str, chunk_list: ChunkList):
+        try:
+            mtime = os.stat(os.path.join(self.files_dir, filename)).st_mtime_ns
+        except OSError:
+            mtime = None    # indexed again by the next refresh
+        with self.lock:
+            self._forget(filename)
+            digests = set()
+            for offset, digest, size in chunk_list.offsets():
+                if digest not in digests:
+                    digests.add(digest)
+                    self.locations.setdefault(digest, []).append((filename, offset, size))
+            self.indexed[filename] = (mtime, digests)
+
+    def index(self, filename: str):
+        '''
+        Indexes the chunks of a file of the node, unless it has not changed since it was indexed
+        (blocking: it may chunk the whole file)
+        '''
+        file_path = os.path.join(self.files_dir, filename)
+        try:
+            mtime = os.stat(file_path).st_mtime_ns
+            with self.lock:
+                indexed_mtime, _ = self.indexed.get(filename, (None, None))
+            if indexed_mtime == mtime:
+                return
+            self.add(filename, load_or_create_chunk_list(file_path))
+        except OSError:
+            # the file is gone
+            with self.lock:
+                self._forget(filename)
+
+    def refresh(self, filenames: list):
+        '''
+        Indexes the files which are new or have changed since they were indexed (blocking)
+        '''
+        for filename in filenames:
+            self.index(filename)
+
+    def __contains__(self, digest: bytes) -> bool:
+        with self.lock:
+            return digest in self.locations
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.locations)
+
+    def read(self, digest: bytes):
+        '''
+        :return: bytes of the chunk, or None if the node doesn't hold it (anymore)
+        '''
+        with self.lock:
+            locations = list(self.locations.get(digest, ()))
+        for location in locations:
+            filename, offset, size = location
+            try:
+                with open(os.path.join(self.files_dir, filename), "rb") as f:
+                    f.seek(offset)
+                    data = f.read(size)
+            except OSError:
+                data = b""
+            if hashlib.sha256(data).digest() == digest:
+                return data
+            with self.lock:
+                self._drop(digest, location)
+        return None
+
+    def _drop(self, digest: bytes, location: tuple):
+        # the file has changed since it was indexed: the other files holding the chunk are still good
+        locations = self.locations.get(digest)
+        if locations is not None and location in locations:
+            locations.remove(location)
+            if not locations:
+                del self.locations[digest]
+        filename = location[0]
+        if filename in self.indexed:
+            _, digests = self.indexed[filename]
+            digests.discard(digest)
+            self.indexed[filename] = (None, digests)
+
+    def _forget(self, filename: str):
+        _, digests = self.indexed.pop(filename, (None, ()))
+        for digest in digests:
+            locations = [location for location in self.locations.get(digest, ()) if location[0] != filename]
+            if locations:
+                self.locations[digest] = locations
+            else:
+                self.locations.pop(digest, None)
@@ -9,20 +9,103 @@ CFG = {
     },
     "constants": {
         "AVAILABLE_PORTS_RANGE": (1024, 65535), # range of available ports on the local computer
-        "TRACKER_ADDR": ('localhost', 12345),
+        "TRACKER_ADDR": ('localhost', 12345),   # the registry, it must be the first of TRACKER_SHARDS
+        "TRACKER_SHARDS": [('localhost', 12345)],   # addresses of the tracker processes, see shard_map.py
+        "TRACKER_SHARD_VNODES": 64, # points of each shard on the hash ring which assigns the files to the shards
         "MAX_UDP_SEGMENT_DATA_SIZE": 65527,
         "BUFFER_SIZE": 9216,        # MACOSX UDP MTU is 9216
-        "CHUNK_PIECES_SIZE": 9216 - 2000, # Each chunk pieces(segments of UDP) must be lower than UDP buffer size
+        "CHUNK_PIECES_SIZE": 9216 - 2000, # size of the hashed pieces of the manifests, and of the pieces on the wire where the path can't be probed
+        # size of the pieces on the wire (see path_mtu.py), datagram sizes are in bytes of UDP payload
+        "LOOPBACK_DATAGRAM_SIZE": 65507,    # largest UDP payload over IPv4
+        "PMTU_PROBE_SIZES": [8972, 1472],   # jumbo frames and ethernet, the largest one which reaches the peer is used
+        "SAFE_DATAGRAM_SIZE": 1200, # used if no probe reaches the peer
+        "PMTU_PROBE_RETRIES": 2,
+        "PMTU_CACHE_TTL": 600,      # the path to a host is probed again after this many seconds
         "MAX_SPLITTNES_RATE": 3,    # number of neighboring peers which the node take chunks of a file in parallel
+        # choice of these peers by their measured speed (see peer_stats.py)
+        "PEER_EWMA_ALPHA": 0.25,    # weight of a new measurement of the bandwidth and rtt of a peer
+        "PEER_DEFAULT_BANDWIDTH": 10 * 1000 * 1000,   # assumed for the peers nothing is known about (bytes/s)
+        "PEER_DEFAULT_RTT": 0.05,   # assumed for the peers nothing is known about (seconds)
+        "SLOW_PEER_FACTOR": 4,      # a peer this many times slower than the fastest one of a download leaves its blocks to the others
+        "REPORT_PEER_STATS": True,  # nodes tell the tracker how fast the peers they downloaded from were
+        "SCHEDULER_BLOCK_PIECES": 64,   # pieces of a block, the unit of work handed to a peer (see scheduler.py)
+        "MAX_BLOCK_FAILURES": 5,    # a download is abandoned when a block fails more times than this
         "NODE_TIME_INTERVAL": 20,        # the interval time that each node periodically informs the tracker (in seconds)
-        "TRACKER_TIME_INTERVAL": 22      #the interval time that the tracker periodically checks which nodes are in the torrent (in seconds)
+        "TRACKER_TIME_INTERVAL": 22,     # the lease of a node: it leaves the torrent if it doesn't inform the tracker for that long (in seconds)
+        "TRACKER_LEASE_TICK": 1,    # the interval time that the tracker expires the leases of the nodes (in seconds)
+        "TRACKER_RECV_BATCH": 64,   # datagrams the tracker handles per wakeup before it writes its database log
+        "TRACKER_RCV_BUFFER": 1024 * 1024,  # SO_RCVBUF of the tracker socket, the queue of its pending requests
+        "TRACKER_SNAPSHOT_INTERVAL": 60,    # the interval time that the tracker writes a snapshot of its database (in seconds)
+        "TRACKER_SEARCH_OWNERS": 16,    # owners a node asks for when it searches a file, the fastest ones by the reports of the other nodes
+        "TRACKER_SEARCH_REPLY_SIZE": 1200,  # bytes of the largest search reply, a page holds as many owners as fit in it
+        # reliable transfer of chunk pieces (see transport.py); windows are counted in pieces, times are in seconds
+        "INITIAL_CWND": 10,         # congestion window at the start of a transfer
+        "MIN_CWND": 2,              # the window is never cut below this
+        "MAX_CWND": 512,            # upper bound of the congestion window
+        "ACK_EVERY": 2,             # in-order pieces received before an ack is sent (out of order ones are acked at once)
+        "ACK_DELAY": 0.005,         # an ack is never held back longer than this
+        "MAX_SACK_BLOCKS": 16,      # selective ack blocks carried by an ack
+        "INITIAL_RTO": 0.5,
+        "MIN_RTO": 0.05,
+        "MAX_RTO": 4,
+        "PACING_BURST": 16,         # pieces which may leave back-to-back before pacing applies
+        "REQUEST_RETRIES": 5,       # a chunk request is resent this many times if no piece comes back
+        "TRANSFER_IDLE_TIMEOUT": 10,    # a transfer is abandoned if the peer is silent for that long
+        "RCV_SOCKET_BUFFER": 4 * 1024 * 1024,   # SO_RCVBUF asked for the sockets which receive pieces
+        "MAX_RCV_SOCKET_BUFFER": 32 * 1024 * 1024,  # it grows up to this to hold a full window of large pieces
+        "UDP_GSO": True,            # on Linux, the pieces which leave together are segmented by the kernel (see endpoint.py)
+        "UDP_GRO": True,            # on Linux, the kernel coalesces the received pieces
+        "RECV_BATCH": 64,           # reads of the socket per wakeup when the endpoint reads it itself (with UDP_GRO)
+        # serving of the chunk requests (see upload_queue.py)
+        "MAX_UPLOAD_WORKERS": 32,   # chunks a node sends at the same time, the other requests wait in the queue
+        "MAX_UPLOADS_PER_REQUESTER": 4, # chunks sent at the same time to one requester
+        "UPLOAD_QUANTUM": 512 * 1024,   # bytes a requester may be sent in its turn before the next requester's turn
+        "UPLOAD_QUEUE_TIMEOUT": 8,  # a request waiting longer than this is dropped, its requester has given up on it (in seconds)
+        # compression of the pieces on the wire (see piece_codecs.py)
+        "COMPRESSION": True,        # pieces are compressed when both nodes agree on a codec and the data compresses
+        "COMPRESS_LEVEL": 1,        # level of zlib and zstd, the fastest
+        "COMPRESS_SAMPLE_SIZE": 16 * 1024,  # bytes of a chunk compressed to tell whether the chunk is worth compressing
+        "COMPRESS_MIN_SAVING": 0.1, # a chunk is compressed if its sample shrinks by at least this fraction
+        "COMPRESS_WORKERS": 4,      # threads compressing the pieces being sent
+        "COMPRESS_LOOKAHEAD": 64,   # pieces compressed ahead of the one being sent
+        "COMPRESS_MAX_BANDWIDTH": 50 * 1000 * 1000,    # pieces aren't compressed for the peers faster than that (bytes/s)
+        # caches of the uploading side (see file_cache.py)
+        "FILE_CACHE_SIZE": 64,      # files kept open and mapped for sending, 0 maps the file for every chunk
+        "PIECE_CACHE_SIZE": 64 * 1024 * 1024,  # bytes of the hot pieces kept in memory, 0 turns the cache off
+        "READAHEAD_HINTS": True,    # the kernel is told which ranges of a file are about to be sent
+        "HASH_WORKERS": 4,          # threads hashing pieces (see piece_hashes.py)
+        "MAX_PENDING_HASHES": 1024, # received pieces which may wait to be verified
+        # content-defined chunks (see chunk_store.py), the same on every node or their chunks never match
+        "CHUNK_DEDUP": True,        # the pieces of a download which the node already holds in other files are not downloaded
+        "CDC_MIN_SIZE": 16 * 1024,
+        "CDC_AVG_SIZE": 64 * 1024,
+        "CDC_MAX_SIZE": 256 * 1024,
+        # discovery of the owners over a Kademlia-style DHT instead of the tracker shards (see dht.py)
+        "DHT": False,               # the tracker is then only used to join the torrent
+        "DHT_K": 8,                 # contacts per bucket, and nodes which store a record
+        "DHT_ALPHA": 3,             # requests of a lookup in flight at once
+        "DHT_RPC_TIMEOUT": 0.25,    # a node which doesn't answer a DHT request within this (doubled at every retry) is dropped (in seconds)
+        "DHT_RPC_RETRIES": 1,
+        "DHT_BOOTSTRAP_CONTACTS": 16,   # nodes the registry gives to a node which joins the DHT
+        "DHT_MAX_OWNERS": 100,      # owners of a file in a reply
+        "DHT_REPUBLISH_INTERVAL": 60,   # the owners store their records again this often (in seconds)
+        "DHT_RECORD_TTL": 180,      # a record which is not stored again for that long expires (in seconds)
+        # logging (see utils.py)
+        "LOG_LEVEL": "INFO",        # DEBUG, INFO or WARNING: logs below this level are skipped
+        "LOG_FLUSH_INTERVAL": 0.2,  # the logs are written in batches, at most this late (in seconds)
+        "LOG_MAX_PENDING": 100000,  # log lines which may wait to be written, the next ones are dropped
+        "LOG_PROGRESS_INTERVAL": 1, # progress of a transfer is logged at most once per this interval (in seconds)
+        # metrics in the Prometheus format (see metrics.py), served with -metrics_port
+        "METRICS_HOST": "127.0.0.1",    # only local scrapers by default
+        "METRICS_TIMEOUT": 5        # a scrape whose request doesn't come within this many seconds is dropped
     },
     "tracker_requests_mode": {
         "REGISTER": 0,  # tells the tracker that it is in the torrent
         "OWN": 1,       # tells the tracker that it is now in sending mode for a specific file
         "NEED": 2,      # tells the torrent that it needs a file, so the file must be searched in torrent
         "UPDATE": 3,    # tells tracker that it's upload freq rate must be incremented)
-        "EXIT": 4       # tells the tracker that it left the torrent
+        "EXIT": 4,      # tells the tracker that it left the torrent (also sent by the registry to the other shards)
+        "BOOTSTRAP": 5  # asks the registry for a few nodes of the torrent, to join the DHT through them
     }
 }
 
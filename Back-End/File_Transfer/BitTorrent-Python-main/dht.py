@@ -0,0 +1,288 @@
+"""
+Discovery of the owners of a file over a Kademlia-style distributed hash table (DHT).
+
+With DHT on, the nodes keep the file -> owners records among themselves and
+the tracker is only used to join the torrent: a node asks the registry for a
+few nodes which are in it (BOOTSTRAP), and then looks up its own key, which
+fills its routing table and tells its neighbours about it.
+
+Nodes and files have a 64-bit key (a hash of the node id or of the
+filename), and the distance between two keys is their XOR. A node keeps up to
+DHT_K contacts per bucket, a bucket for each bit length of the distance to its
+own key, so it knows many nodes close to it and a few far from it. Buckets
+keep their contacts from the least to the most recently seen; a full bucket
+doesn't take new contacts, they wait in a replacement cache until a contact of
+the bucket stops answering.
+
+A lookup of a key asks DHT_ALPHA nodes at a time, the closest ones it knows
+which it hasn't asked yet, for the nodes they know closest to the key, until
+the DHT_K closest nodes it has heard of have all answered, so it takes
+O(log n) rounds. The owner of a file stores its record on the DHT_K nodes
+closest to the key of the filename, and stores it again every
+DHT_REPUBLISH_INTERVAL; a record expires after DHT_RECORD_TTL, so the owners
+which left the torrent disappear. A search looks up the key of the filename
+and stops at the first round which found owners.
+"""
+import asyncio
+import hashlib
+import random
+import time
+from messages.dht_message import DHTMessage, FIND_NODE, FIND_VALUE, STORE
+from messages.node2tracker import Node2Tracker
+from utils import log
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+KEY_BITS = 64
+
+
+def dht_key(name: str) -> int:
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=KEY_BITS // 8).digest(), "big")
+
+
+def node_key(node_id: int) -> int:
+    return dht_key(f"node{node_id}")
+
+
+class Contact:
+    __slots__ = ("node_id", "addr", "key")
+
+    def __init__(self, node_id: int, addr: tuple):
+        self.node_id = node_id
+        self.addr = tuple(addr)
+        self.key = node_key(node_id)
+
+    def __eq__(self, other) -> bool:
+        return self.node_id == other.node_id and self.addr == other.addr
+
+    def __hash__(self) -> int:
+        return hash((self.node_id, self.addr))
+
+
+class RoutingTable:
+    """
+    :param own_key: key of the node
+    :param k: contacts per bucket
+    """
+    def __init__(self, own_key: int, k: int):
+        self.own_key = own_key
+        self.k = k
+        self.buckets = [[] for _ in range(KEY_BITS)]        # from the least to the most recently seen
+        self.replacements = [[] for _ in range(KEY_BITS)]   # seen while their bucket was full
+
+    def bucket_of(self, key: int) -> int:
+        return (self.own_key ^ key).bit_length() - 1
+
+    def seen(self, contact: Contact):
+        '''
+        Records that the contact has just sent us a message
+        '''
+        if contact.key == self.own_key:
+            return
+        index = self.bucket_of(contact.key)
+        bucket = self.buckets[index]
+        if contact in bucket:
+            bucket.remove(contact)
+            bucket.append(contact)
+        elif len(bucket) < self.k:
+            bucket.append(contact)
+        else:
+            replacements = self.replacements[index]
+            if contact in replacements:
+                replacements.remove(contact)
+            replacements.append(contact)
+            del replacements[:-self.k]
+
+    def remove(self, contact: Contact):
+        '''
+        Forgets a contact which didn't answer, the most recently seen replacement takes its place
+        '''
+        index = self.bucket_of(contact.key)
+        bucket = self.buckets[index]
+        if contact in bucket:
+            bucket.remove(contact)
+            if self.replacements[index]:
+                bucket.append(self.replacements[index].pop())
+
+    def closest(self, key: int, count: int) -> list:
+        contacts = [contact for bucket in self.buckets for contact in bucket]
+        contacts.sort(key=lambda contact: contact.key ^ key)
+        return contacts[:count]
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self.buckets)
+
+
+class RecordStore:
+    """
+    The owners of the files whose records are stored on this node
+    """
+    def __init__(self):
+        self.records = {}   # filename -> {(node_id, addr): when the record expires}
+
+    def put(self, filename: str, node_id: int, addr: tuple, now: float):
+        self.records.setdefault(filename, {})[(node_id, tuple(addr))] = now + config.constants.DHT_RECORD_TTL
+
+    def get(self, filename: str, now: float) -> list:
+        owners = self.records.get(filename)
+        if not owners:
+            return []
+        return [owner for owner, expires_at in owners.items() if expires_at > now]
+
+    def purge(self, now: float):
+        for filename in list(self.records):
+            owners = {owner: expires_at for owner, expires_at in self.records[filename].items() if expires_at > now}
+            if owners:
+                self.records[filename] = owners
+            else:
+                del self.records[filename]
+
+
+class DHT:
+    """
+    The DHT side of a node, on its endpoint.
+
+    :param endpoint: endpoint of the node, the DHT requests of the peers must be handed to ``handle()``
+    :param registry: address of the tracker registry, which the node joins the DHT through
+    """
+    def __init__(self, endpoint, node_id: int, registry: tuple):
+        self.endpoint = endpoint
+        self.node_id = node_id
+        self.key = node_key(node_id)
+        self.registry = tuple(registry)
+        self.table = RoutingTable(own_key=self.key, k=config.constants.DHT_K)
+        self.records = RecordStore()
+        self.announced = set()  # files this node owns, their records are stored again periodically
+        self.rpc_count = 0      # requests sent to other nodes
+
+    async def bootstrap(self) -> bool:
+        '''
+        Joins the DHT through the nodes the registry knows
+
+        :return: whether the node knows other nodes of the DHT, it doesn't if it is the first one
+        '''
+        msg = Node2Tracker(node_id=self.node_id,
+                           mode=config.tracker_requests_mode.BOOTSTRAP,
+                           filename="")
+        reply = await self.endpoint.request(msg=msg, addr=self.registry)
+        if reply is None:
+            return False
+        for owner, _ in reply["search_result"]:
+            if owner["node_id"] != self.node_id:
+                self.table.seen(Contact(owner["node_id"], owner["addr"]))
+        await self.lookup(self.key)
+        return len(self.table) > 0
+
+    async def rpc(self, contact: Contact, msg: DHTMessage):
+        '''
+        :return: the reply of the contact, or None if it doesn't answer (it is then removed from the routing table)
+        '''
+        self.rpc_count += 1
+        reply = await self.endpoint.request(msg=msg, addr=contact.addr,
+                                            retries=config.constants.DHT_RPC_RETRIES,
+                                            timeout=config.constants.DHT_RPC_TIMEOUT)
+        if reply is not None and "contacts" not in reply:
+            reply = None    # not an answer to a DHT request
+        if reply is None:
+            self.table.remove(contact)
+        else:
+            self.table.seen(contact)
+        return reply
+
+    def handle(self, msg: dict, addr: tuple):
+        '''
+        Answers a DHT request of another node, a malformed one is dropped
+        '''
+        try:
+            self.answer(msg, addr)
+        except (KeyError, IndexError, ValueError) as e:
+            log(node_id=self.node_id, content=f"A malformed DHT request from {addr} is dropped: {e!r}")
+
+    def answer(self, msg: dict, addr: tuple):
+        self.table.seen(Contact(msg["node_id"], addr))
+        kind = msg["dht_kind"]
+        reply = DHTMessage(node_id=self.node_id, kind=kind)
+        if kind == STORE:
+            # the owner stores its own record, from its own address
+            self.records.put(msg["filename"], msg["node_id"], addr, now=time.monotonic())
+        elif kind in (FIND_NODE, FIND_VALUE):
+            reply.target = msg["target"]
+            reply.contacts = [(contact.node_id, contact.addr)
+                              for contact in self.table.closest(msg["target"], config.constants.DHT_K)]
+            if kind == FIND_VALUE:
+                owners = self.records.get(msg["filename"], now=time.monotonic())
+                reply.owners = random.sample(owners, min(len(owners), config.constants.DHT_MAX_OWNERS))
+        self.endpoint.send(reply.in_reply_to(msg).encode(), addr)
+
+    async def lookup(self, target: int, filename: str = None) -> tuple:
+        '''
+        Iterative lookup of the nodes closest to target
+
+        :param filename: if given, the owners of that file are looked for (target is its key), and
+            the lookup stops at the first round which finds some
+        :return: (the closest contacts which answered, the owners found as (node_id, addr))
+        '''
+        k = config.constants.DHT_K
+        shortlist = self.table.closest(target, k)
+        queried = set()
+        answered = set()
+        owners = set()
+        while True:
+            candidates = [contact for contact in shortlist if contact not in queried][:config.constants.DHT_ALPHA]
+            if not candidates:
+                break
+            queried.update(candidates)
+            kind = FIND_NODE if filename is None else FIND_VALUE
+            replies = await asyncio.gather(*(self.rpc(contact, DHTMessage(node_id=self.node_id, kind=kind,
+                                                                           target=target, filename=filename or ""))
+                                             for contact in candidates))
+            known = set(shortlist)
+            for contact, reply in zip(candidates, replies):
+                if reply is None:
+                    known.discard(contact)
+                    continue
+                answered.add(contact)
+                known.update(Contact(node_id, addr) for node_id, addr in reply["contacts"] if node_id != self.node_id)
+                owners.update(reply["owners"])
+            shortlist = sorted(known, key=lambda contact: contact.key ^ target)[:k]
+            if owners:
+                break
+        return [contact for contact in shortlist if contact in answered], owners
+
+    async def store(self, filename: str):
+        '''
+        Stores the record of the file, owned by this node, on the nodes closest to its key
+        '''
+        closest, _ = await self.lookup(dht_key(filename))
+        msg = DHTMessage(node_id=self.node_id, kind=STORE, target=dht_key(filename), filename=filename)
+        await asyncio.gather(*(self.rpc(contact, msg) for contact in closest))
+
+    async def announce(self, filename: str):
+        self.announced.add(filename)
+        await self.store(filename)
+
+    async def find_owners(self, filename: str) -> list:
+        '''
+        :return: (node_id, addr) of the owners of the file
+        '''
+        owners = set(self.records.get(filename, now=time.monotonic()))
+        _, found = await self.lookup(dht_key(filename), filename=filename)
+        return list(owners | found)
+
+    async def maintain(self, interval: float):
+        '''
+        Stores the records of the files of the node again, forgets the expired records
+        of the others, and looks up its own key to keep its neighbours fresh
+        '''
+        loop = asyncio.get_running_loop()
+        next_call = loop.time()
+        while True:
+            next_call = next_call + interval
+            await asyncio.sleep(next_call - loop.time())
+            self.records.purge(now=time.monotonic())
+            if not len(self.table):
+                await self.bootstrap()
+            else:
+                await self.lookup(self.key)
+            for filename in list(self.announced):
+                await self.store(filename)
@@ -0,0 +1,252 @@
+import asyncio
+import os
+import functools
+import mmap
+import struct
+import threading
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+PART_SUFFIX = ".part"
+BITFIELD_SUFFIX = ".bitfield"
+RESUME_READ_PIECES = 64     # pieces of the part file read at once to be verified again when a download resumes
+
+
+def read_at(fd: int, size: int, offset: int, lock: threading.Lock) -> bytes:
+    '''
+    Reads size bytes of fd at offset, with a seek under lock where there is no positional read
+    '''
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    with lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+
+def write_at(fd: int, data: bytes, offset: int, lock: threading.Lock):
+    '''
+    Writes data in fd at offset, with a seek under lock where there is no positional write
+    '''
+    if hasattr(os, "pwrite"):
+        os.pwrite(fd, data, offset)
+    else:
+        with lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+
+
+class PieceBitfield:
+    """
+    The hashed pieces of a download which are verified and written in the part
+    file, one bit each, in a file mapped next to it (``<filename>.bitfield``).
+
+    Its header holds the merkle root of the manifest of the download, so the
+    bits of another version of the file are never taken. A bit is set once its
+    piece is written, and the mapping is written back by the kernel even if the
+    node is killed. A machine which crashes may however keep a bit whose piece
+    didn't reach the disk: the pieces are verified again when a download resumes.
+    """
+    # magic, version, file_size, piece_size, pieces_count, merkle root
+    layout = struct.Struct("!4sBQII32s")
+    MAGIC = b"VQBF"
+    VERSION = 1
+
+    def __init__(self, path: str, manifest):
+        self.path = path
+        self.pieces_count = manifest.pieces_count
+        header = self.layout.pack(self.MAGIC, self.VERSION, manifest.file_size, manifest.piece_size,
+                                  manifest.pieces_count, manifest.root)
+        size = self.layout.size + (self.pieces_count + 7) // 8
+        self.lock = threading.Lock()    # the pieces are marked on the hashing threads, and share bytes
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            if os.fstat(self.fd).st_size != size or read_at(self.fd, self.layout.size, 0, self.lock) != header:
+                # a bitfield of another download of this name, or none: nothing is downloaded yet
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, size)
+                write_at(self.fd, header, 0, self.lock)
+            self.mm = mmap.mmap(self.fd, size)
+        except (OSError, ValueError):
+            os.close(self.fd)
+            raise
+
+    def __contains__(self, index: int) -> bool:
+        return bool(self.mm[self.layout.size + index // 8] & (1 << (index % 8)))
+
+    def set(self, index: int, value: bool = True):
+        position = self.layout.size + index // 8
+        with self.lock:
+            if value:
+                self.mm[position] |= 1 << (index % 8)
+            else:
+                self.mm[position] &= ~(1 << (index % 8)) & 0xFF
+
+    def indices(self) -> list:
+        return [index for index in range(self.pieces_count) if index in self]
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class DownloadSink:
+    """
+    Destination of a file which is being downloaded.
+
+    The file is preallocated as ``<file_path>.part`` and every piece is written
+    at its final offset as soon as it arrives, so a download needs constant
+    memory whatever the size of the file. When all the pieces are written,
+    ``finalize()`` renames the part file to its real name. If a verifier is
+    given, pieces are handed to it and only written once checked against
+    their digest.
+
+    With a verifier, the pieces written are also marked in a ``PieceBitfield``
+    next to the part file. A download which was interrupted (the node died, or
+    every owner left) keeps both files: when the file is downloaded again,
+    ``resume()`` verifies the pieces the bitfield marks, and only the others
+    are to be downloaded.
+
+    The pieces on the wire need not be the hashed pieces of the manifest: a
+    large piece is cut into the hashed pieces it holds, and the parts of a
+    hashed piece which come in several small pieces are put together in
+    memory until it is whole, and then verified.
+    """
+    def __init__(self, file_path: str, file_size: int, verifier=None):
+        self.file_path = file_path
+        self.part_path = file_path + PART_SUFFIX
+        self.file_size = file_size
+        self.verifier = verifier
+        self.fd = os.open(self.part_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        self.lock = threading.Lock()    # only needed where there is no positional read and write
+        self.partial = {}               # index of a hashed piece -> (its buffer, [start, end) parts received)
+        if os.fstat(self.fd).st_size > file_size:
+            os.ftruncate(self.fd, file_size)
+        if hasattr(os, "posix_fallocate") and file_size > 0:
+            os.posix_fallocate(self.fd, 0, file_size)
+        else:
+            os.ftruncate(self.fd, file_size)
+        self.bitfield = None
+        if verifier is not None:
+            try:
+                self.bitfield = PieceBitfield(file_path + BITFIELD_SUFFIX, verifier.manifest)
+            except (OSError, ValueError):
+                os.close(self.fd)
+                raise
+
+    async def resume(self) -> int:
+        '''
+        Verifies again the pieces of an interrupted download which its bitfield marks as written
+
+        :return: the number of pieces which are verified, and need not be downloaded
+        '''
+        if self.bitfield is None:
+            return 0
+        claimed = self.bitfield.indices()
+        if not claimed:
+            return 0
+        loop = asyncio.get_running_loop()
+        hash_size = self.verifier.manifest.piece_size
+        for first in range(0, len(claimed), RESUME_READ_PIECES):
+            batch = claimed[first: first + RESUME_READ_PIECES]
+            pieces = await loop.run_in_executor(None, self.read_pieces, batch, hash_size)
+            for index, piece in zip(batch, pieces):
+                # it is in the file already, there is nothing to write
+                await self.verifier.submit(index, piece, on_valid=lambda: None)
+        missing = await self.verifier.wait_pieces(0, self.verifier.manifest.pieces_count)
+        for index in claimed:
+            if index in missing:
+                self.bitfield.set(index, False)
+        return len(claimed) - len(missing.intersection(claimed))
+
+    def read_pieces(self, indices: list, hash_size: int) -> list:
+        return [read_at(self.fd, min(hash_size, self.file_size - index * hash_size), index * hash_size, self.lock)
+                for index in indices]
+
+    async def write_piece(self, rng: tuple, idx: int, piece: bytes, piece_size: int):
+        '''
+        Writes the idx-th piece of the chunk with range of rng at its offset
+
+        :param rng: range of the chunk which the piece belongs to
+        :param idx: index of the piece in the chunk
+        :param piece: bytes (or memoryview) of the piece
+        :param piece_size: size of the pieces the chunk is split into
+        :raises ValueError: if the piece is not within the file
+        '''
+        offset = rng[0] + idx * piece_size
+        if idx < 0 or offset < 0 or offset + len(piece) > self.file_size:
+            raise ValueError(f"piece {idx} of {rng} is out of the file")
+        if self.verifier is None:
+            self.write_at(offset, piece)
+            return
+        # ranges of verified downloads are aligned on hashed pieces
+        hash_size = self.verifier.manifest.piece_size
+        end = offset + len(piece)
+        start = offset
+        while start < end:
+            index = start // hash_size
+            if index >= self.verifier.manifest.pieces_count:
+                raise ValueError(f"piece {idx} of {rng} is out of the manifest")
+            hash_start = index * hash_size
+            hash_end = min(hash_start + hash_size, self.file_size)
+            part_end = min(end, hash_end)
+            part = piece[start - offset: part_end - offset]
+            if self.verifier.verified[index]:
+                part = None     # a late copy
+                self.partial.pop(index, None)
+            elif start != hash_start or part_end != hash_end:
+                part = self.assemble(index, start - hash_start, part, hash_end - hash_start)
+            else:
+                # a whole copy, e.g. from a peer with larger pieces: the parts received so far are of no use
+                self.partial.pop(index, None)
+            if part is not None:
+                await self.verifier.submit(index, part, on_valid=functools.partial(self.write_verified, index, hash_start, part))
+            start = part_end
+
+    def assemble(self, index: int, start: int, part: bytes, length: int):
+        '''
+        Puts a part of the index-th hashed piece in place
+
+        :return: the whole hashed piece once all of its parts are received, else None
+        '''
+        buffer, parts = self.partial.setdefault(index, (bytearray(length), []))
+        buffer[start: start + len(part)] = part
+        parts.append((start, start + len(part)))
+        # parts may be received twice, or overlap if they come from peers with other piece sizes
+        parts.sort()
+        covered = 0
+        for part_start, part_end in parts:
+            if part_start > covered:
+                return None
+            covered = max(covered, part_end)
+        if covered < length:
+            return None
+        del self.partial[index]
+        return bytes(buffer)
+
+    def write_at(self, offset: int, data: bytes):
+        write_at(self.fd, data, offset, self.lock)
+
+    def write_verified(self, index: int, offset: int, data: bytes):
+        self.write_at(offset, data)
+        self.bitfield.set(index)
+
+    def finalize(self):
+        self.partial.clear()
+        os.fsync(self.fd)
+        os.close(self.fd)
+        os.replace(self.part_path, self.file_path)
+        if self.bitfield is not None:
+            self.bitfield.remove()
+
+    def close(self):
+        '''
+        Stops the download, its part file and bitfield are kept so that it can be resumed
+        '''
+        self.partial.clear()
+        os.close(self.fd)
+        if self.bitfield is not None:
+            self.bitfield.close()
@@ -0,0 +1,333 @@
+"""
+The one UDP socket of a node, shared by all of its exchanges.
+
+Every message carries a request id (see ``messages/message.py``). The node
+which starts an exchange picks a fresh id, and every answer of the peer
+(a reply, or the pieces of a chunk) carries that id with the reply flag. So:
+- a reply goes to the exchange which was opened with its id, if it comes
+  from the peer the exchange was opened with,
+- a message which is not a reply either belongs to an exchange the node is
+  serving (the acks of a chunk it sends), keyed by (peer address, id),
+- or it starts a new exchange, and goes to the request handler of the node.
+
+Exchanges get their messages through an ``asyncio.Queue``, so the whole node
+runs on one event loop and one socket instead of a thread and a socket per
+request. The endpoint reads the socket when the event loop tells it is
+readable, and queues the datagrams the socket can't take until it is writable.
+
+On Linux, the socket offloads the segmentation of the pieces to the kernel
+when it can (``UDP_GSO``, ``UDP_GRO`` in ``configs.py``):
+- ``send_many()`` hands a run of datagrams of the same size to one
+  ``sendmsg()`` with a ``UDP_SEGMENT`` size, and the kernel cuts it back
+  into datagrams (only the last one of a run may be shorter),
+- with ``UDP_GRO`` the kernel coalesces the datagrams of a flow which arrive
+  together, and tells their size in the ancillary data of ``recvmsg()``.
+Where these options are missing, datagrams are sent and received one by one.
+"""
+import asyncio
+import errno
+import functools
+import itertools
+from collections import deque
+import socket
+import struct
+import sys
+
+from utils import set_socket, free_socket, send_datagram
+from messages.message import Message
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+# the socket module doesn't always export these Linux options, which turn IP fragmentation off
+IP_MTU_DISCOVER = getattr(socket, "IP_MTU_DISCOVER", 10 if sys.platform.startswith("linux") else None)
+IP_PMTUDISC_DO = getattr(socket, "IP_PMTUDISC_DO", 2)
+# nor these ones, of UDP segmentation offload
+SOL_UDP = getattr(socket, "SOL_UDP", 17)
+UDP_SEGMENT = getattr(socket, "UDP_SEGMENT", 103 if sys.platform.startswith("linux") else None)
+UDP_GRO = getattr(socket, "UDP_GRO", 104 if sys.platform.startswith("linux") else None)
+MAX_GSO_SEGMENTS = 64       # UDP_MAX_SEGMENTS of the kernel
+GRO_BUFFER_SIZE = 65535     # a coalesced read is never larger than an IP packet
+GRO_CMSG_SIZE = socket.CMSG_SPACE(4) if hasattr(socket, "CMSG_SPACE") else 0
+
+# the kernel can't segment on this socket after all, e.g. the device doesn't checksum segments
+GSO_UNSUPPORTED = {errno.EIO, errno.ENOPROTOOPT, errno.EOPNOTSUPP}
+
+
+def enable_udp_option(sock: socket.socket, option, value: int) -> bool:
+    '''
+    :return: whether the socket accepted the option
+    '''
+    if option is None or not hasattr(sock, "sendmsg") or sock.family != socket.AF_INET:
+        return False
+    try:
+        sock.setsockopt(SOL_UDP, option, value)
+        return True
+    except OSError:
+        return False
+
+
+@functools.lru_cache(maxsize=1024)
+def resolve_host(host: str) -> str:
+    '''
+    :return: the IPv4 address of host (e.g. "localhost"), as the socket tells where a datagram comes from
+    '''
+    try:
+        return socket.gethostbyname(host)
+    except OSError:
+        return host
+
+
+def datagram_size(data) -> int:
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    return sum(len(buf) for buf in data)
+
+
+class Endpoint:
+    """
+    :param port: port the socket is bound to
+    :param on_request: called with (msg, addr) for every message which starts a new exchange
+    """
+    def __init__(self, port: int, on_request):
+        self.on_request = on_request
+        self.sock = set_socket(port)
+        self.sock.setblocking(False)
+        self.loop = None
+        self.pending = deque()  # (datagram, addr) waiting for the socket to be writable
+        self.rcv_buffer = 0     # SO_RCVBUF asked for the socket
+        self.gso = False        # send_many() segments in the kernel
+        self.gro = False        # the kernel coalesces the received datagrams
+        self.requests = {}      # req_id -> (peer addr, inbox) of the exchanges started by this node
+        self.streams = {}       # (peer addr, req_id) -> inbox of the exchanges served by this node
+        self._req_ids = itertools.count(1)
+
+    async def open(self):
+        '''
+        Starts receiving on the event loop which is running
+        '''
+        self.reserve_receive_buffer(config.constants.RCV_SOCKET_BUFFER)
+        self.gso = config.constants.UDP_GSO and enable_udp_option(self.sock, UDP_SEGMENT, 0)
+        self.gro = config.constants.UDP_GRO and enable_udp_option(self.sock, UDP_GRO, 1)
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.sock.fileno(), self.on_readable)
+
+    def close(self):
+        if self.loop is not None:
+            self.loop.remove_reader(self.sock.fileno())
+            self.loop.remove_writer(self.sock.fileno())
+            self.loop = None
+        self.pending.clear()
+        if self.sock is not None:
+            free_socket(self.sock)
+            self.sock = None
+
+    @property
+    def port(self) -> int:
+        return self.sock.getsockname()[1]
+
+    def datagram_received(self, data: bytes, addr: tuple):
+        try:
+            msg = Message.decode(data)
+        except (ValueError, IndexError):
+            return
+        if msg["is_reply"]:
+            # a reply from anyone but the peer which was asked is dropped, whatever its id
+            peer, inbox = self.requests.get(msg["req_id"], (None, None))
+            if peer != addr:
+                return
+        else:
+            inbox = self.streams.get((addr, msg["req_id"]))
+            if inbox is None:
+                self.on_request(msg, addr)
+                return
+        if inbox is not None:
+            inbox.put_nowait(msg)
+
+    def on_readable(self):
+        '''
+        Receives the datagrams waiting in the socket (at most RECV_BATCH reads),
+        and splits the coalesced ones
+        '''
+        for _ in range(config.constants.RECV_BATCH):
+            if self.loop is None:
+                return
+            try:
+                if self.gro:
+                    data, ancdata, _, addr = self.sock.recvmsg(GRO_BUFFER_SIZE, GRO_CMSG_SIZE)
+                else:
+                    (data, addr), ancdata = self.sock.recvfrom(GRO_BUFFER_SIZE), ()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # e.g. an ICMP error of an earlier datagram
+                continue
+            segment_size = len(data)
+            for level, kind, value in ancdata:
+                if level == SOL_UDP and kind == UDP_GRO:
+                    segment_size = int.from_bytes(value[:4], sys.byteorder)
+            if segment_size >= len(data):
+                self.datagram_received(data, addr)
+                continue
+            for start in range(0, len(data), segment_size):
+                self.datagram_received(data[start: start + segment_size], addr)
+
+    def send(self, data, addr: tuple):
+        '''
+        :param data: bytes, or a list of buffers which form the datagram
+        '''
+        if self.loop is None:
+            return
+        if not self.pending:
+            # nothing is queued before it, so it may go straight to the kernel without being joined
+            try:
+                send_datagram(sock=self.sock, data=data, addr=addr)
+                return
+            except (BlockingIOError, InterruptedError):
+                self.loop.add_writer(self.sock.fileno(), self.on_writable)
+            except OSError:
+                return  # a datagram may be lost anyway
+        # the socket buffer is full: it is queued, joined as its buffers may not outlive this call
+        self.pending.append((data if isinstance(data, (bytes, bytearray)) else b"".join(data), addr))
+
+    def on_writable(self):
+        while self.pending:
+            data, addr = self.pending[0]
+            try:
+                self.sock.sendto(data, addr)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                pass
+            self.pending.popleft()
+        self.loop.remove_writer(self.sock.fileno())
+
+    def send_many(self, datagrams: list, addr: tuple):
+        '''
+        Sends datagrams in order, the runs of datagrams of the same size in one system call each if GSO is on
+
+        :param datagrams: list of datagrams, each of them bytes or a list of buffers
+        '''
+        idx = 0
+        while idx < len(datagrams):
+            if not self.gso or self.loop is None or self.pending:
+                self.send(datagrams[idx], addr)
+                idx += 1
+                continue
+            size = datagram_size(datagrams[idx])
+            end, total = idx + 1, size
+            while end < len(datagrams) and end - idx < MAX_GSO_SEGMENTS:
+                next_size = datagram_size(datagrams[end])
+                if next_size > size or total + next_size > config.constants.LOOPBACK_DATAGRAM_SIZE:
+                    break
+                end, total = end + 1, total + next_size
+                if next_size < size:
+                    break   # only the last segment may be shorter
+            if end - idx == 1:
+                self.send(datagrams[idx], addr)
+                idx = end
+                continue
+            buffers = []
+            for data in datagrams[idx: end]:
+                if isinstance(data, (bytes, bytearray)):
+                    buffers.append(data)
+                else:
+                    buffers.extend(data)
+            try:
+                self.sock.sendmsg(buffers, [(SOL_UDP, UDP_SEGMENT, struct.pack("=H", size))], 0, addr)
+            except (BlockingIOError, InterruptedError):
+                # the socket buffer is full, send() queues them
+                for data in datagrams[idx: end]:
+                    self.send(data, addr)
+            except OSError as e:
+                # e.g. the segments are larger than the MTU of the device: they go one by one
+                if e.errno in GSO_UNSUPPORTED:
+                    self.gso = False
+                for data in datagrams[idx: end]:
+                    self.send(data, addr)
+            idx = end
+
+    def reserve_receive_buffer(self, size: int):
+        '''
+        Grows the receive buffer of the socket to size bytes (up to MAX_RCV_SOCKET_BUFFER), it is never shrunk
+        '''
+        size = min(size, config.constants.MAX_RCV_SOCKET_BUFFER)
+        if size <= self.rcv_buffer:
+            return
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, size)
+            self.rcv_buffer = size
+        except OSError:
+            pass
+
+    @property
+    def can_send_unfragmented(self) -> bool:
+        return IP_MTU_DISCOVER is not None and self.sock is not None and self.sock.family == socket.AF_INET
+
+    def send_unfragmented(self, data, addr: tuple) -> bool:
+        '''
+        Sends a datagram with IP fragmentation turned off (the don't fragment bit is set),
+        so it is dropped on the way if it is larger than the MTU of the path
+
+        :return: False if it can't be sent, e.g. it is larger than the MTU of the local interface
+        '''
+        if self.loop is None:
+            return False
+        previous = self.sock.getsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER)
+        try:
+            self.sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+            send_datagram(sock=self.sock, data=data, addr=addr)
+            return True
+        except OSError:
+            return False
+        finally:
+            self.sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, previous)
+
+    def open_exchange(self, addr: tuple):
+        '''
+        Opens an exchange started by this node with the peer at addr, only its replies go to the inbox
+
+        :return: (request id to put in the request, inbox of the replies)
+        '''
+        req_id = next(self._req_ids) & 0xFFFFFFFF
+        inbox = asyncio.Queue()
+        self.requests[req_id] = ((resolve_host(addr[0]), addr[1]), inbox)
+        return req_id, inbox
+
+    def close_exchange(self, req_id: int):
+        self.requests.pop(req_id, None)
+
+    def open_stream(self, addr: tuple, req_id: int) -> asyncio.Queue:
+        '''
+        Opens an exchange served by this node, the later messages of the peer go to the returned inbox
+        '''
+        inbox = asyncio.Queue()
+        self.streams[(addr, req_id)] = inbox
+        return inbox
+
+    def close_stream(self, addr: tuple, req_id: int):
+        self.streams.pop((addr, req_id), None)
+
+    async def request(self, msg: Message, addr: tuple, retries: int = None, timeout: float = None):
+        '''
+        Sends a request and waits for its reply. The request is sent again (with
+        the same id) if no reply comes, as a datagram or its reply may be lost.
+
+        :param retries: times the request is sent again, REQUEST_RETRIES by default
+        :param timeout: wait for the first reply, INITIAL_RTO by default (it doubles at every retry)
+        :return: the decoded reply, or None if the peer never replied
+        '''
+        req_id, inbox = self.open_exchange(addr)
+        msg.req_id = req_id
+        data = msg.encode()
+        timeout = config.constants.INITIAL_RTO if timeout is None else timeout
+        retries = config.constants.REQUEST_RETRIES if retries is None else retries
+        try:
+            for _ in range(retries + 1):
+                self.send(data, addr)
+                try:
+                    return await asyncio.wait_for(inbox.get(), timeout)
+                except asyncio.TimeoutError:
+                    timeout = min(timeout * 2, config.constants.MAX_RTO)
+            return None
+        finally:
+            self.close_exchange(req_id)
@@ -0,0 +1,190 @@
+"""
+Caches of the uploading side: the files being served stay mapped, and the hot pieces stay in memory.
+
+``FileCache`` keeps up to FILE_CACHE_SIZE files open and mapped read-only,
+keyed by path and checked against the inode, mtime and size of the file, so
+a popular file is mapped once for all the chunks served from it instead of
+once per chunk, and its pages stay mapped. When a chunk is requested, the
+kernel is told that its range will be read (``MADV_WILLNEED`` on the mapping,
+``POSIX_FADV_WILLNEED`` on the file), so it reads the range ahead while the
+first pieces leave; the file is also read sequentially (``POSIX_FADV_SEQUENTIAL``,
+a larger readahead). ``MADV_SEQUENTIAL`` is not used, as it lets the kernel
+drop the pages right after they are read, which a file served to many peers
+reads again.
+
+``PieceCache`` keeps the pieces which are requested again, up to
+PIECE_CACHE_SIZE bytes, in least recently used order, keyed by the file
+version, their range and their codec, so a hot piece is sent again without
+reading the file (or compressing it again, see ``piece_codecs.py``). A piece
+is only kept the second time it is sent: a large file sent once goes through
+without evicting the hot pieces.
+"""
+import mmap
+import os
+from collections import OrderedDict
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+
+def file_version(st: os.stat_result) -> tuple:
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+class MappedFile:
+    """
+    A file mapped read-only, shared by the chunks being sent from it
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        try:
+            st = os.fstat(self.fd)
+            self.version = file_version(st)
+            self.size = st.st_size
+            # a file can't be mapped empty, an empty one has no pieces to send anyway
+            self.mm = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ) if self.size else None
+        except (OSError, ValueError):
+            os.close(self.fd)
+            raise
+        self.view = memoryview(self.mm) if self.mm is not None else memoryview(b"")
+        self.users = 0      # chunks being sent from it
+        if config.constants.READAHEAD_HINTS and hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def will_need(self, start: int, end: int):
+        '''
+        Tells the kernel to read the range [start, end) ahead
+        '''
+        if not config.constants.READAHEAD_HINTS or self.mm is None or end <= start:
+            return
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self.fd, start, end - start, os.POSIX_FADV_WILLNEED)
+        if hasattr(self.mm, "madvise") and hasattr(mmap, "MADV_WILLNEED"):
+            # madvise() wants a start aligned on a page
+            aligned = start - start % mmap.PAGESIZE
+            self.mm.madvise(mmap.MADV_WILLNEED, aligned, min(end, self.size) - aligned)
+
+    def is_current(self) -> bool:
+        try:
+            return file_version(os.stat(self.path)) == self.version
+        except OSError:
+            return False
+
+    def close(self) -> bool:
+        '''
+        :return: False if it can't be closed yet, a piece of it is still referenced
+        '''
+        try:
+            self.view.release()
+            if self.mm is not None:
+                self.mm.close()
+        except BufferError:
+            return False
+        os.close(self.fd)
+        return True
+
+
+class FileCache:
+    """
+    The files mapped for sending, up to max_files of them (0 maps every chunk on its own)
+    """
+    def __init__(self, max_files: int):
+        self.max_files = max_files
+        self.files = OrderedDict()  # path -> MappedFile, the least recently used first
+        self.closing = []           # dropped from the cache while still used
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, path: str) -> MappedFile:
+        '''
+        :return: the file mapped, which must be given back with release()
+        :raises OSError: if the file can't be opened
+        '''
+        mapped = self.files.get(path)
+        if mapped is not None and mapped.is_current():
+            self.files.move_to_end(path)
+            self.hits += 1
+        else:
+            if mapped is not None:
+                self.drop(path)
+            mapped = MappedFile(path)
+            self.misses += 1
+            if self.max_files > 0:
+                self.files[path] = mapped
+                while len(self.files) > self.max_files:
+                    self.drop(next(iter(self.files)))
+        mapped.users += 1
+        return mapped
+
+    def release(self, mapped: MappedFile):
+        mapped.users -= 1
+        if mapped.users == 0 and self.files.get(mapped.path) is not mapped:
+            self.closing.append(mapped)
+        self.close_unused()
+
+    def drop(self, path: str):
+        mapped = self.files.pop(path)
+        if mapped.users == 0:
+            self.closing.append(mapped)
+
+    def close_unused(self):
+        self.closing = [mapped for mapped in self.closing if mapped.users > 0 or not mapped.close()]
+
+    def close(self):
+        for path in list(self.files):
+            self.drop(path)
+        self.close_unused()
+
+
+class PieceCache:
+    """
+    Byte-bounded LRU of the pieces sent more than once
+
+    :param max_bytes: bytes of the pieces kept, 0 turns the cache off
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.pieces = OrderedDict()     # key -> bytes, the least recently used first
+        self.size = 0
+        # keys of the pieces sent once, a piece is kept when it is sent again
+        self.seen = OrderedDict()
+        self.hits = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self.pieces
+
+    def get(self, key):
+        piece = self.pieces.get(key)
+        if piece is not None:
+            self.pieces.move_to_end(key)
+            self.hits += 1
+        return piece
+
+    def wants(self, key) -> bool:
+        '''
+        Records that the piece of key is sent (not from the cache)
+
+        :return: whether it is hot, and should be put in the cache
+        '''
+        if self.max_bytes <= 0:
+            return False
+        if key in self.seen:
+            del self.seen[key]
+            return True
+        self.seen[key] = None
+        # as many keys as pieces of a few KB would fill the cache
+        while len(self.seen) > max(self.max_bytes // 4096, 1):
+            self.seen.popitem(last=False)
+        return False
+
+    def put(self, key, piece: bytes):
+        if len(piece) > self.max_bytes:
+            return
+        old = self.pieces.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self.pieces[key] = piece
+        self.size += len(piece)
+        while self.size > self.max_bytes:
+            _, evicted = self.pieces.popitem(last=False)
+            self.size -= len(evicted)
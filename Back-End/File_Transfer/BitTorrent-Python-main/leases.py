@@ -0,0 +1,71 @@
+"""
+Leases of the nodes in the torrent, kept by the tracker in a hashed timing wheel.
+
+A node holds a lease which it renews each time it informs the tracker that it
+is still in the torrent. The wheel is a ring of slots, one per tick of time;
+a lease sits in the slot of the tick it expires at. Renewing a lease moves it
+to another slot, and every tick only the slot of that tick is emptied, so the
+work is proportional to the leases which expire, not to the number of nodes.
+"""
+import math
+
+
+class LeaseWheel:
+    """
+    The wheel covers a bit more than one lease period, so a lease normally
+    expires the first time its slot comes round. If the ticks are processed
+    late, a lease renewed meanwhile may be due a whole turn later, so the
+    tick a lease is due at is kept and checked when its slot is emptied.
+    Times are given by the caller, in seconds of a monotonic clock.
+    """
+    def __init__(self, lease: float, tick: float, now: float):
+        self.lease = lease
+        self.tick = tick
+        self.slots = [set() for _ in range(math.ceil(lease / tick) + 2)]
+        self.due_tick = {}      # key -> tick its lease expires at
+        self.start_time = now
+        self.ticks = 0          # ticks already processed
+
+    def __len__(self) -> int:
+        return len(self.due_tick)
+
+    def __contains__(self, key) -> bool:
+        return key in self.due_tick
+
+    def __iter__(self):
+        return iter(self.due_tick)
+
+    def renew(self, key, now: float):
+        '''
+        Gives the key a lease which expires one lease period from now
+        '''
+        due_tick = max(math.ceil((now + self.lease - self.start_time) / self.tick), self.ticks + 1)
+        old_due_tick = self.due_tick.get(key)
+        if old_due_tick == due_tick:
+            return
+        if old_due_tick is not None:
+            self.slots[old_due_tick % len(self.slots)].discard(key)
+        self.slots[due_tick % len(self.slots)].add(key)
+        self.due_tick[key] = due_tick
+
+    def remove(self, key):
+        due_tick = self.due_tick.pop(key, None)
+        if due_tick is not None:
+            self.slots[due_tick % len(self.slots)].discard(key)
+
+    def expire(self, now: float) -> list:
+        '''
+        Processes the ticks which have passed until now
+
+        :return: the keys whose lease has expired, they are not in the wheel anymore
+        '''
+        expired = []
+        while self.start_time + (self.ticks + 1) * self.tick <= now:
+            self.ticks += 1
+            slot = self.slots[self.ticks % len(self.slots)]
+            due_keys = [key for key in slot if self.due_tick[key] <= self.ticks]
+            for key in due_keys:
+                del self.due_tick[key]
+                slot.discard(key)
+            expired.extend(due_keys)
+        return expired
@@ -0,0 +1,39 @@
+import struct
+from messages.message import Message, HEADER, HEADER_FIELDS
+
+class ChunkAck(Message):
+    msg_type = 5
+    # src_node_id, dest_node_id, range start, range end, cum_ack, number of sack blocks, len(filename)
+    layout = struct.Struct(HEADER + "iiqqiBH")
+    block = struct.Struct("!ii")
+
+    def __init__(self, src_node_id: int, dest_node_id: int, filename: str,
+                 range: tuple, cum_ack: int, sacks: list = ()):
+
+        super().__init__()
+        self.src_node_id = src_node_id
+        self.dest_node_id = dest_node_id
+        self.filename = filename
+        self.range = range
+        self.cum_ack = cum_ack  # every piece with a lower index has been received
+        self.sacks = sacks      # [start, end) blocks of pieces received above cum_ack
+
+    def pack(self) -> bytes:
+        filename = self.filename.encode()
+        parts = [self.layout.pack(*self.header(), self.src_node_id, self.dest_node_id,
+                                  self.range[0], self.range[1], self.cum_ack,
+                                  len(self.sacks), len(filename)),
+                 filename]
+        parts.extend(self.block.pack(start, end) for start, end in self.sacks)
+        return b"".join(parts)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> dict:
+        src_node_id, dest_node_id, start, end, cum_ack, sacks_count, name_len = cls.layout.unpack_from(data)[HEADER_FIELDS:]
+        offset = cls.layout.size + name_len
+        return {"src_node_id": src_node_id,
+                "dest_node_id": dest_node_id,
+                "filename": data[cls.layout.size: offset].decode(),
+                "range": (start, end),
+                "cum_ack": cum_ack,
+                "sacks": list(cls.block.iter_unpack(data[offset: offset + sacks_count * cls.block.size]))}
@@ -1,8 +1,13 @@
-from messages.message import Message
+import struct
+from messages.message import Message, HEADER, HEADER_FIELDS
 
 class ChunkSharing(Message):
+    msg_type = 3
+    # src_node_id, dest_node_id, range start, range end, idx, piece_size, codec, has_chunk, len(filename)
+    layout = struct.Struct(HEADER + "iiqqiIB?H")
+
     def __init__(self, src_node_id: int, dest_node_id: int, filename: str,
-                 range: tuple, idx: int =-1, chunk: bytes = None):
+                 range: tuple, idx: int =-1, chunk: bytes = None, piece_size: int = 0, codec: int = 0):
 
         super().__init__()
         self.src_node_id = src_node_id
@@ -11,3 +16,32 @@ class ChunkSharing(Message):
         self.range = range
         self.idx = idx
         self.chunk = chunk
+        self.piece_size = piece_size    # size of the pieces the range is split into, chosen by the requester
+        # in a request, the bitmask of the codecs the requester decodes; in a piece, the codec it is compressed with
+        self.codec = codec
+
+    def encode_parts(self) -> list:
+        # the piece bytes travel as they are, right after the fixed fields
+        if self.chunk is None:
+            return [self.pack()]
+        return [self.pack(), self.chunk]
+
+    def pack(self) -> bytes:
+        filename = self.filename.encode()
+        return self.layout.pack(*self.header(), self.src_node_id, self.dest_node_id,
+                                self.range[0], self.range[1], self.idx, self.piece_size, self.codec,
+                                self.chunk is not None, len(filename)) + filename
+
+    @classmethod
+    def unpack(cls, data: bytes) -> dict:
+        src_node_id, dest_node_id, start, end, idx, piece_size, codec, has_chunk, name_len = \
+            cls.layout.unpack_from(data)[HEADER_FIELDS:]
+        name_end = cls.layout.size + name_len
+        return {"src_node_id": src_node_id,
+                "dest_node_id": dest_node_id,
+                "filename": data[cls.layout.size: name_end].decode(),
+                "range": (start, end),
+                "idx": idx,
+                "piece_size": piece_size,
+                "codec": codec,
+                "chunk": memoryview(data)[name_end:] if has_chunk else None}
@@ -0,0 +1,67 @@
+import struct
+from messages.message import Message, HEADER, HEADER_FIELDS
+
+# kinds of the DHT requests (see dht.py), a reply has the kind of its request
+PING, FIND_NODE, FIND_VALUE, STORE = range(4)
+
+
+class DHTMessage(Message):
+    msg_type = 9
+    # node_id, kind, target key, len(filename), number of distinct hosts, number of contacts, number of owners
+    layout = struct.Struct(HEADER + "iBQHBHH")
+    host_len = struct.Struct("!B")
+    entry = struct.Struct("!iHB")   # node_id, port, index of the host in the hosts table
+
+    def __init__(self, node_id: int, kind: int, target: int = 0, filename: str = "",
+                 contacts: list = (), owners: list = ()):
+        '''
+        :param target: key looked up by FIND_NODE and FIND_VALUE
+        :param filename: file looked up by FIND_VALUE, or stored by STORE
+        :param contacts: (node_id, addr) of the nodes closest to the target, in a reply
+        :param owners: (node_id, addr) of the owners of the file, in a reply to FIND_VALUE
+        '''
+        super().__init__()
+        self.node_id = node_id
+        self.kind = kind
+        self.target = target
+        self.filename = filename
+        self.contacts = contacts
+        self.owners = owners
+
+    def pack(self) -> bytes:
+        # as in Tracker2Node, the hosts are sent once as a table
+        hosts = {}
+        entries = []
+        for node_id, (host, port) in list(self.contacts) + list(self.owners):
+            entries.append(self.entry.pack(node_id, port, hosts.setdefault(host, len(hosts))))
+        filename = self.filename.encode()
+        parts = [self.layout.pack(*self.header(), self.node_id, self.kind, self.target,
+                                  len(filename), len(hosts), len(self.contacts), len(self.owners)),
+                 filename]
+        for host in hosts:
+            raw = host.encode()
+            parts.append(self.host_len.pack(len(raw)))
+            parts.append(raw)
+        parts.extend(entries)
+        return b"".join(parts)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> dict:
+        node_id, kind, target, name_len, hosts_count, contacts_count, owners_count = \
+            cls.layout.unpack_from(data)[HEADER_FIELDS:]
+        offset = cls.layout.size + name_len
+        filename = data[cls.layout.size: offset].decode()
+        hosts = []
+        for _ in range(hosts_count):
+            length = data[offset]
+            hosts.append(data[offset + 1: offset + 1 + length].decode())
+            offset += 1 + length
+        entries_end = offset + (contacts_count + owners_count) * cls.entry.size
+        entries = [(entry_node_id, (hosts[host_idx], port))
+                   for entry_node_id, port, host_idx in cls.entry.iter_unpack(data[offset: entries_end])]
+        return {"node_id": node_id,
+                "dht_kind": kind,
+                "target": target,
+                "filename": filename,
+                "contacts": entries[:contacts_count],
+                "owners": entries[contacts_count:]}
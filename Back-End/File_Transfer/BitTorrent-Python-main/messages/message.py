@@ -1,14 +1,92 @@
 from __future__ import annotations
-import pickle
+import struct
+
+# Every datagram starts with the same header: (wire version, message type, is reply, request id).
+# The version must be bumped whenever a message layout changes.
+WIRE_VERSION = 6
+HEADER = "!BB?I"
+HEADER_FIELDS = 4
+header_layout = struct.Struct(HEADER)
 
 
 class Message:
+    """
+    Base class of all the messages exchanged among the nodes and the tracker.
+
+    Each concrete class declares a ``layout`` struct which starts with the
+    common header, followed by its fixed-width fields and the lengths of its
+    variable-length fields (filenames, hosts). Those are appended right after
+    the fixed part, and a trailing payload (the bytes of a chunk piece) is
+    appended raw so that it can be decoded as a zero-copy ``memoryview``.
+
+    The request id correlates the messages of an exchange: a reply (and every
+    piece of a chunk) carries the id of the request it answers, so a node can
+    multiplex all of its exchanges over one socket.
+    """
+    msg_type = None     # unique id of the concrete message class on the wire
+    layout = None
+    _registry = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.msg_type is not None:
+            assert cls.msg_type not in Message._registry, f"duplicate message type {cls.msg_type}"
+            Message._registry[cls.msg_type] = cls
+
     def __init__(self):
-        pass
+        self.req_id = 0
+        self.is_reply = False
+
+    def in_reply_to(self, request: dict):
+        '''
+        Marks the message as an answer to the decoded request
+
+        :return: the message itself
+        '''
+        self.req_id = request["req_id"]
+        self.is_reply = True
+        return self
+
+    def header(self) -> tuple:
+        return WIRE_VERSION, self.msg_type, self.is_reply, self.req_id
 
     def encode(self) -> bytes:
-        return pickle.dumps(self.__dict__)
+        return b"".join(self.encode_parts())
+
+    def encode_parts(self) -> list:
+        '''
+        Encodes the message as a list of buffers which, concatenated, form the
+        datagram. Messages with a raw payload return it as a separate buffer so
+        that it can be sent without being copied.
+        '''
+        return [self.pack()]
+
+    def pack(self) -> bytes:
+        raise NotImplementedError
+
+    @classmethod
+    def unpack(cls, data: bytes) -> dict:
+        raise NotImplementedError
 
     @staticmethod
     def decode(data: bytes) -> dict:
-        return pickle.loads(data)
+        '''
+        :raises ValueError: if the datagram is not a message of this wire version
+        '''
+        if len(data) < header_layout.size:
+            raise ValueError("truncated message")
+        if data[0] != WIRE_VERSION:
+            raise ValueError(f"unsupported wire version {data[0]}")
+        try:
+            cls = Message._registry[data[1]]
+        except KeyError:
+            raise ValueError(f"unknown message type {data[1]}") from None
+        try:
+            msg = cls.unpack(data)
+        except struct.error as e:
+            raise ValueError(f"truncated message: {e}") from None
+        except IndexError as e:
+            # e.g. a table of hosts shorter than its entries refer to
+            raise ValueError(f"malformed message: {e}") from None
+        _, _, msg["is_reply"], msg["req_id"] = header_layout.unpack_from(data)
+        return msg
@@ -1,6 +1,10 @@
-from messages.message import Message
+import struct
+from messages.message import Message, HEADER, HEADER_FIELDS
 
 class Node2Node(Message):
+    msg_type = 2
+    layout = struct.Struct(HEADER + "iiqH")  # src_node_id, dest_node_id, size, len(filename)
+
     def __init__(self, src_node_id: int, dest_node_id: int, filename: str, size: int = -1):
 
         super().__init__()
@@ -8,3 +12,17 @@ class Node2Node(Message):
         self.dest_node_id = dest_node_id
         self.filename = filename
         self.size = size    # size = -1 means a node is asking for size
+
+    def pack(self) -> bytes:
+        filename = self.filename.encode()
+        return self.layout.pack(*self.header(), self.src_node_id, self.dest_node_id,
+                                self.size, len(filename)) + filename
+
+    @classmethod
+    def unpack(cls, data: bytes) -> dict:
+        src_node_id, dest_node_id, size, name_len = cls.layout.unpack_from(data)[HEADER_FIELDS:]
+        start = cls.layout.size
+        return {"src_node_id": src_node_id,
+                "dest_node_id": dest_node_id,
+                "filename": data[start: start + name_len].decode(),
+                "size": size}
@@ -1,9 +1,42 @@
-from messages.message import Message
+import struct
+from messages.message import Message, HEADER, HEADER_FIELDS
+
+# orders of the owners in a search (NEED), the tracker replies with the first ones
+ORDER_ANNOUNCED, ORDER_SEND_FREQ, ORDER_SPEED = range(3)
+
 
 class Node2Tracker(Message):
-    def __init__(self, node_id: int, mode: int, filename: str):
+    msg_type = 1
+    # node_id, mode, len(filename), order, limit and cursor of a search
+    layout = struct.Struct(HEADER + "iBHBHI")
 
+    def __init__(self, node_id: int, mode: int, filename: str,
+                 order: int = ORDER_ANNOUNCED, limit: int = 0, cursor: int = 0):
+        '''
+        :param order: order of the owners in a search, one of the ORDER_* constants
+        :param limit: most owners wanted in the reply of a search, 0 for as many as fit in it
+        :param cursor: next_cursor of the previous page of the search, 0 for the first page
+        '''
         super().__init__()
         self.node_id = node_id
         self.filename = filename
         self.mode = mode
+        self.order = order
+        self.limit = limit
+        self.cursor = cursor
+
+    def pack(self) -> bytes:
+        filename = self.filename.encode()
+        return self.layout.pack(*self.header(), self.node_id, self.mode,
+                                len(filename), self.order, self.limit, self.cursor) + filename
+
+    @classmethod
+    def unpack(cls, data: bytes) -> dict:
+        node_id, mode, name_len, order, limit, cursor = cls.layout.unpack_from(data)[HEADER_FIELDS:]
+        start = cls.layout.size
+        return {"node_id": node_id,
+                "filename": data[start: start + name_len].decode(),
+                "mode": mode,
+                "order": order,
+                "limit": limit,
+                "cursor": cursor}
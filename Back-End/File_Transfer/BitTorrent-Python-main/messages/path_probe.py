@@ -0,0 +1,31 @@
+import struct
+from messages.message import Message, HEADER, HEADER_FIELDS
+
+class PathProbe(Message):
+    msg_type = 7
+    layout = struct.Struct(HEADER + "iiI")  # src_node_id, dest_node_id, probe size
+
+    def __init__(self, src_node_id: int, dest_node_id: int, probe_size: int, padded: bool = True):
+
+        super().__init__()
+        self.src_node_id = src_node_id
+        self.dest_node_id = dest_node_id
+        # a probe is padded to probe_size bytes, its reply tells how many bytes arrived
+        self.probe_size = probe_size
+        self.padded = padded
+
+    def encode_parts(self) -> list:
+        if not self.padded:
+            return [self.pack()]
+        return [self.pack(), bytes(max(self.probe_size - self.layout.size, 0))]
+
+    def pack(self) -> bytes:
+        return self.layout.pack(*self.header(), self.src_node_id, self.dest_node_id, self.probe_size)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> dict:
+        src_node_id, dest_node_id, probe_size = cls.layout.unpack_from(data)[HEADER_FIELDS:]
+        return {"src_node_id": src_node_id,
+                "dest_node_id": dest_node_id,
+                "probe_size": probe_size,
+                "received_size": len(data)}
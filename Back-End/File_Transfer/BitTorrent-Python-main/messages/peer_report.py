@@ -0,0 +1,27 @@
+import struct
+from messages.message import Message, HEADER, HEADER_FIELDS
+
+class PeerReport(Message):
+    msg_type = 8
+    layout = struct.Struct(HEADER + "iiII")  # node_id, peer_id, bandwidth (bytes/s), rtt (microseconds)
+
+    def __init__(self, node_id: int, peer_id: int, bandwidth: float, rtt: float):
+
+        super().__init__()
+        # what node_id measured while it downloaded from peer_id
+        self.node_id = node_id
+        self.peer_id = peer_id
+        self.bandwidth = bandwidth
+        self.rtt = rtt
+
+    def pack(self) -> bytes:
+        return self.layout.pack(*self.header(), self.node_id, self.peer_id,
+                                min(int(self.bandwidth), 0xFFFFFFFF), min(int(self.rtt * 1e6), 0xFFFFFFFF))
+
+    @classmethod
+    def unpack(cls, data: bytes) -> dict:
+        node_id, peer_id, bandwidth, rtt = cls.layout.unpack_from(data)[HEADER_FIELDS:]
+        return {"node_id": node_id,
+                "peer_id": peer_id,
+                "bandwidth": bandwidth,
+                "rtt": rtt / 1e6}
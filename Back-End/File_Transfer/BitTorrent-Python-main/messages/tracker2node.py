@@ -1,9 +1,75 @@
-from messages.message import Message
+import socket
+import struct
+from messages.message import Message, HEADER, HEADER_FIELDS
+
+RTT_SCALE = 10000   # the rtt of an owner is sent in units of 1/RTT_SCALE seconds
+
+
+def pack_host(host: str) -> bytes:
+    try:
+        return socket.inet_aton(host)
+    except OSError:
+        # a name (e.g. "localhost"), the addresses seen by the tracker are numeric
+        return socket.inet_aton(socket.gethostbyname(host))
+
 
 class Tracker2Node(Message):
-    def __init__(self, dest_node_id: int, search_result: list, filename: str):
+    msg_type = 4
+    # dest_node_id, len(filename), number of search results, owners of the file, cursor of the next page (0 if none)
+    layout = struct.Struct(HEADER + "iHHII")
+    # node_id, IPv4 address, port, send frequency, bandwidth (bytes/s) and rtt (1/RTT_SCALE s)
+    # reported by other nodes, 0 if unknown; fixed width, so a page holds a known number of owners
+    entry = struct.Struct("!i4sHIIH")
 
+    def __init__(self, dest_node_id: int, search_result: list, filename: str,
+                 total: int = None, next_cursor: int = 0):
+        '''
+        :param total: owners of the file, the search results are a page of them (len(search_result) if None)
+        :param next_cursor: cursor of the search of the next page, 0 if this one is the last
+        '''
         super().__init__()
         self.dest_node_id = dest_node_id
         self.search_result = search_result
         self.filename = filename
+        self.total = len(search_result) if total is None else total
+        self.next_cursor = next_cursor
+
+    @classmethod
+    def capacity(cls, filename: str, size: int) -> int:
+        '''
+        :return: most search results in a reply of at most size bytes
+        '''
+        return max(0, (size - cls.layout.size - len(filename.encode())) // cls.entry.size)
+
+    def pack(self) -> bytes:
+        filename = self.filename.encode()
+        parts = [self.layout.pack(*self.header(), self.dest_node_id, len(filename),
+                                  len(self.search_result), self.total, self.next_cursor),
+                 filename]
+        packed_hosts = {}   # owners nearly always share a handful of hosts
+        for owner, freq in self.search_result:
+            host, port = owner['addr']
+            packed_host = packed_hosts.get(host)
+            if packed_host is None:
+                packed_host = packed_hosts[host] = pack_host(host)
+            parts.append(self.entry.pack(owner['node_id'], packed_host, port, freq,
+                                         min(int(owner.get('bandwidth', 0)), 0xFFFFFFFF),
+                                         min(int(owner.get('rtt', 0) * RTT_SCALE), 0xFFFF)))
+        return b"".join(parts)
+
+    @classmethod
+    def unpack(cls, data: bytes) -> dict:
+        dest_node_id, name_len, entries_count, total, next_cursor = cls.layout.unpack_from(data)[HEADER_FIELDS:]
+        offset = cls.layout.size + name_len
+        filename = data[cls.layout.size: offset].decode()
+        entries_end = offset + entries_count * cls.entry.size
+        hosts = {}
+        search_result = [({'node_id': node_id, 'addr': (hosts.get(host) or hosts.setdefault(host, socket.inet_ntoa(host)), port),
+                           'bandwidth': bandwidth, 'rtt': rtt / RTT_SCALE}, freq)
+                         for node_id, host, port, freq, bandwidth, rtt
+                         in cls.entry.iter_unpack(data[offset: entries_end])]
+        return {"dest_node_id": dest_node_id,
+                "search_result": search_result,
+                "filename": filename,
+                "total": total,
+                "next_cursor": next_cursor}
@@ -0,0 +1,27 @@
+import struct
+from messages.message import Message, HEADER, HEADER_FIELDS
+
+class Tracker2Tracker(Message):
+    msg_type = 6
+    layout = struct.Struct(HEADER + "iBHB")  # node_id, mode, node port, len(node host)
+
+    def __init__(self, node_id: int, mode: int, addr: tuple):
+
+        super().__init__()
+        self.node_id = node_id
+        self.mode = mode
+        self.addr = addr    # address of the node the message is about
+
+    def pack(self) -> bytes:
+        host, port = self.addr
+        host = host.encode()
+        return self.layout.pack(*self.header(), self.node_id, self.mode,
+                                port, len(host)) + host
+
+    @classmethod
+    def unpack(cls, data: bytes) -> dict:
+        node_id, mode, port, host_len = cls.layout.unpack_from(data)[HEADER_FIELDS:]
+        start = cls.layout.size
+        return {"node_id": node_id,
+                "mode": mode,
+                "addr": (data[start: start + host_len].decode(), port)}
@@ -0,0 +1,175 @@
+"""
+Counters and histograms of a node or of the tracker, served in the Prometheus text format.
+
+A ``Metrics`` registry holds the metrics of one process. A metric has a value
+per combination of its labels (e.g. the peer), given as a tuple of values in
+the order of its label names. Updating one is a dict lookup and an addition,
+and the transfers update them once per chunk, not per piece: the piece path
+only adds to local variables. The values which the node or the tracker
+already keeps (sizes of its tables, hits of its caches) are not copied, a
+metric may instead be given a ``read`` function which is only called when the
+metrics are scraped.
+
+``Metrics.serve()`` starts a small HTTP server on the event loop, which
+answers ``GET /metrics`` with the text format
+(https://prometheus.io/docs/instrumenting/exposition_formats/). The rates
+(pieces per second, requests per second...) are left to the scraper, as the
+``rate()`` of the counters.
+"""
+import asyncio
+import bisect
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds, from a request on the loopback to a transfer over a slow link
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    :param labels: names of the labels
+    :param read: if given, returns the values at scrape time, as {label values: value} (or a number if there are no labels)
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), read=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.read = read
+        self.values = {}    # label values -> value
+
+    def samples(self) -> dict:
+        if self.read is None:
+            return self.values
+        values = self.read()
+        return values if isinstance(values, dict) else {(): values}
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.samples().items():
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, labels: tuple = ()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, labels: tuple = ()):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """
+    :param buckets: upper bounds of the buckets, in increasing order (+Inf is added)
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.values = {}    # label values -> [count of each bucket (not cumulative) and of +Inf, sum]
+
+    def observe(self, value: float, labels: tuple = ()):
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, state in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {format_value(state[-1])}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """
+    The metrics of a process, in the order they are registered
+    """
+    def __init__(self):
+        self.metrics = {}   # name -> Metric
+        self.server = None
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = (), read=None) -> Counter:
+        return self.register(Counter(name, help, labels, read))
+
+    def gauge(self, name: str, help: str, labels: tuple = (), read=None) -> Gauge:
+        return self.register(Gauge(name, help, labels, read))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    async def handle_scrape(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), config.constants.METRICS_TIMEOUT)
+            # the headers are not used, but they are read up to the blank line
+            while (await asyncio.wait_for(reader.readline(), config.constants.METRICS_TIMEOUT)).strip():
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"only /metrics is served\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port: int, host: str = None):
+        '''
+        Serves the metrics over HTTP on the running event loop, until close()
+        '''
+        self.server = await asyncio.start_server(self.handle_scrape, host or config.constants.METRICS_HOST, port)
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
@@ -0,0 +1,189 @@
+"""
+User-space emulation of a bad network path, to exercise the transport locally.
+
+``LossySocket`` wraps a UDP socket and drops, duplicates, delays and reorders
+the datagrams sent through it. Everything else (receiving, select(), closing)
+goes to the wrapped socket untouched.
+
+``ImpairedLink`` does the same to the datagrams sent by an ``Endpoint`` (see
+``endpoint.py``), on its event loop instead of a thread, and can also limit
+them to the rate of a slow link. It counts the datagrams and bytes the
+endpoint puts on the wire, so it is also installed on a clean path to
+measure the overhead of a transfer.
+"""
+import asyncio
+import heapq
+import random
+import threading
+import time
+from endpoint import datagram_size
+
+
+class LossySocket:
+    """
+    :param loss: probability of dropping a datagram
+    :param duplicate: probability of sending a datagram twice
+    :param reorder: probability of holding a datagram back by reorder_delay so that later ones overtake it
+    :param delay: one-way delay added to every datagram (in seconds)
+    :param jitter: random extra delay in [0, jitter] (in seconds)
+    """
+    def __init__(self, sock, loss: float = 0.0, duplicate: float = 0.0, reorder: float = 0.0,
+                 reorder_delay: float = 0.002, delay: float = 0.0, jitter: float = 0.0, seed: int = None):
+        self.sock = sock
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.delay = delay
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.stats = {"sent": 0, "dropped": 0, "duplicated": 0, "reordered": 0}
+        self._queue = []    # heap of (due time, counter, data, addr)
+        self._counter = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def sendto(self, data, addr) -> int:
+        self._emit(bytes(data), addr)
+        return len(data)
+
+    def sendmsg(self, buffers, ancdata=(), flags=0, address=None) -> int:
+        data = b"".join(buffers)
+        self._emit(data, address)
+        return len(data)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.sock.close()
+
+    def _emit(self, data: bytes, addr: tuple):
+        self.stats["sent"] += 1
+        if self.random.random() < self.loss:
+            self.stats["dropped"] += 1
+            return
+        copies = 1
+        if self.random.random() < self.duplicate:
+            self.stats["duplicated"] += 1
+            copies = 2
+        for _ in range(copies):
+            delay = self.delay + self.random.uniform(0, self.jitter)
+            if self.random.random() < self.reorder:
+                self.stats["reordered"] += 1
+                delay += self.reorder_delay
+            if delay <= 0:
+                self.sock.sendto(data, addr)
+            else:
+                self._schedule(time.monotonic() + delay, data, addr)
+
+    def _schedule(self, due: float, data: bytes, addr: tuple):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._deliver, daemon=True)
+                self._thread.start()
+            self._counter += 1
+            heapq.heappush(self._queue, (due, self._counter, data, addr))
+            self._cond.notify()
+
+    def _deliver(self):
+        with self._cond:
+            while not self._closed:
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                due, _, data, addr = self._queue[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                heapq.heappop(self._queue)
+                try:
+                    self.sock.sendto(data, addr)
+                except OSError:
+                    pass
+
+
+class ImpairedLink:
+    """
+    The outgoing path of an endpoint, installed over its send() and send_many().
+
+    :param rate: bytes/s of the link, 0 if it is not limited
+    (the other parameters are those of LossySocket)
+    """
+    def __init__(self, endpoint, loss: float = 0.0, duplicate: float = 0.0, reorder: float = 0.0,
+                 reorder_delay: float = 0.002, delay: float = 0.0, jitter: float = 0.0, rate: float = 0.0,
+                 seed: int = None):
+        self.endpoint = endpoint
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self.delay = delay
+        self.jitter = jitter
+        self.rate = rate
+        self.random = random.Random(seed)
+        self.stats = {"sent": 0, "bytes": 0, "dropped": 0, "duplicated": 0, "reordered": 0}
+        self.free_at = 0.0      # when the link has sent everything queued on it
+        self._counting = True   # off while the endpoint sends a run of datagrams already counted
+        self._send = endpoint.send
+        self._send_many = endpoint.send_many
+        endpoint.send = self.send
+        endpoint.send_many = self.send_many
+
+    @property
+    def is_clean(self) -> bool:
+        return not (self.loss or self.duplicate or self.reorder or self.delay or self.jitter or self.rate)
+
+    def send(self, data, addr: tuple):
+        size = datagram_size(data)
+        if self._counting:
+            self.stats["sent"] += 1
+            self.stats["bytes"] += size
+        if self.is_clean:
+            self._send(data, addr)
+            return
+        if self.random.random() < self.loss:
+            self.stats["dropped"] += 1
+            return
+        if not isinstance(data, (bytes, bytearray)):
+            # the buffers may not outlive this call
+            data = b"".join(data)
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.rate:
+            self.free_at = max(self.free_at, now) + size / self.rate
+            now = self.free_at
+        copies = 1
+        if self.random.random() < self.duplicate:
+            self.stats["duplicated"] += 1
+            copies = 2
+        for _ in range(copies):
+            delay = self.delay + self.random.uniform(0, self.jitter)
+            if self.random.random() < self.reorder:
+                self.stats["reordered"] += 1
+                delay += self.reorder_delay
+            due = now + delay
+            if due <= loop.time():
+                self._send(data, addr)
+            else:
+                loop.call_at(due, self._send, data, addr)
+
+    def send_many(self, datagrams: list, addr: tuple):
+        if self.is_clean:
+            self.stats["sent"] += len(datagrams)
+            self.stats["bytes"] += sum(datagram_size(data) for data in datagrams)
+            # it sends with send() the datagrams it doesn't segment
+            self._counting = False
+            try:
+                self._send_many(datagrams, addr)
+            finally:
+                self._counting = True
+            return
+        # every datagram meets the path on its own, so they are not segmented by the kernel
+        for data in datagrams:
+            self.send(data, addr)
@@ -1,12 +1,11 @@
 # built-in libraries
 from utils import *
 import argparse
-from threading import Thread, Timer
-from operator import itemgetter
-import datetime
+import asyncio
+import functools
 import time
-from itertools import groupby
-import mmap
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -14,113 +13,359 @@ warnings.filterwarnings("ignore")
 from configs import CFG, Config
 config = Config.from_json(CFG)
 from messages.message import Message
-from messages.node2tracker import Node2Tracker
+from messages.node2tracker import Node2Tracker, ORDER_SPEED
 from messages.node2node import Node2Node
 from messages.chunk_sharing import ChunkSharing
+from messages.tracker2node import Tracker2Node
+from messages.chunk_ack import ChunkAck
 from segment import UDPSegment
-
-next_call = time.time()
+from endpoint import Endpoint
+from transport import ReliableSender, ReliableReceiver, pieces_count_of
+from download_sink import DownloadSink, PART_SUFFIX, BITFIELD_SUFFIX
+from piece_hashes import PieceManifest, PieceVerifier, load_or_create_manifest, MANIFEST_SUFFIX
+from chunk_store import ChunkStore, ChunkList, load_or_create_chunk_list, matches_file, CHUNKS_SUFFIX
+from scheduler import PieceScheduler
+from shard_map import ShardMap
+from path_mtu import PathMTU
+from messages.path_probe import PathProbe
+from messages.peer_report import PeerReport
+from peer_stats import PeerStats
+from upload_queue import UploadQueue
+from dht import DHT
+from file_cache import FileCache, PieceCache
+from metrics import Metrics
+from piece_codecs import PieceCompressor, accepted_codecs, choose_codec, decompress, is_compressible, NONE
 
 class Node:
-    def __init__(self, node_id: int, rcv_port: int, send_port: int):
+    """
+    A node runs on an asyncio event loop, and all of its exchanges (requests to
+    the tracker and to the peers, the chunks it sends and receives, heartbeats)
+    share one UDP socket, see ``endpoint.py``. ``start()`` must be awaited
+    before the node is used.
+
+    The requests about a file go to the tracker shard which owns it, and the
+    heartbeats go to the registry shard, see ``shard_map.py``. With DHT on,
+    the owners of the files are announced and searched in the DHT instead,
+    and the tracker is only used to join it, see ``dht.py``.
+    """
+    def __init__(self, node_id: int, port: int, shard_map: ShardMap = None):
         self.node_id = node_id
-        self.rcv_socket = set_socket(rcv_port)
-        self.send_socket = set_socket(send_port)
+        self.shard_map = shard_map or ShardMap.from_config()
+        self.endpoint = Endpoint(port=port, on_request=self.handle_requests)
+        self.path_mtu = PathMTU(endpoint=self.endpoint, node_id=node_id)
+        self.peer_stats = PeerStats()   # measured speed of the peers we download from
+        self.dht = DHT(endpoint=self.endpoint, node_id=node_id, registry=self.shard_map.registry) \
+            if config.constants.DHT else None
         self.files = self.fetch_owned_files()
-        self.is_in_send_mode = False    # is thread uploading a file or not
-        self.downloaded_files = {}
-
-    def send_segment(self, sock: socket.socket, data: bytes, addr: tuple):
+        self.chunk_store = ChunkStore(files_dir=f"{config.directory.node_files_dir}node{node_id}")
+        self.is_in_send_mode = False    # is the node serving requests for its files or not
+        self.downloaded_files = {}      # filename -> DownloadSink of the files being downloaded
+        self.served_requests = {}       # (requester addr, req_id) -> when its chunk was requested
+        # chunk requests waiting to be served, fairly among the requesters
+        self.uploads = UploadQueue(quantum=config.constants.UPLOAD_QUANTUM,
+                                   per_requester=config.constants.MAX_UPLOADS_PER_REQUESTER)
+        self.hash_pool = ThreadPoolExecutor(max_workers=config.constants.HASH_WORKERS)
+        self.compress_pool = ThreadPoolExecutor(max_workers=config.constants.COMPRESS_WORKERS)
+        # the files are chunked one at a time (see chunk_store.py), so a file is never chunked twice at once
+        self.index_pool = ThreadPoolExecutor(max_workers=1)
+        self.indexing = None            # the last job indexing the files of the node, see index_files()
+        # the files being served stay mapped, and their hot pieces in memory (see file_cache.py)
+        self.file_cache = FileCache(max_files=config.constants.FILE_CACHE_SIZE)
+        self.piece_cache = PieceCache(max_bytes=config.constants.PIECE_CACHE_SIZE)
+        self.tasks = set()              # requests being served, referenced until they are done
+        self.metrics = Metrics()        # served in the Prometheus format with -metrics_port (see metrics.py)
+        self.register_metrics()
+
+    def register_metrics(self):
+        metrics = self.metrics
+        self.sent_bytes = metrics.counter("node_sent_bytes_total", "Bytes of pieces sent (as on the wire), by peer",
+                                          ("peer",))
+        self.received_bytes = metrics.counter("node_received_bytes_total",
+                                              "Bytes of pieces received (as on the wire), by peer", ("peer",))
+        self.sent_pieces = metrics.counter("node_sent_pieces_total", "Pieces sent, retransmissions included, by peer",
+                                           ("peer",))
+        self.received_pieces = metrics.counter("node_received_pieces_total", "Pieces received, by peer", ("peer",))
+        self.retransmissions = metrics.counter("node_retransmitted_pieces_total", "Pieces sent again, by peer",
+                                               ("peer",))
+        self.failed_chunks = metrics.counter("node_failed_chunks_total",
+                                             "Chunks abandoned as the peer went silent, by peer and direction",
+                                             ("peer", "direction"))
+        self.phase_seconds = metrics.histogram("node_download_phase_seconds",
+                                               "Time spent in each phase of the downloads", ("phase",))
+        self.downloads_count = metrics.counter("node_downloads_total", "Downloads, by result", ("result",))
+        metrics.gauge("node_downloads_active", "Files being downloaded", read=lambda: len(self.downloaded_files))
+        metrics.gauge("node_uploads_waiting", "Chunk requests waiting to be served", read=lambda: len(self.uploads))
+        metrics.gauge("node_uploads_running", "Chunks being sent", read=lambda: self.uploads.running_count)
+        metrics.gauge("node_files", "Files the node owns", read=lambda: len(self.files))
+        metrics.counter("node_file_cache_hits_total", "Chunks sent from a file which was already mapped",
+                        read=lambda: self.file_cache.hits)
+        metrics.counter("node_piece_cache_hits_total", "Pieces sent from the cache of the hot pieces",
+                        read=lambda: self.piece_cache.hits)
+        metrics.gauge("node_piece_cache_bytes", "Bytes of the cache of the hot pieces", read=lambda: self.piece_cache.size)
+        if self.dht is not None:
+            metrics.gauge("node_dht_contacts", "Contacts in the routing table of the DHT", read=lambda: len(self.dht.table))
+            metrics.counter("node_dht_requests_total", "Requests sent to other nodes of the DHT",
+                            read=lambda: self.dht.rpc_count)
+
+    async def start(self):
+        await self.endpoint.open()
+        if config.constants.CHUNK_DEDUP:
+            # the files are indexed once, in the background: downloads don't wait for it
+            self.index_files(self.files)
+
+    def index_files(self, filenames: list) -> asyncio.Future:
+        '''
+        Indexes the chunks of the files which are new or have changed since they were indexed
+        (see chunk_store.py), on index_pool
+
+        :return: the indexing job, the jobs complete in order
+        '''
+        self.indexing = self.spawn(asyncio.get_running_loop().run_in_executor(
+            self.index_pool, self.chunk_store.refresh, list(filenames)))
+        return self.indexing
+
+    def send_segment(self, data, addr: tuple):
         ip, dest_port = addr
-        segment = UDPSegment(src_port=sock.getsockname()[1],
+        segment = UDPSegment(src_port=self.endpoint.port,
                              dest_port=dest_port,
                              data=data)
-        encrypted_data = segment.data
-        sock.sendto(encrypted_data, addr)
-
-    def split_file_to_chunks(self, file_path: str, rng: tuple) -> list:
-        with open(file_path, "r+b") as f:
-            mm = mmap.mmap(f.fileno(), 0)[rng[0]: rng[1]]
-            # we divide each chunk to a fixed-size pieces to be transferable
-            piece_size = config.constants.CHUNK_PIECES_SIZE
-            return [mm[p: p + piece_size] for p in range(0, rng[1] - rng[0], piece_size)]
-
-    def reassemble_file(self, chunks: list, file_path: str):
-        with open(file_path, "bw+") as f:
-            for ch in chunks:
-                f.write(ch)
-            f.flush()
-            f.close()
-
-    def send_chunk(self, filename: str, rng: tuple, dest_node_id: int, dest_port: int):
-        file_path = f"{config.directory.node_files_dir}node{self.node_id}/{filename}"
-        chunk_pieces = self.split_file_to_chunks(file_path=file_path,
-                                                 rng=rng)
-        temp_port = generate_random_port()
-        temp_sock = set_socket(temp_port)
-        for idx, p in enumerate(chunk_pieces):
-            msg = ChunkSharing(src_node_id=self.node_id,
-                               dest_node_id=dest_node_id,
-                               filename=filename,
-                               range=rng,
-                               idx=idx,
-                               chunk=p)
-            log_content = f"The {idx}/{len(chunk_pieces)} has been sent!"
+        self.endpoint.send(data=segment.data, addr=addr)
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def shared_path(self, filename: str):
+        '''
+        :return: path of filename if it is a file of this node, or the manifest or chunk list of one, else None
+                 (a peer must not make the node read or write anything else, e.g. "../x.manifest")
+        '''
+        owned = filename
+        for suffix in (MANIFEST_SUFFIX, CHUNKS_SUFFIX):
+            if owned.endswith(suffix):
+                owned = owned[:-len(suffix)]
+                break
+        if owned not in self.files:
+            return None
+        return f"{config.directory.node_files_dir}node{self.node_id}/{filename}"
+
+    @contextmanager
+    def split_file_to_chunks(self, file_path: str, rng: tuple, piece_size: int):
+        '''
+        Yields a function which returns the idx-th piece of range rng as a
+        memoryview over the mapping of the file (shared by the chunks sent from
+        it, see file_cache.py), so no piece is ever copied, and the version of the
+        file. Pieces are fetched by index since lost ones are sent again.
+        '''
+        mapped = self.file_cache.acquire(file_path)
+        try:
+            mapped.will_need(rng[0], rng[1])
+            view = mapped.view
+
+            # we divide each chunk to pieces of the size the requester asked for
+            def piece_at(idx: int) -> memoryview:
+                start = rng[0] + idx * piece_size
+                return view[start: min(start + piece_size, rng[1])]
+            yield piece_at, mapped.version
+        finally:
+            self.file_cache.release(mapped)
+
+    async def send_chunk(self, request: dict, addr: tuple):
+        filename = request["filename"]
+        rng = request["range"]
+        dest_node_id = request["src_node_id"]
+        file_path = self.shared_path(filename)
+        if file_path is None:
+            return
+        piece_size = request["piece_size"]
+        # a piece leaves with its header in one datagram, never larger than the largest UDP payload
+        max_piece_size = config.constants.LOOPBACK_DATAGRAM_SIZE - ChunkSharing.layout.size - len(filename.encode())
+        if not 0 < piece_size <= max_piece_size:
+            return
+        pieces_count = pieces_count_of(rng, piece_size)
+        # the acks of the requester come with the id of its request
+        inbox = self.endpoint.open_stream(addr=addr, req_id=request["req_id"])
+        progress = ProgressLog(node_id=self.node_id, total=pieces_count,
+                               describe=lambda sent, total: f"{sent}/{total} pieces of the chunk {rng} of {filename} "
+                                                            f"have been sent to node{dest_node_id} (with retransmissions)")
+        compressor = None
+        sent_bytes = 0
+        try:
+            with self.split_file_to_chunks(file_path=file_path, rng=rng, piece_size=piece_size) as (piece_at, version):
+                def piece_key(idx: int, piece_codec: int) -> tuple:
+                    return file_path, version, rng[0] + idx * piece_size, piece_size, piece_codec
+
+                # the pieces are compressed ahead of the sender if the requester decodes a codec of ours,
+                # and a sample of the start and middle of the chunk compresses well
+                codec = choose_codec(request["codec"])
+                sample_size = config.constants.COMPRESS_SAMPLE_SIZE // 2
+                if codec != NONE and is_compressible(bytes(piece_at(0)[:sample_size]) +
+                                                     bytes(piece_at(pieces_count // 2)[:sample_size])):
+                    compressor = PieceCompressor(codec=codec, piece_at=piece_at,
+                                                 pieces_count=pieces_count, pool=self.compress_pool,
+                                                 skip=lambda idx: piece_key(idx, codec) in self.piece_cache)
+
+                def next_piece(idx: int) -> tuple:
+                    '''
+                    :return: (piece, codec it is compressed with), from the cache of the hot pieces if it is there
+                    '''
+                    if compressor is not None:
+                        cached = self.piece_cache.get(piece_key(idx, codec))
+                        if cached is not None:
+                            return cached, codec
+                    cached = self.piece_cache.get(piece_key(idx, NONE))
+                    if cached is not None:
+                        return cached, NONE
+                    chunk, piece_codec = compressor.piece(idx) if compressor is not None else (piece_at(idx), NONE)
+                    key = piece_key(idx, piece_codec)
+                    if self.piece_cache.wants(key):
+                        self.piece_cache.put(key, bytes(chunk))
+                    return chunk, piece_codec
+
+                def make_piece(idx: int) -> list:
+                    nonlocal sent_bytes
+                    chunk, piece_codec = next_piece(idx)
+                    sent_bytes += len(chunk)
+                    msg = ChunkSharing(src_node_id=self.node_id,
+                                       dest_node_id=dest_node_id,
+                                       filename=filename,
+                                       range=rng,
+                                       idx=idx,
+                                       chunk=chunk,
+                                       piece_size=piece_size,
+                                       codec=piece_codec).in_reply_to(request)
+                    progress.step()
+                    # header and piece are handed to the kernel as they are, without being joined
+                    return msg.encode_parts()
+
+                # when every piece is acked, we tell the neighboring peer that sending has finished (idx = -1)
+                fin_msg = ChunkSharing(src_node_id=self.node_id,
+                                       dest_node_id=dest_node_id,
+                                       filename=filename,
+                                       range=rng).in_reply_to(request)
+                sender = ReliableSender(send=functools.partial(self.endpoint.send, addr=addr),
+                                        inbox=inbox,
+                                        pieces_count=pieces_count,
+                                        make_piece=make_piece,
+                                        make_fin=fin_msg.encode,
+                                        send_many=functools.partial(self.endpoint.send_many, addr=addr))
+                try:
+                    if compressor is not None:
+                        await compressor.head_start(config.constants.INITIAL_CWND)
+                    is_sent = await sender.run()
+                finally:
+                    if compressor is not None:
+                        await compressor.close()
+        finally:
+            self.endpoint.close_stream(addr=addr, req_id=request["req_id"])
+
+        # the metrics are updated once per chunk, not on the path of the pieces
+        peer = (f"node{dest_node_id}",)
+        self.sent_bytes.inc(sent_bytes, peer)
+        self.sent_pieces.inc(sender.window.sent_count, peer)
+        self.retransmissions.inc(sender.window.retransmissions_count, peer)
+        if sender.cancelled:
+            log_content = f"Node{dest_node_id} gave up the chunk {rng} of {filename}, sending is stopped."
             log(node_id=self.node_id, content=log_content)
-            self.send_segment(sock=temp_sock,
-                              data=Message.encode(msg),
-                              addr=("localhost", dest_port))
-        # now let's tell the neighboring peer that sending has finished (idx = -1)
-        msg = ChunkSharing(src_node_id=self.node_id,
-                           dest_node_id=dest_node_id,
-                           filename=filename,
-                           range=rng)
-        self.send_segment(sock=temp_sock,
-                          data=Message.encode(msg),
-                          addr=("localhost", dest_port))
+            return
+        if not is_sent:
+            self.failed_chunks.inc(1, (f"node{dest_node_id}", "upload"))
+            log_content = f"Node{dest_node_id} stopped acknowledging the chunk {rng} of {filename}. Sending is abandoned!"
+            log(node_id=self.node_id, content=log_content)
+            return
 
-        log_content = "The process of sending a chunk to node{} of file {} has finished!".format(dest_node_id, filename)
+        log_content = "The process of sending a chunk to node{} of file {} has finished! ({} retransmissions{})".format(
+            dest_node_id, filename, sender.window.retransmissions_count,
+            f", {compressor.compressed_count} compressed pieces" if compressor is not None else "")
         log(node_id=self.node_id, content=log_content)
 
+        # the upload count ranks the owners in the tracker, a DHT has none
+        if self.dht is not None:
+            return
         msg = Node2Tracker(node_id=self.node_id,
                            mode=config.tracker_requests_mode.UPDATE,
                            filename=filename)
 
-        self.send_segment(sock=temp_sock,
-                          data=Message.encode(msg),
-                          addr=tuple(config.constants.TRACKER_ADDR))
-
-        free_socket(temp_sock)
+        self.send_segment(data=Message.encode(msg),
+                          addr=self.shard_map.shard_of(filename))
 
     def handle_requests(self, msg: dict, addr: tuple):
+        # the DHT requests are answered whatever the mode of the node
+        if "dht_kind" in msg:
+            if self.dht is not None:
+                self.dht.handle(msg=msg, addr=addr)
+            return
+        # requests are only served once the node is in send mode
+        if not self.is_in_send_mode:
+            return
         # 1. asks the node about a file size
         if "size" in msg.keys() and msg["size"] == -1:
-            self.tell_file_size(msg=msg, addr=addr)
+            self.spawn(self.tell_file_size(msg=msg, addr=addr))
         # 2. Wants a chunk of a file
-        elif "range" in msg.keys() and msg["chunk"] is None:
-            self.send_chunk(filename=msg["filename"],
-                            rng=msg["range"],
-                            dest_node_id=msg["src_node_id"],
-                            dest_port=addr[1])
-
-    def listen(self):
-        while True:
-            data, addr = self.send_socket.recvfrom(config.constants.BUFFER_SIZE)
-            msg = Message.decode(data)
-            self.handle_requests(msg=msg, addr=addr)
-
-    def set_send_mode(self, filename: str):
+        elif "chunk" in msg.keys() and msg["chunk"] is None:
+            # a request sent again while its chunk is being sent goes to the transfer, but
+            # a late copy may arrive after it: it must be served only once
+            request_key = (addr, msg["req_id"])
+            now = time.monotonic()
+            self.served_requests = {k: t for k, t in self.served_requests.items()
+                                    if now - t < config.constants.TRANSFER_IDLE_TIMEOUT}
+            if request_key in self.served_requests:
+                return
+            self.served_requests[request_key] = now
+            rng = msg["range"]
+            self.uploads.push(requester=addr, cost=rng[1] - rng[0], item=(msg, now))
+            self.dispatch_uploads()
+        # 3. Probes the path to tell how large its pieces may be
+        elif "probe_size" in msg.keys():
+            reply = PathProbe(src_node_id=self.node_id,
+                              dest_node_id=msg["src_node_id"],
+                              probe_size=msg["received_size"],
+                              padded=False).in_reply_to(msg)
+            self.send_segment(data=reply.encode(), addr=addr)
+
+    def dispatch_uploads(self):
+        '''
+        Starts sending the queued chunks, as long as fewer than MAX_UPLOAD_WORKERS are being sent
+        '''
+        while self.uploads.running_count < config.constants.MAX_UPLOAD_WORKERS:
+            entry = self.uploads.pop()
+            if entry is None:
+                return
+            addr, (request, requested_at) = entry
+            if time.monotonic() - requested_at > config.constants.UPLOAD_QUEUE_TIMEOUT:
+                self.uploads.done(addr)
+                continue
+            task = self.spawn(self.send_chunk(request=request, addr=addr))
+            task.add_done_callback(lambda _, addr=addr: self.upload_done(addr))
+
+    def upload_done(self, addr: tuple):
+        self.uploads.done(addr)
+        self.dispatch_uploads()
+
+    async def set_send_mode(self, filename: str):
         if filename not in self.files:
             log(node_id=self.node_id,
                 content=f"You don't have {filename}")
             return
-        message = Node2Tracker(node_id=self.node_id,
-                               mode=config.tracker_requests_mode.OWN,
-                               filename=filename)
+        # the piece manifest is computed once and cached next to the file
+        file_path = f"{config.directory.node_files_dir}node{self.node_id}/{filename}"
+        await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(load_or_create_manifest, file_path=file_path, pool=self.hash_pool))
+        if self.dht is not None:
+            await self.dht.announce(filename)
+        else:
+            message = Node2Tracker(node_id=self.node_id,
+                                   mode=config.tracker_requests_mode.OWN,
+                                   filename=filename)
 
-        self.send_segment(sock=self.send_socket,
-                          data=message.encode(),
-                          addr=tuple(config.constants.TRACKER_ADDR))
+            self.send_segment(data=message.encode(),
+                              addr=self.shard_map.shard_of(filename))
+        if config.constants.CHUNK_DEDUP:
+            # so are its content-defined chunks, which downloaders look for in their own files. The file is
+            # announced first: until they are computed, downloaders just don't reuse their own chunks
+            self.index_files([filename])
 
         if self.is_in_send_mode:    # has been already in send(upload) mode
             log_content = f"Some other node also requested a file from you! But you are already in SEND(upload) mode!"
@@ -130,84 +375,154 @@ class Node:
             self.is_in_send_mode = True
             log_content = f"You are free now! You are waiting for other nodes' requests!"
             log(node_id=self.node_id, content=log_content)
-            t = Thread(target=self.listen, args=())
-            t.setDaemon(True)
-            t.start()
 
-    def ask_file_size(self, filename: str, file_owner: tuple) -> int:
-        temp_port = generate_random_port()
-        temp_sock = set_socket(temp_port)
+    async def ask_file_size(self, filename: str, file_owner: tuple) -> int:
+        '''
+        :return: size of the file, or -1 if the owner doesn't have it or doesn't answer
+        '''
         dest_node = file_owner[0]
 
         msg = Node2Node(src_node_id=self.node_id,
                         dest_node_id=dest_node["node_id"],
                         filename=filename)
-        self.send_segment(sock=temp_sock,
-                          data=msg.encode(),
-                          addr=tuple(dest_node["addr"]))
-        while True:
-            data, addr = temp_sock.recvfrom(config.constants.BUFFER_SIZE)
-            dest_node_response = Message.decode(data)
-            size = dest_node_response["size"]
-            free_socket(temp_sock)
-
-            return size
+        dest_node_response = await self.endpoint.request(msg=msg, addr=tuple(dest_node["addr"]))
+        if dest_node_response is None:
+            log_content = f"Node{dest_node['node_id']} did not tell the size of {filename}."
+            log(node_id=self.node_id, content=log_content)
+            return -1
+        return dest_node_response["size"]
 
-    def tell_file_size(self, msg: dict, addr: tuple):
+    async def tell_file_size(self, msg: dict, addr: tuple):
         filename = msg["filename"]
-        file_path = f"{config.directory.node_files_dir}node{self.node_id}/{filename}"
-        file_size = os.stat(file_path).st_size
+        # the size of a file the node doesn't hold is -1, like a missing one
+        file_size = -1
+        file_path = self.shared_path(filename)
+        if file_path is not None:
+            if filename.endswith(MANIFEST_SUFFIX):
+                original_path = file_path[:-len(MANIFEST_SUFFIX)]
+                if os.path.isfile(original_path):
+                    await asyncio.get_running_loop().run_in_executor(
+                        None, functools.partial(load_or_create_manifest, file_path=original_path, pool=self.hash_pool))
+            elif filename.endswith(CHUNKS_SUFFIX):
+                original_path = file_path[:-len(CHUNKS_SUFFIX)]
+                if os.path.isfile(original_path):
+                    await asyncio.get_running_loop().run_in_executor(self.index_pool, load_or_create_chunk_list,
+                                                                     original_path)
+            try:
+                file_size = os.stat(file_path).st_size
+            except FileNotFoundError:
+                pass
         response_msg = Node2Node(src_node_id=self.node_id,
                         dest_node_id=msg["src_node_id"],
                         filename=filename,
-                        size=file_size)
-        temp_port = generate_random_port()
-        temp_sock = set_socket(temp_port)
-        self.send_segment(sock=temp_sock,
-                          data=response_msg.encode(),
+                        size=file_size).in_reply_to(msg)
+        self.send_segment(data=response_msg.encode(),
                           addr=addr)
 
-        free_socket(temp_sock)
-
-    def receive_chunk(self, filename: str, range: tuple, file_owner: tuple):
+    async def receive_chunk(self, filename: str, range: tuple, file_owner: tuple) -> bool:
         dest_node = file_owner[0]
+        dest_addr = tuple(dest_node["addr"])
+        if range[1] <= range[0]:
+            return True
+        # the pieces are as large as the path allows, and the socket must hold a window of them
+        piece_size = await self.path_mtu.piece_size(addr=dest_addr, dest_node_id=dest_node["node_id"], filename=filename)
+        pieces_count = pieces_count_of(range, piece_size)
+        self.endpoint.reserve_receive_buffer(piece_size * config.constants.MAX_CWND)
+        # the pieces of the chunk come back with the id of the request
+        req_id, inbox = self.endpoint.open_exchange(dest_addr)
         # we set idx of ChunkSharing to -1, because we want to tell it that we
         # need the chunk from it
+        estimate = self.peer_stats.get(dest_node["node_id"])
         msg = ChunkSharing(src_node_id=self.node_id,
                            dest_node_id=dest_node["node_id"],
                            filename=filename,
-                           range=range)
-        temp_port = generate_random_port()
-        temp_sock = set_socket(temp_port)
-        self.send_segment(sock=temp_sock,
-                          data=msg.encode(),
-                          addr=tuple(dest_node["addr"]))
-        log_content = "I sent a request for a chunk of {0} for node{1}".format(filename, dest_node["node_id"])
-        log(node_id=self.node_id, content=log_content)
-
-        while True:
-            data, addr = temp_sock.recvfrom(config.constants.BUFFER_SIZE)
-            msg = Message.decode(data) # but this is not a simple message, it contains chunk's bytes
-            if msg["idx"] == -1: # end of the file
-                free_socket(temp_sock)
+                           range=range,
+                           piece_size=piece_size,
+                           codec=accepted_codecs(bandwidth=estimate.bandwidth if estimate is not None else None))
+        msg.req_id = req_id
+        sink = self.downloaded_files[filename]
+        requested_at = time.monotonic()
+        first_piece_at = last_piece_at = None
+        first_piece_bytes = received_bytes = received_pieces = 0
+
+        async def write_piece(piece: dict):
+            nonlocal first_piece_at, last_piece_at, first_piece_bytes, received_bytes, received_pieces
+            last_piece_at = time.monotonic()
+            chunk = piece["chunk"]
+            if first_piece_at is None:
+                first_piece_at, first_piece_bytes = last_piece_at, len(chunk)
+            received_bytes += len(chunk)
+            received_pieces += 1
+            if piece["codec"] != NONE:
+                try:
+                    chunk = decompress(piece["codec"], chunk, max_size=piece_size)
+                except ValueError as e:
+                    # the piece is lost, its hashed piece is never verified and is asked for again
+                    log(node_id=self.node_id, content=f"A piece of {filename} from node{dest_node['node_id']} is dropped: {e}")
+                    return
+            # each piece goes straight to its offset in the file, nothing is kept in memory; its offset
+            # is taken from the range which was asked for, a piece of any other range is dropped
+            if (piece["range"] != range or not 0 <= piece["idx"] < pieces_count
+                    or range[0] + piece["idx"] * piece_size + len(chunk) > range[1]):
+                log(node_id=self.node_id, content=f"A piece of {filename} from node{dest_node['node_id']} is dropped: "
+                                                  f"piece {piece['idx']} of {piece['range']} is not in the chunk {range}")
                 return
+            await sink.write_piece(rng=range, idx=piece["idx"], piece=chunk, piece_size=piece_size)
 
-            self.downloaded_files[filename].append(msg)
-
-    def sort_downloaded_chunks(self, filename: str) -> list:
-        sort_result_by_range = sorted(self.downloaded_files[filename],
-                                      key=itemgetter("range"))
-        group_by_range = groupby(sort_result_by_range,
-                                 key=lambda i: i["range"])
-        sorted_downloaded_chunks = []
-        for key, value in group_by_range:
-            value_sorted_by_idx = sorted(list(value),
-                                         key=itemgetter("idx"))
-            sorted_downloaded_chunks.append(value_sorted_by_idx)
-
-        return sorted_downloaded_chunks
-
-    def split_file_owners(self, file_owners: list, filename: str):
+        def make_ack(cum_ack: int, sacks: list) -> bytes:
+            ack = ChunkAck(src_node_id=self.node_id,
+                           dest_node_id=dest_node["node_id"],
+                           filename=filename,
+                           range=range,
+                           cum_ack=cum_ack,
+                           sacks=sacks)
+            ack.req_id = req_id
+            return ack.encode()
+
+        receiver = ReliableReceiver(send=functools.partial(self.endpoint.send, addr=dest_addr),
+                                    inbox=inbox,
+                                    pieces_count=pieces_count,
+                                    on_piece=write_piece,
+                                    make_ack=make_ack)
+        log_content = "I sent a request for a chunk of {0} for node{1}".format(filename, dest_node["node_id"])
+        log(node_id=self.node_id, content=log_content)
+        async def linger():
+            try:
+                await receiver.linger()
+            finally:
+                self.endpoint.close_exchange(req_id)
+
+        is_received = False
+        try:
+            is_received = await receiver.run(request=msg.encode())
+        except asyncio.CancelledError:
+            # e.g. another owner sent the block first in endgame: its sender stops instead of waiting for acks
+            receiver.cancel()
+            raise
+        finally:
+            if is_received:
+                # the chunk is there, the exchange stays open until the sender tells it is over
+                self.spawn(linger())
+            else:
+                self.endpoint.close_exchange(req_id)
+        peer = (f"node{dest_node['node_id']}",)
+        self.received_bytes.inc(received_bytes, peer)
+        self.received_pieces.inc(received_pieces, peer)
+        if not is_received:
+            self.failed_chunks.inc(1, (peer[0], "download"))
+            self.peer_stats.on_failure(dest_node["node_id"])
+            log_content = f"Node{dest_node['node_id']} stopped sending the chunk {range} of {filename}!"
+            log(node_id=self.node_id, content=log_content)
+        elif first_piece_at is not None:
+            # the first piece arrives one rtt (and the time the request waited) after the request, the others follow at the bandwidth
+            # of the link: it is measured on the bytes of the wire, whether the pieces were compressed or not
+            self.peer_stats.on_chunk(dest_node["node_id"],
+                                     rtt=first_piece_at - requested_at,
+                                     nbytes=received_bytes - first_piece_bytes,
+                                     seconds=last_piece_at - first_piece_at)
+        return is_received
+
+    async def split_file_owners(self, file_owners: list, filename: str):
         owners = []
         for owner in file_owners:
             if owner[0]['node_id'] != self.node_id:
@@ -216,53 +531,244 @@ class Node:
             log_content = f"No one has {filename}"
             log(node_id=self.node_id, content=log_content)
             return
-        # sort owners based on their sending frequency
-        owners = sorted(owners, key=lambda x: x[1], reverse=True)
+        # the owners expected to send a block the fastest come first (see peer_stats.py)
+        block_bytes = config.constants.SCHEDULER_BLOCK_PIECES * config.constants.CHUNK_PIECES_SIZE
+        owners = self.peer_stats.rank(owners, block_bytes)
 
         to_be_used_owners = owners[:config.constants.MAX_SPLITTNES_RATE]
         # 1. first ask the size of the file from peers
         log_content = f"You are going to download {filename} from Node(s) {[o[0]['node_id'] for o in to_be_used_owners]}"
         log(node_id=self.node_id, content=log_content)
-        file_size = self.ask_file_size(filename=filename, file_owner=to_be_used_owners[0])
+        phase_started_at = time.monotonic()
+        file_size = -1
+        for owner in to_be_used_owners:
+            file_size = await self.ask_file_size(filename=filename, file_owner=owner)
+            if file_size >= 0:
+                break
+        phase_started_at = self.phase_done("size_query", phase_started_at)
+        if file_size < 0:
+            log_content = f"None of the owners of {filename} told its size."
+            log(node_id=self.node_id, content=log_content)
+            self.downloads_count.inc(1, ("failed",))
+            return
         log_content = f"The file {filename} which you are about to download, has size of {file_size} bytes"
         log(node_id=self.node_id, content=log_content)
 
-        # 2. Now, we know the size, let's split it equally among peers to download chunks of it from them
-        step = file_size / len(to_be_used_owners)
-        chunks_ranges = [(round(step*i), round(step*(i+1))) for i in range(len(to_be_used_owners))]
-
-        # 3. Create a thread for each neighbor peer to get a chunk from it
-        self.downloaded_files[filename] = []
-        neighboring_peers_threads = []
-        for idx, obj in enumerate(to_be_used_owners):
-            t = Thread(target=self.receive_chunk, args=(filename, chunks_ranges[idx], obj))
-            t.setDaemon(True)
-            t.start()
-            neighboring_peers_threads.append(t)
-        for t in neighboring_peers_threads:
-            t.join()
-
-        log_content = "All the chunks of {} has downloaded from neighboring peers. But they must be reassembled!".format(filename)
-        log(node_id=self.node_id, content=log_content)
-
-        # 4. Now we have downloaded all the chunks of the file. It's time to sort them.
-        sorted_chunks = self.sort_downloaded_chunks(filename=filename)
-        log_content = f"All the pieces of the {filename} is now sorted and ready to be reassembled."
-        log(node_id=self.node_id, content=log_content)
+        # 2. Get the manifest of the file, every piece is verified against it as soon as it lands
+        manifest = await self.fetch_manifest(filename=filename, file_size=file_size, owners=to_be_used_owners)
+        phase_started_at = self.phase_done("manifest", phase_started_at)
+        if manifest is None:
+            log_content = f"No valid piece manifest of {filename} could be received, so it can't be verified."
+            log(node_id=self.node_id, content=log_content)
+            self.downloads_count.inc(1, ("failed",))
+            return
 
-        # 5. Finally, we assemble the chunks to re-build the file
-        total_file = []
+        # 3. The pieces are verified and written to a preallocated part file at their offsets as soon as
+        # they arrive. Those an interrupted download of the file has written are kept, and
+        # those made of chunks we already hold in other files are taken from them.
         file_path = f"{config.directory.node_files_dir}node{self.node_id}/{filename}"
-        for chunk in sorted_chunks:
-            for piece in chunk:
-                total_file.append(piece["chunk"])
-        self.reassemble_file(chunks=total_file,
-                             file_path=file_path)
-        log_content = f"{filename} has successfully downloaded and saved in my files directory."
+        verifier = PieceVerifier(manifest=manifest, pool=self.hash_pool)
+        sink = DownloadSink(file_path=file_path, file_size=file_size, verifier=verifier)
+        self.downloaded_files[filename] = sink
+        chunk_list = None
+        missing_pieces = None
+        resumed_count = await sink.resume()
+        if resumed_count:
+            missing_pieces = await verifier.wait_pieces(0, manifest.pieces_count)
+            log_content = (f"{resumed_count} of the {manifest.pieces_count} pieces of {filename} were downloaded "
+                           f"before, only the {len(missing_pieces)} others are requested.")
+            log(node_id=self.node_id, content=log_content)
+        if config.constants.CHUNK_DEDUP:
+            chunk_list = await self.fetch_chunk_list(filename=filename, file_size=file_size, owners=to_be_used_owners)
+        if chunk_list is not None:
+            missing_pieces = await self.reuse_local_chunks(filename=filename, chunk_list=chunk_list, verifier=verifier)
+        if config.constants.CHUNK_DEDUP:
+            phase_started_at = self.phase_done("dedup", phase_started_at)
+
+        # 4. The other pieces are handed out to the peers in small blocks from a shared queue: a task for
+        # each neighbor peer pulls a new block as soon as it is done with the previous one, so fast peers download more.
+        scheduler = PieceScheduler(pieces_count=manifest.pieces_count,
+                                   block_pieces=config.constants.SCHEDULER_BLOCK_PIECES,
+                                   peers=[o[0]['node_id'] for o in to_be_used_owners],
+                                   pieces=missing_pieces)
+        await asyncio.gather(*(self.download_blocks(filename, owner, scheduler, verifier, file_size)
+                               for owner in to_be_used_owners))
+        phase_started_at = self.phase_done("transfer", phase_started_at)
+
+        if not scheduler.done():
+            self.downloaded_files.pop(filename).close()
+            log_content = f"Downloading {filename} failed, some of its pieces could not be received intact."
+            log(node_id=self.node_id, content=log_content)
+            self.downloads_count.inc(1, ("failed",))
+            return
+
+        # 5. Every piece is already in place and verified, so the part file just takes its real name
+        await asyncio.get_running_loop().run_in_executor(None, self.downloaded_files.pop(filename).finalize)
+        # the manifest must stay newer than the file, so that it is used when we seed the file
+        os.utime(file_path + MANIFEST_SUFFIX)
+        if chunk_list is not None:
+            await asyncio.get_running_loop().run_in_executor(None, self.keep_chunk_list, filename, chunk_list)
+        self.phase_done("reassembly", phase_started_at)
+        self.downloads_count.inc(1, ("completed",))
+        log_content = (f"{filename} has successfully downloaded and saved in my files directory. "
+                       f"({verifier.failed_count} corrupted pieces replaced, {scheduler.endgame_duplicates} endgame requests)")
         log(node_id=self.node_id, content=log_content)
         self.files.append(filename)
+        if config.constants.REPORT_PEER_STATS and self.dht is None:
+            self.report_peer_stats(filename=filename, peers=[o[0]['node_id'] for o in to_be_used_owners])
+
+    def phase_done(self, phase: str, started_at: float) -> float:
+        '''
+        :return: when the phase ended, the next one starts then
+        '''
+        now = time.monotonic()
+        self.phase_seconds.observe(now - started_at, (phase,))
+        return now
+
+    async def download_blocks(self, filename: str, file_owner: tuple, scheduler: PieceScheduler,
+                              verifier: PieceVerifier, file_size: int):
+        '''
+        Keeps downloading the blocks the scheduler hands out from one owner until there is nothing left.
+        An owner which stops sending is given nothing more.
+        '''
+        peer = file_owner[0]['node_id']
+        piece_size = verifier.manifest.piece_size
+        block_bytes = config.constants.SCHEDULER_BLOCK_PIECES * piece_size
+        while True:
+            block = await scheduler.next_block(peer)
+            if block is None:
+                break
+            rng = (block[0] * piece_size, min(block[1] * piece_size, file_size))
+            # in endgame, the download is cancelled (and its exchange closed) if another owner completes the block first
+            task = asyncio.ensure_future(self.receive_chunk(filename, rng, file_owner))
+            scheduler.attach(block, peer, task)
+            try:
+                await asyncio.wait((task,))
+            finally:
+                task.cancel()   # if this download itself is cancelled
+                scheduler.detach(block, peer)
+            if task.cancelled():
+                continue
+            if not task.result():
+                scheduler.fail(block, peer)
+                break
+            failed_pieces = await verifier.wait_pieces(*block)
+            if failed_pieces:
+                # only the failed pieces are requested again, preferably from another owner
+                log_content = f"{len(failed_pieces)} piece(s) of {filename} from node{peer} are missing or corrupted."
+                log(node_id=self.node_id, content=log_content)
+                scheduler.fail(block, peer, pieces=failed_pieces)
+            else:
+                scheduler.complete(block)
+            if self.peer_stats.is_slow(peer, scheduler.active_peers, block_bytes):
+                log_content = f"Node{peer} is much slower than the other owners of {filename}, its blocks are left to them."
+                log(node_id=self.node_id, content=log_content)
+                break
+        scheduler.leave(peer)
+
+    def report_peer_stats(self, filename: str, peers: list):
+        '''
+        Tells the tracker shard of the file how fast the peers we downloaded it from were
+        '''
+        for peer in peers:
+            estimate = self.peer_stats.get(peer)
+            if estimate is None or estimate.bandwidth is None:
+                continue
+            msg = PeerReport(node_id=self.node_id, peer_id=peer, bandwidth=estimate.bandwidth, rtt=estimate.rtt)
+            self.send_segment(data=msg.encode(), addr=self.shard_map.shard_of(filename))
+
+    async def fetch_manifest(self, filename: str, file_size: int, owners: list):
+        '''
+        Downloads the piece manifest of a file (from the first owner which has a valid one).
+        It is kept next to the file, so we can seed the file without hashing it again.
+
+        :return: PieceManifest, or None
+        '''
+        manifest_name = filename + MANIFEST_SUFFIX
+        manifest_path = f"{config.directory.node_files_dir}node{self.node_id}/{manifest_name}"
+        for owner in owners:
+            if not await self.fetch_whole_file(filename=manifest_name, file_owner=owner):
+                continue
+            try:
+                manifest = PieceManifest.load(manifest_path)
+            except ValueError:
+                continue
+            if manifest.file_size == file_size and manifest.piece_size == config.constants.CHUNK_PIECES_SIZE:
+                return manifest
+        return None
+
+    async def fetch_chunk_list(self, filename: str, file_size: int, owners: list):
+        '''
+        Downloads the content-defined chunk list of a file (from the first owner which has a valid one)
+
+        :return: ChunkList, or None
+        '''
+        chunks_name = filename + CHUNKS_SUFFIX
+        chunks_path = f"{config.directory.node_files_dir}node{self.node_id}/{chunks_name}"
+        for owner in owners:
+            if not await self.fetch_whole_file(filename=chunks_name, file_owner=owner):
+                continue
+            try:
+                chunk_list = ChunkList.load(chunks_path)
+            except ValueError:
+                continue
+            if chunk_list.file_size == file_size:
+                return chunk_list
+        return None
+
+    async def fetch_whole_file(self, filename: str, file_owner: tuple) -> bool:
+        '''
+        Downloads a small file (a manifest or a chunk list) as one chunk, it isn't verified
+        '''
+        file_size = await self.ask_file_size(filename=filename, file_owner=file_owner)
+        if file_size < 0:
+            return False
+        file_path = f"{config.directory.node_files_dir}node{self.node_id}/{filename}"
+        self.downloaded_files[filename] = DownloadSink(file_path=file_path, file_size=file_size)
+        if not await self.receive_chunk(filename, (0, file_size), file_owner):
+            self.downloaded_files.pop(filename).close()
+            return False
+        self.downloaded_files.pop(filename).finalize()
+        return True
+
+    async def reuse_local_chunks(self, filename: str, chunk_list: ChunkList, verifier: PieceVerifier) -> set:
+        '''
+        Writes the chunks of a file being downloaded which we already hold in our other files (see chunk_store.py).
+        They go through the verifier like downloaded pieces.
+
+        :return: indices of the hashed pieces which are still to be downloaded
+        '''
+        loop = asyncio.get_running_loop()
+        sink = self.downloaded_files[filename]
+        # the files were indexed when the node started or announced them; those which changed since are indexed
+        # again in the background, for the next downloads
+        self.index_files(self.files)
+        for offset, digest, size in chunk_list.offsets():
+            if digest not in self.chunk_store:
+                continue
+            data = await loop.run_in_executor(None, self.chunk_store.read, digest)
+            if data is not None:
+                await sink.write_piece(rng=(offset, offset + size), idx=0, piece=data, piece_size=size)
+        pieces_count = verifier.manifest.pieces_count
+        missing_pieces = await verifier.wait_pieces(0, pieces_count)
+        log_content = (f"{pieces_count - len(missing_pieces)} of the {pieces_count} pieces of {filename} "
+                       f"were found in the files you already have.")
+        log(node_id=self.node_id, content=log_content)
+        return missing_pieces
 
-    def set_download_mode(self, filename: str):
+    def keep_chunk_list(self, filename: str, chunk_list: ChunkList):
+        '''
+        Keeps the chunk list received with a downloaded file, once it is checked against the file
+        '''
+        file_path = f"{config.directory.node_files_dir}node{self.node_id}/{filename}"
+        if matches_file(chunk_list, file_path):
+            # like the manifest, it must stay newer than the file
+            os.utime(file_path + CHUNKS_SUFFIX)
+            self.chunk_store.add(filename, chunk_list)
+        else:
+            os.remove(file_path + CHUNKS_SUFFIX)
+
+    async def set_download_mode(self, filename: str):
         file_path = f"{config.directory.node_files_dir}node{self.node_id}/{filename}"
         if os.path.isfile(file_path):
             log_content = f"You already have this file!"
@@ -271,44 +777,77 @@ class Node:
         else:
             log_content = f"You just started to download {filename}. Let's search it in torrent!"
             log(node_id=self.node_id, content=log_content)
-            tracker_response = self.search_torrent(filename=filename)
+            search_started_at = time.monotonic()
+            tracker_response = await self.search_torrent(filename=filename)
+            self.phase_done("search", search_started_at)
+            if tracker_response is None:
+                log_content = f"The tracker did not answer the search of {filename}."
+                log(node_id=self.node_id, content=log_content)
+                return
             file_owners = tracker_response['search_result']
-            self.split_file_owners(file_owners=file_owners, filename=filename)
-
-    def search_torrent(self, filename: str) -> dict:
-        msg = Node2Tracker(node_id=self.node_id,
-                           mode=config.tracker_requests_mode.NEED,
-                           filename=filename)
-        temp_port = generate_random_port()
-        search_sock = set_socket(temp_port)
-        self.send_segment(sock=search_sock,
-                          data=msg.encode(),
-                          addr=tuple(config.constants.TRACKER_ADDR))
-        # now we must wait for the tracker response
+            await self.split_file_owners(file_owners=file_owners, filename=filename)
+
+    async def search_torrent(self, filename: str) -> dict:
+        '''
+        :return: the response of the tracker (or a response of the same form from the DHT), or None if it doesn't answer
+        '''
+        if self.dht is not None:
+            owners = await self.dht.find_owners(filename)
+            return {"search_result": [({'node_id': node_id, 'addr': addr}, 0) for node_id, addr in owners],
+                    "filename": filename}
+        # the tracker ranks the owners by the reports of the other nodes and sends them a page at a time,
+        # pages are asked for until TRACKER_SEARCH_OWNERS owners are known or there are no more
+        wanted = config.constants.TRACKER_SEARCH_OWNERS
+        response, cursor = None, 0
         while True:
-            data, addr = search_sock.recvfrom(config.constants.BUFFER_SIZE)
-            tracker_msg = Message.decode(data)
-            return tracker_msg
+            msg = Node2Tracker(node_id=self.node_id,
+                               mode=config.tracker_requests_mode.NEED,
+                               filename=filename,
+                               order=ORDER_SPEED,
+                               limit=wanted - (len(response['search_result']) if response else 0),
+                               cursor=cursor)
+            # the request is sent again until the tracker responds
+            page = await self.endpoint.request(msg=msg, addr=self.shard_map.shard_of(filename))
+            if page is None:
+                return response
+            if response is None:
+                response = page
+            else:
+                response['search_result'].extend(page['search_result'])
+            cursor = page['next_cursor']
+            if not cursor or len(response['search_result']) >= wanted:
+                return response
 
     def fetch_owned_files(self) -> list:
         files = []
         node_files_dir = config.directory.node_files_dir + 'node' + str(self.node_id)
         if os.path.isdir(node_files_dir):
             _, _, files = next(os.walk(node_files_dir))
+            # unfinished downloads are not owned yet, and manifests and chunk lists are not files of the torrent
+            files = [f for f in files if not f.endswith((PART_SUFFIX, BITFIELD_SUFFIX, MANIFEST_SUFFIX,
+                                                         MANIFEST_SUFFIX + ".tmp", CHUNKS_SUFFIX, CHUNKS_SUFFIX + ".tmp"))]
         else:
             os.makedirs(node_files_dir)
 
         return files
 
+    def unfinished_downloads(self) -> list:
+        '''
+        :return: the files whose download was interrupted, with their pieces written so far
+        '''
+        node_files_dir = f"{config.directory.node_files_dir}node{self.node_id}"
+        _, _, files = next(os.walk(node_files_dir))
+        files = set(files)
+        return [f[:-len(BITFIELD_SUFFIX)] for f in sorted(files)
+                if f.endswith(BITFIELD_SUFFIX) and f[:-len(BITFIELD_SUFFIX)] + PART_SUFFIX in files]
+
     def exit_torrent(self):
         msg = Node2Tracker(node_id=self.node_id,
                            mode=config.tracker_requests_mode.EXIT,
                            filename="")
-        self.send_segment(sock=self.send_socket,
-                          data=Message.encode(msg),
-                          addr=tuple(config.constants.TRACKER_ADDR))
-        free_socket(self.send_socket)
-        free_socket(self.rcv_socket)
+        self.send_segment(data=Message.encode(msg),
+                          addr=self.shard_map.registry)
+        self.endpoint.close()
 
         log_content = f"You exited the torrent!"
         log(node_id=self.node_id, content=log_content)
@@ -318,66 +857,76 @@ class Node:
                            mode=config.tracker_requests_mode.REGISTER,
                            filename="")
 
-        self.send_segment(sock=self.send_socket,
-                          data=Message.encode(msg),
-                          addr=tuple(config.constants.TRACKER_ADDR))
+        self.send_segment(data=Message.encode(msg),
+                          addr=self.shard_map.registry)
 
         log_content = f"You entered Torrent."
         log(node_id=self.node_id, content=log_content)
 
-    def inform_tracker_periodically(self, interval: int):
-        global next_call
-        log_content = f"I informed the tracker that I'm still alive in the torrent!"
-        log(node_id=self.node_id, content=log_content)
+    async def inform_tracker_periodically(self, interval: int):
+        loop = asyncio.get_running_loop()
+        next_call = loop.time()
+        while True:
+            log_content = f"I informed the tracker that I'm still alive in the torrent!"
+            log(node_id=self.node_id, content=log_content)
 
-        msg = Node2Tracker(node_id=self.node_id,
-                           mode=config.tracker_requests_mode.REGISTER,
-                           filename="")
+            msg = Node2Tracker(node_id=self.node_id,
+                               mode=config.tracker_requests_mode.REGISTER,
+                               filename="")
 
-        self.send_segment(sock=self.send_socket,
-                          data=msg.encode(),
-                          addr=tuple(config.constants.TRACKER_ADDR))
+            self.send_segment(data=msg.encode(),
+                              addr=self.shard_map.registry)
 
-        datetime.datetime.now()
-        next_call = next_call + interval
-        Timer(next_call - time.time(), self.inform_tracker_periodically, args=(interval,)).start()
+            next_call = next_call + interval
+            await asyncio.sleep(next_call - loop.time())
 
-def run(args):
+async def run(args):
     node = Node(node_id=args.node_id,
-                rcv_port=generate_random_port(),
-                send_port=generate_random_port())
+                port=generate_random_port())
+    await node.start()
     log_content = f"***************** Node program started just right now! *****************"
     log(node_id=node.node_id, content=log_content)
     node.enter_torrent()
 
-    # We create a thread to periodically informs the tracker to tell it is still in the torrent.
-    timer_thread = Thread(target=node.inform_tracker_periodically, args=(config.constants.NODE_TIME_INTERVAL,))
-    timer_thread.setDaemon(True)
-    timer_thread.start()
-
+    # A task periodically informs the tracker to tell it is still in the torrent.
+    node.spawn(node.inform_tracker_periodically(config.constants.NODE_TIME_INTERVAL))
+    if node.dht is not None:
+        await node.dht.bootstrap()
+        node.spawn(node.dht.maintain(config.constants.DHT_REPUBLISH_INTERVAL))
+    if args.metrics_port is not None:
+        await node.metrics.serve(port=args.metrics_port)
+    # the downloads interrupted when the node stopped go on from where they were
+    for filename in node.unfinished_downloads():
+        log(node_id=node.node_id, content=f"The download of {filename} was interrupted, it is resumed.")
+        node.spawn(node.set_download_mode(filename=filename))
+
+    loop = asyncio.get_running_loop()
     print("ENTER YOUR COMMAND!")
     while True:
-        command = input()
+        # input() blocks, so it is read on a thread while the loop keeps serving
+        command = await loop.run_in_executor(None, input)
         mode, filename = parse_command(command)
 
         #################### send mode ####################
         if mode == 'send':
-            node.set_send_mode(filename=filename)
+            await node.set_send_mode(filename=filename)
         #################### download mode ####################
         elif mode == 'download':
-            t = Thread(target=node.set_download_mode, args=(filename,))
-            t.setDaemon(True)
-            t.start()
+            node.spawn(node.set_download_mode(filename=filename))
         #################### exit mode ####################
         elif mode == 'exit':
             node.exit_torrent()
-            exit(0)
+            # the thread reading the commands is still blocked in input(), so we don't wait for it,
+            # and os._exit() doesn't run atexit: the logs are written first
+            logger.close()
+            os._exit(0)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-node_id', type=int,  help='id of the node you want to create')
+    parser.add_argument('-metrics_port', type=int, help='port of the HTTP server of the metrics (see metrics.py), none by default')
     node_args = parser.parse_args()
 
     # run the node
-    run(args=node_args)
+    asyncio.run(run(args=node_args))
@@ -0,0 +1,110 @@
+"""
+Size of the datagrams which reach a peer unfragmented, and the piece size of a transfer.
+
+A transfer is split into pieces as large as the path to the peer allows, since
+fewer and larger datagrams cost fewer system calls and headers per byte:
+- a peer on the loopback gets datagrams of LOOPBACK_DATAGRAM_SIZE bytes,
+- the path to another peer is probed: a PathProbe padded to each size of
+  PMTU_PROBE_SIZES is sent with IP fragmentation turned off, and the largest
+  one the peer acknowledges is used (SAFE_DATAGRAM_SIZE if none comes back),
+- where fragmentation can't be turned off, pieces keep the CHUNK_PIECES_SIZE
+  of the manifests and IP fragments them as needed.
+The probes go from the downloader to the owner while the pieces come back the
+other way, so the path is assumed to be the same in both directions.
+
+The downloader chooses the piece size and puts it in its chunk request.
+"""
+import asyncio
+import ipaddress
+import time
+
+from messages.chunk_sharing import ChunkSharing
+from messages.path_probe import PathProbe
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+MIN_PIECE_SIZE = 256
+
+
+def is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def piece_size_for(datagram_size: int, filename: str) -> int:
+    '''
+    :return: size of the pieces of filename which fit, with their header, in a datagram of datagram_size bytes
+    '''
+    room = datagram_size - ChunkSharing.layout.size - len(filename.encode())
+    hash_size = config.constants.CHUNK_PIECES_SIZE
+    if room >= hash_size:
+        # a whole number of hashed pieces, so they are verified without being copied
+        return room // hash_size * hash_size
+    return max(room, MIN_PIECE_SIZE)
+
+
+class PathMTU:
+    """
+    The probed sizes are cached per host for PMTU_CACHE_TTL seconds, and the
+    transfers which start while a host is being probed wait for that probe.
+
+    :param max_datagram_size: if given, no datagram is larger than this (for benchmarks)
+    """
+    def __init__(self, endpoint, node_id: int, max_datagram_size: int = None):
+        self.endpoint = endpoint
+        self.node_id = node_id
+        self.max_datagram_size = max_datagram_size
+        self.sizes = {}     # host -> (datagram size, time it expires)
+        self.probes = {}    # host -> task probing it
+
+    async def datagram_size(self, addr: tuple, dest_node_id: int) -> int:
+        host = addr[0]
+        if is_loopback(host):
+            size = config.constants.LOOPBACK_DATAGRAM_SIZE
+        else:
+            cached = self.sizes.get(host)
+            if cached is not None and cached[1] > time.monotonic():
+                size = cached[0]
+            else:
+                if host not in self.probes:
+                    self.probes[host] = asyncio.ensure_future(self.probe(addr, dest_node_id))
+                    self.probes[host].add_done_callback(lambda _: self.probes.pop(host, None))
+                size = await asyncio.shield(self.probes[host])
+        if self.max_datagram_size is not None:
+            size = min(size, self.max_datagram_size)
+        return size
+
+    async def piece_size(self, addr: tuple, dest_node_id: int, filename: str) -> int:
+        if not is_loopback(addr[0]) and not self.endpoint.can_send_unfragmented:
+            return config.constants.CHUNK_PIECES_SIZE
+        return piece_size_for(await self.datagram_size(addr, dest_node_id), filename)
+
+    async def probe(self, addr: tuple, dest_node_id: int) -> int:
+        '''
+        :return: the largest of PMTU_PROBE_SIZES the peer received, or SAFE_DATAGRAM_SIZE
+        '''
+        async def reaches(size: int) -> bool:
+            req_id, inbox = self.endpoint.open_exchange(addr)
+            probe = PathProbe(src_node_id=self.node_id, dest_node_id=dest_node_id, probe_size=size)
+            probe.req_id = req_id
+            data = probe.encode_parts()
+            try:
+                for _ in range(config.constants.PMTU_PROBE_RETRIES + 1):
+                    if not self.endpoint.send_unfragmented(data, addr):
+                        return False
+                    try:
+                        reply = await asyncio.wait_for(inbox.get(), config.constants.INITIAL_RTO)
+                    except asyncio.TimeoutError:
+                        continue
+                    return reply["probe_size"] == size
+                return False
+            finally:
+                self.endpoint.close_exchange(req_id)
+
+        sizes = config.constants.PMTU_PROBE_SIZES
+        results = await asyncio.gather(*(reaches(size) for size in sizes))
+        size = max([s for s, ok in zip(sizes, results) if ok], default=config.constants.SAFE_DATAGRAM_SIZE)
+        self.sizes[addr[0]] = (size, time.monotonic() + config.constants.PMTU_CACHE_TTL)
+        return size
@@ -0,0 +1,86 @@
+"""
+Measured speed of the peers a node downloads from, used to choose them.
+
+After every chunk received from a peer, the node updates exponentially
+weighted moving averages (EWMA) of the bandwidth it got from the peer and of
+its round-trip time. The bandwidth is measured on the bytes which came over
+the wire, whether the pieces were compressed or not, so it is the speed of
+the link and not that of the data: it is what decides whether compressing
+pays (see ``piece_codecs.py``). The RTT is measured from the request to the
+first piece, so it also grows when the peer is overloaded and the request
+waits there. A chunk the peer stopped sending halves its bandwidth estimate.
+
+Peers are ranked by the time they are expected to take to send a block:
+``rtt + block bytes / bandwidth``. A peer the node hasn't measured yet is
+ranked by what the other nodes reported to the tracker about it, or else by
+PEER_DEFAULT_BANDWIDTH and PEER_DEFAULT_RTT, so new peers are still tried
+as long as the known ones are not faster than that.
+"""
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+
+class PeerEstimate:
+    __slots__ = ("bandwidth", "rtt")
+
+    def __init__(self, bandwidth: float = None, rtt: float = None):
+        self.bandwidth = bandwidth  # bytes per second, None until a chunk of several pieces is received
+        self.rtt = rtt              # seconds
+
+
+def ewma(average, sample: float, alpha: float) -> float:
+    return sample if average is None else (1 - alpha) * average + alpha * sample
+
+
+class PeerStats:
+    def __init__(self):
+        self.peers = {}     # node_id -> PeerEstimate
+
+    def get(self, peer: int):
+        return self.peers.get(peer)
+
+    def on_chunk(self, peer: int, rtt: float, nbytes: int = 0, seconds: float = 0.0):
+        '''
+        :param rtt: time from the request of the chunk to its first piece
+        :param nbytes: bytes received after the first piece
+        :param seconds: time from the first piece to the last one
+        '''
+        alpha = config.constants.PEER_EWMA_ALPHA
+        estimate = self.peers.setdefault(peer, PeerEstimate())
+        estimate.rtt = ewma(estimate.rtt, rtt, alpha)
+        if nbytes > 0 and seconds > 0:
+            estimate.bandwidth = ewma(estimate.bandwidth, nbytes / seconds, alpha)
+
+    def on_failure(self, peer: int):
+        estimate = self.peers.setdefault(peer, PeerEstimate(rtt=config.constants.MAX_RTO))
+        estimate.bandwidth = (estimate.bandwidth or config.constants.PEER_DEFAULT_BANDWIDTH) / 2
+
+    def expected_time(self, peer: int, nbytes: int, reported: dict = None) -> float:
+        '''
+        :param reported: the search result of the peer, with the bandwidth and rtt other nodes reported to the tracker
+        :return: seconds the peer is expected to take to send nbytes
+        '''
+        bandwidth, rtt = config.constants.PEER_DEFAULT_BANDWIDTH, config.constants.PEER_DEFAULT_RTT
+        if reported and reported.get("bandwidth"):
+            bandwidth, rtt = reported["bandwidth"], reported["rtt"]
+        estimate = self.peers.get(peer)
+        if estimate is not None:
+            bandwidth = estimate.bandwidth or bandwidth
+            rtt = estimate.rtt if estimate.rtt is not None else rtt
+        return rtt + nbytes / bandwidth
+
+    def rank(self, owners: list, nbytes: int) -> list:
+        '''
+        :param owners: (owner, send frequency) search results of the tracker
+        :return: the owners, the fastest first (the ones which sent more first, if they are as fast)
+        '''
+        return sorted(owners, key=lambda o: (self.expected_time(o[0]['node_id'], nbytes, reported=o[0]), -o[1]))
+
+    def is_slow(self, peer: int, peers, nbytes: int) -> bool:
+        '''
+        :return: whether the peer takes SLOW_PEER_FACTOR times longer than the fastest of the other peers
+        '''
+        if self.peers.get(peer) is None:
+            return False
+        others = [self.expected_time(other, nbytes) for other in peers if other != peer and other in self.peers]
+        return bool(others) and self.expected_time(peer, nbytes) > config.constants.SLOW_PEER_FACTOR * min(others)
@@ -0,0 +1,187 @@
+"""
+Compression of the chunk pieces on the wire.
+
+A transfer negotiates its codec: the requester of a chunk puts the codecs it
+can decode in its request (a bitmask, see ``accepted_codecs()``), and the
+owner picks the first of CODEC_PREFERENCE which both of them have. zlib is
+always there; zstd and lz4 only if their package (``zstandard``, ``lz4``) is
+installed.
+
+Before a chunk is compressed, a sample of it is compressed with zlib at its
+fastest level: if that doesn't save COMPRESS_MIN_SAVING of the sample, the
+chunk is sent as it is (compressed archives, media...). The pieces are
+compressed ahead of the sender on a thread pool (the codecs release the GIL),
+at most COMPRESS_LOOKAHEAD pieces ahead: the sender only waits for its first
+window of pieces, and a later piece which is not compressed yet when it must
+be sent (the link is faster than the pool), or which doesn't get smaller, is
+sent as it is. Each piece tells the codec it is compressed with, so the receiver decompresses every piece on its own.
+
+Compressing only pays on links slower than the codec: a requester only
+offers its codecs to a peer it has measured slower than COMPRESS_MAX_BANDWIDTH.
+The bandwidth of a peer is measured on the bytes of the wire, compressed or
+not (see ``peer_stats.py``), so the first chunks asked to a peer are not
+compressed, and a link which turns fast stops being compressed.
+"""
+import asyncio
+import zlib
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+NONE, ZLIB, LZ4, ZSTD = 0, 1, 2, 3
+CODEC_PREFERENCE = (ZSTD, LZ4, ZLIB)
+CODEC_NAMES = {NONE: "none", ZLIB: "zlib", LZ4: "lz4", ZSTD: "zstd"}
+
+DECODE_ERRORS = (zlib.error, ValueError, RuntimeError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def available_codecs() -> list:
+    return [codec for codec in CODEC_PREFERENCE
+            if codec == ZLIB or (codec == ZSTD and zstandard is not None) or (codec == LZ4 and lz4_frame is not None)]
+
+
+def accepted_codecs(bandwidth: float = None) -> int:
+    '''
+    :param bandwidth: measured bandwidth of the peer (bytes/s), None if it is not known yet
+    :return: bitmask of the codecs this node decodes, 0 if compression is turned off or doesn't pay with that peer
+    '''
+    if not config.constants.COMPRESSION:
+        return 0
+    if bandwidth is None or bandwidth > config.constants.COMPRESS_MAX_BANDWIDTH:
+        return 0
+    mask = 0
+    for codec in available_codecs():
+        mask |= 1 << codec
+    return mask
+
+
+def choose_codec(accepted: int) -> int:
+    '''
+    :param accepted: bitmask of the codecs the requester decodes
+    :return: the codec to send the chunk with, NONE if there is none in common
+    '''
+    if not config.constants.COMPRESSION:
+        return NONE
+    for codec in available_codecs():
+        if accepted & (1 << codec):
+            return codec
+    return NONE
+
+
+def compress(codec: int, data) -> bytes:
+    level = config.constants.COMPRESS_LEVEL
+    if codec == ZLIB:
+        return zlib.compress(data, level)
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if codec == LZ4:
+        return lz4_frame.compress(data)
+    raise ValueError(f"unknown codec {codec}")
+
+
+def decompress(codec: int, data, max_size: int) -> bytes:
+    '''
+    :param max_size: size of the piece before it was compressed, it is never decompressed to more than that
+    :raises ValueError: if the data can't be decompressed
+    '''
+    try:
+        if codec == ZLIB:
+            decompressor = zlib.decompressobj()
+            piece = decompressor.decompress(data, max_size)
+            if decompressor.unconsumed_tail or not decompressor.eof:
+                raise ValueError("piece larger than its size")
+            return piece
+        if codec == ZSTD and zstandard is not None:
+            return zstandard.ZstdDecompressor().decompress(data, max_output_size=max_size)
+        if codec == LZ4 and lz4_frame is not None:
+            piece = lz4_frame.decompress(data)
+            if len(piece) > max_size:
+                raise ValueError("piece larger than its size")
+            return piece
+    except DECODE_ERRORS as e:
+        raise ValueError(f"corrupted {CODEC_NAMES[codec]} piece: {e}") from None
+    raise ValueError(f"unknown codec {codec}")
+
+
+def is_compressible(sample) -> bool:
+    if not len(sample):
+        return False
+    saving = 1 - len(zlib.compress(sample, 1)) / len(sample)
+    return saving >= config.constants.COMPRESS_MIN_SAVING
+
+
+class PieceCompressor:
+    """
+    Compresses the pieces of a chunk ahead of its sender, on a thread pool. At most
+    COMPRESS_LOOKAHEAD pieces beyond the one being sent are compressed in advance,
+    so the memory held does not grow with the chunk.
+
+    :param piece_at: idx -> the piece, as sent when it is not compressed
+    :param skip: idx -> whether the piece need not be compressed (it is cached compressed, see file_cache.py)
+    """
+    def __init__(self, codec: int, piece_at, pieces_count: int, pool, skip=None):
+        self.codec = codec
+        self.piece_at = piece_at
+        self.pieces_count = pieces_count
+        self.pool = pool
+        self.skip = skip
+        self.futures = {}       # idx -> compression of the piece, submitted but not sent yet
+        self.submitted = 0      # pieces before this one have been submitted (or skipped)
+        self.compressed_count = 0
+
+    def compress_piece(self, idx: int) -> bytes:
+        return compress(self.codec, self.piece_at(idx))
+
+    def submit_until(self, end: int):
+        # the workers take their piece themselves: a cancelled job must not hold a view of the file mapping
+        end = min(end, self.pieces_count)
+        for idx in range(self.submitted, end):
+            if self.skip is None or not self.skip(idx):
+                self.futures[idx] = self.pool.submit(self.compress_piece, idx)
+        self.submitted = max(self.submitted, end)
+
+    def piece(self, idx: int) -> tuple:
+        '''
+        :return: (piece, codec it is compressed with), it is never waited for
+        '''
+        self.submit_until(idx + 1 + config.constants.COMPRESS_LOOKAHEAD)
+        raw = self.piece_at(idx)
+        # a retransmission of the piece goes as it is (or from the cache of the hot pieces)
+        future = self.futures.pop(idx, None)
+        if future is not None and future.done() and not future.cancelled() and future.exception() is None:
+            compressed = future.result()
+            if len(compressed) < len(raw):
+                self.compressed_count += 1
+                return compressed, self.codec
+        elif future is not None:
+            future.cancel()
+        return raw, NONE
+
+    async def head_start(self, count: int):
+        '''
+        Waits for the first count pieces, which leave at once when the transfer starts
+        '''
+        self.submit_until(max(count, config.constants.COMPRESS_LOOKAHEAD))
+        first = [asyncio.wrap_future(future) for idx, future in self.futures.items() if idx < count]
+        if first:
+            await asyncio.wait(first)
+
+    async def close(self):
+        '''
+        Drops the pieces not compressed yet, and waits for those being compressed (they read the file mapping)
+        '''
+        futures = list(self.futures.values())
+        self.futures.clear()
+        for future in futures:
+            future.cancel()
+        running = [asyncio.wrap_future(future) for future in futures if not future.done()]
+        if running:
+            await asyncio.wait(running)
@@ -0,0 +1,189 @@
+"""
+Per-piece SHA-256 manifests of the files, used to verify downloaded pieces.
+
+The manifest of a file lists the digest of each of its pieces and the Merkle
+root of those digests. A seeder computes it once and caches it next to the
+file as ``<filename>.manifest``; downloaders fetch it like any other file and
+check every piece against it as soon as the piece lands.
+
+Hashing runs on a thread pool: hashlib releases the GIL while it hashes
+buffers larger than 2 KB, so pieces are hashed in parallel.
+"""
+import asyncio
+import hashlib
+import math
+import mmap
+import os
+import struct
+from collections import defaultdict
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+MANIFEST_SUFFIX = ".manifest"
+PIECES_PER_TASK = 64    # pieces hashed by one task of the pool while hashing a whole file
+
+
+def merkle_root(digests: list) -> bytes:
+    '''
+    Merkle root of a list of digests. An odd node at the end of a level is
+    promoted as it is, and inner nodes are prefixed so they can't be mistaken
+    for pieces.
+
+    :param digests: SHA-256 digests of the pieces
+    :return: 32-byte root
+    '''
+    if not digests:
+        return hashlib.sha256(b"").digest()
+    level = list(digests)
+    while len(level) > 1:
+        next_level = [hashlib.sha256(b"\x01" + level[i] + level[i + 1]).digest()
+                      for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            next_level.append(level[-1])
+        level = next_level
+    return level[0]
+
+
+class PieceManifest:
+    # magic, version, piece_size, file_size, pieces_count, merkle root
+    layout = struct.Struct("!4sBIQI32s")
+    MAGIC = b"VQBM"
+    VERSION = 1
+
+    def __init__(self, piece_size: int, file_size: int, digests: list):
+        self.piece_size = piece_size
+        self.file_size = file_size
+        self.digests = digests
+        self.root = merkle_root(digests)
+
+    @property
+    def pieces_count(self) -> int:
+        return len(self.digests)
+
+    def encode(self) -> bytes:
+        return self.layout.pack(self.MAGIC, self.VERSION, self.piece_size, self.file_size,
+                                len(self.digests), self.root) + b"".join(self.digests)
+
+    @classmethod
+    def decode(cls, data: bytes):
+        '''
+        :raises ValueError: if the data is not a manifest, or its digests don't match its root
+        '''
+        if len(data) < cls.layout.size:
+            raise ValueError("truncated manifest")
+        magic, version, piece_size, file_size, count, root = cls.layout.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("not a piece manifest")
+        if piece_size == 0:
+            raise ValueError("manifest of pieces of 0 bytes")
+        body = data[cls.layout.size:]
+        if len(body) != count * 32 or count != math.ceil(file_size / piece_size):
+            raise ValueError("truncated manifest")
+        manifest = cls(piece_size, file_size, [body[i: i + 32] for i in range(0, len(body), 32)])
+        if manifest.root != root:
+            raise ValueError("manifest digests don't match its merkle root")
+        return manifest
+
+    @classmethod
+    def load(cls, manifest_path: str):
+        with open(manifest_path, "rb") as f:
+            return cls.decode(f.read())
+
+
+def hash_file(file_path: str, piece_size: int, pool) -> PieceManifest:
+    file_size = os.stat(file_path).st_size
+    pieces_count = math.ceil(file_size / piece_size)
+    if pieces_count == 0:
+        return PieceManifest(piece_size, file_size, [])
+    with open(file_path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with mm:
+        def hash_pieces(first: int, last: int) -> list:
+            with memoryview(mm) as view:
+                return [hashlib.sha256(view[i * piece_size: (i + 1) * piece_size]).digest()
+                        for i in range(first, last)]
+        futures = [pool.submit(hash_pieces, first, min(first + PIECES_PER_TASK, pieces_count))
+                   for first in range(0, pieces_count, PIECES_PER_TASK)]
+        digests = [d for future in futures for d in future.result()]
+    return PieceManifest(piece_size, file_size, digests)
+
+
+def load_or_create_manifest(file_path: str, pool) -> PieceManifest:
+    '''
+    Returns the manifest cached next to the file, or computes (and caches) it
+    if there is none or the file has changed since.
+    '''
+    manifest_path = file_path + MANIFEST_SUFFIX
+    piece_size = config.constants.CHUNK_PIECES_SIZE
+    try:
+        if os.stat(manifest_path).st_mtime_ns >= os.stat(file_path).st_mtime_ns:
+            manifest = PieceManifest.load(manifest_path)
+            if manifest.piece_size == piece_size and manifest.file_size == os.stat(file_path).st_size:
+                return manifest
+    except (OSError, ValueError):
+        pass
+    manifest = hash_file(file_path, piece_size, pool)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(manifest.encode())
+    os.replace(temp_path, manifest_path)
+    return manifest
+
+
+class PieceVerifier:
+    """
+    Checks downloaded pieces against a manifest on a thread pool.
+
+    A piece is handed over with the function which writes it, and that function
+    is only called (on the pool too) if the piece is valid, so corrupted data
+    never reaches the file. Pieces which are already verified are skipped. At
+    most MAX_PENDING_HASHES pieces wait to be hashed at a time, so a slow pool
+    slows the download down instead of buffering it in memory.
+
+    The verifier is used from the event loop of the node: ``submit`` and
+    ``wait_pieces`` are coroutines.
+    """
+    def __init__(self, manifest: PieceManifest, pool):
+        self.manifest = manifest
+        self.pool = pool
+        self.verified = bytearray(manifest.pieces_count)
+        self.failed_count = 0
+        self._slots = asyncio.Semaphore(config.constants.MAX_PENDING_HASHES)
+        self._pending_pieces = defaultdict(set)     # index -> futures of the checks of that piece
+
+    async def submit(self, index: int, piece: bytes, on_valid):
+        if 0 <= index < self.manifest.pieces_count and self.verified[index]:
+            return
+        await self._slots.acquire()
+        future = asyncio.get_running_loop().run_in_executor(self.pool, self._verify, index, piece, on_valid)
+        self._pending_pieces[index].add(future)
+        future.add_done_callback(lambda f: self._on_verified(index, f))
+
+    async def wait_pieces(self, first: int, last: int) -> set:
+        '''
+        Waits for the submitted pieces in [first, last) to be checked
+
+        :return: indices of the pieces in [first, last) which are not verified (corrupted or missing)
+        '''
+        futures = [f for i in range(first, last) for f in self._pending_pieces.get(i, ())]
+        if futures:
+            await asyncio.wait(futures)
+        return {i for i in range(first, last) if not self.verified[i]}
+
+    def _verify(self, index: int, piece: bytes, on_valid) -> bool:
+        is_valid = (index < self.manifest.pieces_count
+                    and hashlib.sha256(piece).digest() == self.manifest.digests[index])
+        if is_valid:
+            on_valid()
+        return is_valid
+
+    def _on_verified(self, index: int, future):
+        self._slots.release()
+        if not future.cancelled() and future.exception() is None and future.result():
+            self.verified[index] = 1
+        else:
+            self.failed_count += 1
+        pending = self._pending_pieces[index]
+        pending.discard(future)
+        if not pending:
+            del self._pending_pieces[index]
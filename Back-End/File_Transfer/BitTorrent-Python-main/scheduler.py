@@ -0,0 +1,160 @@
+"""
+Dynamic assignment of the pieces of a file to the peers it is downloaded from.
+
+The pieces are grouped into small blocks kept in a shared queue. Every peer
+pulls its next block as soon as it finishes the previous one, so fast peers
+simply download more blocks than slow ones and the download goes at the
+aggregate bandwidth of the swarm. Once every block has been handed out
+(endgame), idle peers duplicate the blocks still outstanding, so the tail of
+the download does not wait for the slowest peer: as soon as a copy of a block
+completes, the downloads of its other copies are cancelled.
+
+The scheduler is used from the event loop of the node, by one task per peer.
+"""
+import asyncio
+from collections import defaultdict, deque
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+
+def piece_runs(pieces) -> list:
+    '''
+    Groups piece indices into blocks of consecutive pieces
+
+    :return: list of [first, last) blocks
+    '''
+    runs = []
+    for piece in sorted(pieces):
+        if runs and runs[-1][1] == piece:
+            runs[-1][1] = piece + 1
+        else:
+            runs.append([piece, piece + 1])
+    return [tuple(run) for run in runs]
+
+
+class PieceScheduler:
+    """
+    Blocks are [first, last) ranges of piece indices. A peer which failed a
+    block (it stopped sending or sent corrupted pieces) is not given that
+    block again as long as another peer can take it.
+    """
+    def __init__(self, pieces_count: int, block_pieces: int, peers: list, pieces=None):
+        '''
+        :param pieces: indices of the pieces to download, all of them if None
+        '''
+        runs = [(0, pieces_count)] if pieces is None else piece_runs(pieces)
+        self.pending = deque((first, min(first + block_pieces, last))
+                             for start, last in runs for first in range(start, last, block_pieces))
+        self.remaining = len(self.pending)  # blocks not completed yet
+        self.outstanding = {}               # block -> peers downloading it
+        self.copies = defaultdict(dict)     # block -> peer -> task downloading it, see attach()
+        self.completed = set()
+        self.avoid = defaultdict(set)       # block -> peers which failed it
+        self.failures = defaultdict(int)
+        self.active_peers = set(peers)
+        self.aborted = False
+        self.endgame_duplicates = 0
+        self._changed = asyncio.Event()
+
+    def done(self) -> bool:
+        return self.remaining == 0
+
+    async def next_block(self, peer):
+        '''
+        Waits until there is something for the peer to download
+
+        :return: the next block for the peer, or None if there is nothing left
+        '''
+        while not self.aborted and self.remaining:
+            block = self._pick_pending(peer)
+            if block is not None:
+                self.outstanding[block] = {peer}
+                return block
+            # endgame: every block has been handed out, so the idle peer duplicates one still outstanding
+            block = self._pick_outstanding(peer)
+            if block is not None:
+                self.outstanding[block].add(peer)
+                self.endgame_duplicates += 1
+                return block
+            self._changed.clear()
+            await self._changed.wait()
+        return None
+
+    def attach(self, block: tuple, peer, task: asyncio.Future):
+        '''
+        The task of the peer downloads the block, it is cancelled if another peer completes the block first
+        '''
+        self.copies[block][peer] = task
+
+    def detach(self, block: tuple, peer):
+        copies = self.copies.get(block)
+        if copies is not None:
+            copies.pop(peer, None)
+            if not copies:
+                del self.copies[block]
+
+    def complete(self, block: tuple):
+        self._complete(block)
+        self._changed.set()
+
+    def fail(self, block: tuple, peer, pieces: set = None):
+        '''
+        :param pieces: the pieces of the block which failed. If given, the other ones are
+                       complete and only the failed ones are queued again, else the whole block is.
+        '''
+        if block in self.completed:
+            return
+        peers = self.outstanding.get(block, set())
+        peers.discard(peer)
+        if pieces:
+            for run in piece_runs(pieces):
+                self.avoid[run] = self.avoid[block] | {peer}
+                self.failures[run] = self.failures[block] + 1
+                self.pending.appendleft(run)
+                self.remaining += 1
+                self.aborted |= self.failures[run] > config.constants.MAX_BLOCK_FAILURES
+            self._complete(block)
+        else:
+            self.avoid[block].add(peer)
+            self.failures[block] += 1
+            self.aborted |= self.failures[block] > config.constants.MAX_BLOCK_FAILURES
+            if not peers:
+                self.outstanding.pop(block, None)
+                self.pending.appendleft(block)
+        self._changed.set()
+
+    def leave(self, peer):
+        '''
+        The peer won't download anything more, its blocks are left to the others
+        '''
+        self.active_peers.discard(peer)
+        if not self.active_peers:
+            self.aborted |= bool(self.remaining)
+        self._changed.set()
+
+    def _complete(self, block: tuple):
+        if block in self.completed:
+            return
+        self.completed.add(block)
+        self.remaining -= 1
+        self.outstanding.pop(block, None)
+        # the endgame copies still downloading it are of no use anymore
+        for task in self.copies.pop(block, {}).values():
+            task.cancel()
+        if block in self.pending:
+            self.pending.remove(block)
+
+    def _pick_pending(self, peer):
+        for i, block in enumerate(self.pending):
+            # a block failed by this peer is left to the others, unless none of them can take it
+            if peer not in self.avoid[block] or not (self.active_peers - self.avoid[block]):
+                del self.pending[i]
+                return block
+        return None
+
+    def _pick_outstanding(self, peer):
+        if self.pending:
+            return None
+        candidates = [block for block, peers in self.outstanding.items()
+                      if peer not in peers and peer not in self.avoid[block]]
+        return min(candidates, key=lambda block: len(self.outstanding[block]), default=None)
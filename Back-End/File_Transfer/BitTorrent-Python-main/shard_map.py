@@ -0,0 +1,57 @@
+"""
+Assignment of the filenames to the shards of the tracker, by consistent hashing.
+
+The tracker can run as several processes (shards), each one owning a part of
+the files of the torrent. Every shard is placed at TRACKER_SHARD_VNODES points
+of a hash ring, and a filename belongs to the shard of the first point after
+its own hash. Adding or removing a shard only moves the files of the ring
+segments it takes or gives back.
+
+The first shard is also the registry: the nodes inform it only that they are
+still in the torrent, and it tells the other shards when a node has left.
+"""
+import bisect
+import hashlib
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+
+def ring_hash(key: str) -> int:
+    # the built-in hash() is salted per process, the shards and the nodes must agree
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class ShardMap:
+    """
+    :param shards: addresses of the tracker shards, the first one is the registry
+    """
+    def __init__(self, shards: list, vnodes: int = config.constants.TRACKER_SHARD_VNODES):
+        self.shards = [tuple(shard) for shard in shards]
+        points = sorted((ring_hash(f"{host}:{port}#{i}"), idx)
+                        for idx, (host, port) in enumerate(self.shards)
+                        for i in range(vnodes))
+        self.ring = [point for point, _ in points]
+        self.ring_shards = [idx for _, idx in points]
+
+    @classmethod
+    def from_config(cls):
+        return cls(shards=config.constants.TRACKER_SHARDS)
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    @property
+    def registry(self) -> tuple:
+        return self.shards[0]
+
+    def shard_index_of(self, filename: str) -> int:
+        if len(self.shards) == 1:
+            return 0
+        i = bisect.bisect(self.ring, ring_hash(filename)) % len(self.ring)
+        return self.ring_shards[i]
+
+    def shard_of(self, filename: str) -> tuple:
+        '''
+        :return: address of the shard which owns the file
+        '''
+        return self.shards[self.shard_index_of(filename)]
@@ -0,0 +1,223 @@
+"""
+An in-process swarm: a tracker and nodes on the loopback, driven by a script, to benchmark and regression-test transfers.
+
+``Swarm`` runs a tracker and its nodes on the running event loop, in this
+process, and talks to them through their own functions instead of their
+command line:
+- ``seed()`` writes a file in the directory of a node, which then serves it
+  (``set_send_mode()``), and waits until the tracker knows it owns the file,
+- ``download()`` makes a node download a file (``set_download_mode()``), as
+  typing "download" would, and checks it against the seeded one; the node
+  then serves it too if ``reseed`` is set,
+- ``run()`` plays a script of downloads, each one starting at its own time,
+  and reports the throughput, the percentiles of their completion times and
+  the bytes of overhead,
+- ``restart()`` stops a node as if its process died, and starts it again.
+
+Every node sends through an ``ImpairedLink`` (see ``netem.py``), which drops,
+duplicates, delays, reorders or throttles its datagrams as given by ``link``,
+and counts the bytes it puts on the wire. The nodes keep their files and the
+tracker its database in the current directory, so a swarm should be run in
+a scratch directory.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from configs import CFG, Config
+config = Config.from_json(CFG)
+from netem import ImpairedLink
+from node import Node
+from shard_map import ShardMap
+from tracker import Tracker
+from utils import generate_random_port, free_socket
+
+
+def percentile(values: list, q: float) -> float:
+    '''
+    :return: the q-th percentile (0 <= q <= 100) of the values, by nearest rank
+    '''
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * q / 100))]
+
+
+class Swarm:
+    """
+    :param nodes: number of nodes, the node ids are 1..nodes and they are referred to by their index in ``self.nodes``
+    :param link: parameters of the ImpairedLink every node sends through (loss, delay, rate...), a clean path if None
+    :param reseed: whether a node serves a file as soon as it has downloaded it
+    """
+    def __init__(self, nodes: int, link: dict = None, seed: int = 0, reseed: bool = True):
+        self.nodes_count = nodes
+        self.link = link or {}
+        self.seed_value = seed
+        self.reseed = reseed
+        self.nodes = []
+        self.links = []
+        self.tracker = None
+        self.shard_map = None
+        self.tracker_requests = 0   # requests the tracker handled
+        self.digests = {}           # filename -> sha256 of the seeded file
+        self.sizes = {}             # filename -> bytes of the seeded file
+        self._tracker_task = None
+
+    async def start(self):
+        self.shard_map = ShardMap([("localhost", generate_random_port())])
+        self.tracker = Tracker(shard_index=0, shard_map=self.shard_map)
+        handle_node_request = self.tracker.handle_node_request
+
+        def counted_handle_node_request(data: bytes, addr: tuple):
+            self.tracker_requests += 1
+            handle_node_request(data=data, addr=addr)
+
+        self.tracker.handle_node_request = counted_handle_node_request
+        self._tracker_task = asyncio.ensure_future(self.tracker.serve())
+
+        for i in range(self.nodes_count):
+            self.nodes.append(await self.start_node(i))
+            self.links.append(ImpairedLink(self.nodes[i].endpoint, seed=self.seed_value + i, **self.link))
+        for node in self.nodes:
+            if node.dht is not None:
+                await node.dht.bootstrap()
+                node.spawn(node.dht.maintain(config.constants.DHT_REPUBLISH_INTERVAL))
+
+    async def start_node(self, index: int) -> Node:
+        node = Node(node_id=index + 1, port=generate_random_port(), shard_map=self.shard_map)
+        await node.start()
+        node.enter_torrent()
+        node.spawn(node.inform_tracker_periodically(config.constants.NODE_TIME_INTERVAL))
+        return node
+
+    @staticmethod
+    def stop_node(node: Node):
+        for task in list(node.tasks):
+            task.cancel()
+        for sink in node.downloaded_files.values():
+            sink.close()
+        node.downloaded_files.clear()
+        node.file_cache.close()
+        node.endpoint.close()
+        node.hash_pool.shutdown(wait=False)
+        node.compress_pool.shutdown(wait=False)
+        node.index_pool.shutdown(wait=False)
+
+    async def restart(self, index: int, task: asyncio.Task = None) -> Node:
+        '''
+        Stops the node of index at once, as if its process died, and starts it again on another port
+        with the files it has. Its link keeps its statistics.
+
+        :param task: a download of the node (from download()), it is cancelled with it
+        '''
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self.stop_node(self.nodes[index])
+        node = await self.start_node(index)
+        old_link = self.links[index]
+        self.links[index] = ImpairedLink(node.endpoint, seed=self.seed_value + index, **self.link)
+        self.links[index].stats = old_link.stats
+        self.nodes[index] = node
+        if node.dht is not None:
+            await node.dht.bootstrap()
+            node.spawn(node.dht.maintain(config.constants.DHT_REPUBLISH_INTERVAL))
+        return node
+
+    async def close(self):
+        for node in self.nodes:
+            self.stop_node(node)
+        if self.tracker is not None:
+            tracker = self.tracker
+            self._tracker_task.cancel()
+            if hasattr(tracker, "snapshot_task"):
+                tracker.snapshot_task.cancel()
+            await asyncio.gather(self._tracker_task, return_exceptions=True)
+            asyncio.get_running_loop().remove_reader(tracker.tracker_socket.fileno())
+            tracker.db.close()
+            free_socket(tracker.tracker_socket)
+            self.tracker = None
+
+    def file_path(self, index: int, filename: str) -> str:
+        return f"{config.directory.node_files_dir}node{self.nodes[index].node_id}/{filename}"
+
+    async def seed(self, index: int, filename: str, data: bytes, timeout: float = 10.0):
+        '''
+        Makes the node of index serve a file of the given content
+
+        :raises TimeoutError: if the tracker doesn't learn that the node owns it within timeout seconds
+        '''
+        node = self.nodes[index]
+        with open(self.file_path(index, filename), "wb") as f:
+            f.write(data)
+        self.digests[filename] = hashlib.sha256(data).digest()
+        self.sizes[filename] = len(data)
+        if filename not in node.files:
+            node.files.append(filename)
+        await node.set_send_mode(filename)
+        if node.dht is not None:
+            return
+        # the tracker doesn't answer the announcement, it is looked for in its index and made again if it was lost
+        deadline = time.monotonic() + timeout
+        announced_at = time.monotonic()
+        while not any(node_id == node.node_id
+                      for node_id, _ in self.tracker.file_owners_list.owners_of(filename)):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"the tracker doesn't know that node{node.node_id} owns {filename}")
+            if time.monotonic() - announced_at > config.constants.INITIAL_RTO:
+                await node.set_send_mode(filename)
+                announced_at = time.monotonic()
+            await asyncio.sleep(0.01)
+
+    async def download(self, index: int, filename: str, at: float = 0.0) -> dict:
+        '''
+        :param at: seconds to wait before the download starts
+        :return: {"node", "filename", "seconds" (from its start to its end), "complete", "intact"}
+        '''
+        await asyncio.sleep(at)
+        node = self.nodes[index]
+        start_time = time.perf_counter()
+        await node.set_download_mode(filename)
+        seconds = time.perf_counter() - start_time
+        path = self.file_path(index, filename)
+        complete = os.path.isfile(path)
+        intact = False
+        if complete:
+            with open(path, "rb") as f:
+                intact = hashlib.sha256(f.read()).digest() == self.digests.get(filename)
+        if intact and self.reseed:
+            await node.set_send_mode(filename)
+        return {"node": node.node_id, "filename": filename, "seconds": seconds,
+                "complete": complete, "intact": intact}
+
+    def wire_stats(self) -> dict:
+        return {key: sum(link.stats[key] for link in self.links) for key in self.links[0].stats}
+
+    async def run(self, script: list) -> dict:
+        '''
+        :param script: (start time in seconds, index of the node, filename) of each download
+        :return: the results of the downloads and a summary of the run
+        '''
+        wire_before = self.wire_stats()
+        tracker_before = self.tracker_requests
+        start_time = time.perf_counter()
+        downloads = await asyncio.gather(*(self.download(index, filename, at) for at, index, filename in script))
+        seconds = time.perf_counter() - start_time
+        wire = {key: value - wire_before[key] for key, value in self.wire_stats().items()}
+
+        payload = sum(self.sizes[d["filename"]] for d in downloads if d["intact"])
+        times = [d["seconds"] for d in downloads if d["intact"]]
+        return {"downloads": downloads,
+                "seconds": seconds,
+                "intact": sum(d["intact"] for d in downloads),
+                "throughput": payload / seconds if seconds else 0.0,
+                "p50": percentile(times, 50),
+                "p90": percentile(times, 90),
+                "p99": percentile(times, 99),
+                "max": max(times, default=0.0),
+                "payload_bytes": payload,
+                "wire_bytes": wire["bytes"],
+                "overhead": wire["bytes"] / payload - 1 if payload else 0.0,
+                "datagrams": wire["sent"],
+                "dropped": wire["dropped"],
+                "tracker_requests": self.tracker_requests - tracker_before}
@@ -0,0 +1,68 @@
+import os
+import sys
+import tempfile
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chunk_store import ChunkStore, chunk_file
+
+DATA = os.urandom(300 * 1024)
+
+
+class ChunkStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.files_dir = self.directory.name
+        for filename in ("a.bin", "b.bin"):
+            self.write(filename, DATA)
+        self.store = ChunkStore(self.files_dir)
+        self.store.refresh(["a.bin", "b.bin"])
+        self.chunks = list(chunk_file(os.path.join(self.files_dir, "a.bin")).offsets())
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, filename: str, data: bytes):
+        path = os.path.join(self.files_dir, filename)
+        with open(path, "wb") as f:
+            f.write(data)
+        # the index tells the versions of a file by their mtime
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def test_every_file_holding_a_chunk_is_known(self):
+        self.assertGreater(len(self.chunks), 1)
+        for offset, digest, size in self.chunks:
+            self.assertEqual({location[0] for location in self.store.locations[digest]}, {"a.bin", "b.bin"})
+            self.assertEqual(self.store.read(digest), DATA[offset: offset + size])
+
+    def test_a_changed_file_doesnt_hide_the_other_copies(self):
+        self.write("a.bin", bytes(len(DATA)))
+        for offset, digest, size in self.chunks:
+            self.assertEqual(self.store.read(digest), DATA[offset: offset + size])
+            # only the stale location is forgotten
+            self.assertEqual([location[0] for location in self.store.locations[digest]], ["b.bin"])
+
+    def test_chunk_is_forgotten_when_no_file_holds_it(self):
+        self.write("a.bin", bytes(len(DATA)))
+        os.remove(os.path.join(self.files_dir, "b.bin"))
+        _, digest, _ = self.chunks[0]
+        self.assertIsNone(self.store.read(digest))
+        self.assertNotIn(digest, self.store)
+
+    def test_refresh_indexes_the_changed_files_again(self):
+        new = os.urandom(len(DATA))
+        self.write("a.bin", new)
+        self.store.refresh(["a.bin", "b.bin"])
+        new_chunks = list(chunk_file(os.path.join(self.files_dir, "a.bin")).offsets())
+        for offset, digest, size in new_chunks:
+            self.assertEqual(self.store.read(digest), new[offset: offset + size])
+        for _, digest, _ in self.chunks:
+            self.assertEqual([location[0] for location in self.store.locations[digest]], ["b.bin"])
+        os.remove(os.path.join(self.files_dir, "b.bin"))
+        self.store.refresh(["a.bin", "b.bin"])
+        self.assertEqual(len(self.store), len({digest for _, digest, _ in new_chunks}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import unittest
+from unittest import mock
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dht
+from dht import DHT
+from messages.message import Message
+from messages.dht_message import DHTMessage, FIND_NODE, FIND_VALUE
+
+PEER = ("127.0.0.1", 4001)
+
+
+class FakeEndpoint:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data, addr):
+        self.sent.append((Message.decode(data), addr))
+
+
+class DHTHandleTest(unittest.TestCase):
+    def setUp(self):
+        self.endpoint = FakeEndpoint()
+        self.dht = DHT(endpoint=self.endpoint, node_id=1, registry=("127.0.0.1", 12345))
+
+    def test_find_node_is_answered(self):
+        request = Message.decode(DHTMessage(node_id=2, kind=FIND_NODE, target=7).encode())
+        self.dht.handle(request, PEER)
+        (reply, addr), = self.endpoint.sent
+        self.assertEqual(addr, PEER)
+        self.assertEqual((reply["dht_kind"], reply["target"]), (FIND_NODE, 7))
+        self.assertEqual(reply["contacts"], [(2, PEER)])
+
+    def test_malformed_request_is_dropped(self):
+        with mock.patch.object(dht, "log") as log:
+            self.dht.handle({"node_id": 2, "dht_kind": FIND_VALUE}, PEER)
+        self.assertEqual(self.endpoint.sent, [])
+        log.assert_called_once()
+
+    def test_contacts_out_of_the_hosts_table_are_rejected(self):
+        data = bytearray(DHTMessage(node_id=2, kind=FIND_NODE, contacts=[(3, PEER)]).encode())
+        data[-1] = 5    # index of the host of the contact, there is a single one
+        with self.assertRaises(ValueError):
+            Message.decode(bytes(data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from download_sink import DownloadSink
+from piece_hashes import PieceManifest, PieceVerifier
+
+HASH_SIZE = 1024
+DATA = bytes(range(256)) * 8    # two hashed pieces
+
+
+@contextlib.contextmanager
+def without_positional_io():
+    '''
+    Runs as on a platform which has no os.pread and os.pwrite
+    '''
+    removed = {name: getattr(os, name) for name in ("pread", "pwrite") if hasattr(os, name)}
+    for name in removed:
+        delattr(os, name)
+    try:
+        yield
+    finally:
+        for name, function in removed.items():
+            setattr(os, name, function)
+
+
+class DownloadSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self.manifest = PieceManifest(HASH_SIZE, len(DATA), [hashlib.sha256(DATA[i: i + HASH_SIZE]).digest()
+                                                             for i in range(0, len(DATA), HASH_SIZE)])
+
+    def tearDown(self):
+        self.pool.shutdown()
+        self.directory.cleanup()
+
+    def test_parts_are_dropped_once_a_whole_copy_is_received(self):
+        async def download():
+            verifier = PieceVerifier(self.manifest, self.pool)
+            sink = DownloadSink(os.path.join(self.directory.name, "file"), len(DATA), verifier=verifier)
+            try:
+                # half of the first hashed piece from a peer with small pieces, then the whole file from another one
+                await sink.write_piece(rng=(0, len(DATA)), idx=0, piece=DATA[:256], piece_size=256)
+                self.assertIn(0, sink.partial)
+                await sink.write_piece(rng=(0, len(DATA)), idx=0, piece=DATA, piece_size=len(DATA))
+                self.assertEqual(await verifier.wait_pieces(0, 2), set())
+                self.assertEqual(sink.partial, {})
+            finally:
+                sink.close()
+        asyncio.run(download())
+
+    def test_parts_are_dropped_when_the_download_stops(self):
+        async def download():
+            sink = DownloadSink(os.path.join(self.directory.name, "file"), len(DATA),
+                                verifier=PieceVerifier(self.manifest, self.pool))
+            await sink.write_piece(rng=(0, len(DATA)), idx=1, piece=DATA[256:512], piece_size=256)
+            self.assertIn(0, sink.partial)
+            sink.close()
+            self.assertEqual(sink.partial, {})
+        asyncio.run(download())
+
+    def test_pieces_out_of_the_file_are_rejected(self):
+        async def download():
+            verifier = PieceVerifier(self.manifest, self.pool)
+            sink = DownloadSink(os.path.join(self.directory.name, "file"), len(DATA), verifier=verifier)
+            try:
+                for rng, idx in (((0, len(DATA)), 8), ((len(DATA), 2 * len(DATA)), 0), ((0, len(DATA)), -1)):
+                    with self.subTest(rng=rng, idx=idx), self.assertRaises(ValueError):
+                        await sink.write_piece(rng=rng, idx=idx, piece=DATA[:256], piece_size=256)
+                self.assertEqual(sink.partial, {})
+                self.assertEqual(await verifier.wait_pieces(0, 2), {0, 1})
+            finally:
+                sink.close()
+        asyncio.run(download())
+
+    def test_resume_without_positional_io(self):
+        async def download(path):
+            verifier = PieceVerifier(self.manifest, self.pool)
+            sink = DownloadSink(path, len(DATA), verifier=verifier)
+            try:
+                resumed = await sink.resume()
+                await sink.write_piece(rng=(0, len(DATA)), idx=0, piece=DATA[:HASH_SIZE], piece_size=HASH_SIZE)
+                await verifier.wait_pieces(0, 1)
+                return resumed
+            finally:
+                sink.close()
+        path = os.path.join(self.directory.name, "file")
+        # the sink seeks under its lock instead
+        with without_positional_io():
+            self.assertEqual(asyncio.run(download(path)), 0)
+            # the first piece is kept when the download is interrupted, and verified again
+            self.assertEqual(asyncio.run(download(path)), 1)
+        with open(path + ".part", "rb") as f:
+            self.assertEqual(f.read(HASH_SIZE), DATA[:HASH_SIZE])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import asyncio
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from endpoint import Endpoint
+from messages.node2node import Node2Node
+from utils import generate_random_port
+
+
+class EndpointTest(unittest.TestCase):
+    def test_replies_only_come_from_the_peer_asked(self):
+        async def exchange():
+            def answer(msg, addr):
+                # an intruder which guessed the id of the request answers first
+                lie = Node2Node(src_node_id=3, dest_node_id=1, filename=msg["filename"], size=666).in_reply_to(msg)
+                intruder.send(lie.encode(), ("localhost", asker.port))
+                reply = Node2Node(src_node_id=2, dest_node_id=1, filename=msg["filename"], size=42).in_reply_to(msg)
+                loop.call_later(0.05, owner.send, reply.encode(), addr)
+
+            loop = asyncio.get_running_loop()
+            asker = Endpoint(port=generate_random_port(), on_request=lambda msg, addr: None)
+            owner = Endpoint(port=generate_random_port(), on_request=answer)
+            intruder = Endpoint(port=generate_random_port(), on_request=lambda msg, addr: None)
+            try:
+                for endpoint in (asker, owner, intruder):
+                    await endpoint.open()
+                request = Node2Node(src_node_id=1, dest_node_id=2, filename="a.txt")
+                return await asker.request(msg=request, addr=("localhost", owner.port), retries=0, timeout=1)
+            finally:
+                for endpoint in (asker, owner, intruder):
+                    endpoint.close()
+        reply = asyncio.run(exchange())
+        self.assertIsNotNone(reply)
+        self.assertEqual((reply["src_node_id"], reply["size"]), (2, 42))
+
+
+if __name__ == '__main__':
+    unittest.main()
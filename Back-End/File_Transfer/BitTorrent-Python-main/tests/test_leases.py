@@ -0,0 +1,67 @@
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from leases import LeaseWheel
+
+# times are multiples of the tick, exact in binary floating point
+LEASE = 1.0
+TICK = 0.25
+
+
+class LeaseWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.wheel = LeaseWheel(lease=LEASE, tick=TICK, now=0.0)
+
+    def test_lease_expires_after_its_period(self):
+        self.wheel.renew("a", now=0.0)
+        self.assertEqual(self.wheel.expire(LEASE - TICK), [])
+        self.assertIn("a", self.wheel)
+        self.assertEqual(self.wheel.expire(LEASE), ["a"])
+        self.assertNotIn("a", self.wheel)
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_renewal_postpones_expiry(self):
+        self.wheel.renew("a", now=0.0)
+        self.wheel.renew("a", now=0.5)
+        self.assertEqual(self.wheel.expire(LEASE), [])
+        self.assertEqual(self.wheel.expire(0.5 + LEASE), ["a"])
+
+    def test_renewed_leases_live_across_rounds(self):
+        # the wheel turns many times, the lease is renewed before each expiry
+        renewed_at = 0.0
+        while renewed_at < 20 * LEASE:
+            self.wheel.renew("a", now=renewed_at)
+            self.assertEqual(self.wheel.expire(renewed_at), [])
+            renewed_at += LEASE / 2
+        renewed_at -= LEASE / 2
+        self.assertEqual(self.wheel.expire(renewed_at + LEASE - TICK), [])
+        self.assertEqual(self.wheel.expire(renewed_at + LEASE), ["a"])
+
+    def test_lease_due_more_than_one_revolution_ahead(self):
+        # the ticks are processed late: a lease renewed meanwhile is due several turns of the wheel later
+        self.wheel.renew("a", now=0.0)
+        self.wheel.renew("b", now=0.0)
+        self.assertEqual(self.wheel.expire(0.5), [])
+        self.wheel.renew("a", now=2.0)
+        self.assertGreater(self.wheel.due_tick["a"] - self.wheel.ticks, len(self.wheel.slots))
+        self.assertEqual(self.wheel.expire(2.0), ["b"])
+        # the slot of a comes round without a being due
+        self.assertEqual(self.wheel.expire(2.0 + LEASE - TICK), [])
+        self.assertEqual(self.wheel.expire(2.0 + LEASE), ["a"])
+
+    def test_removed_lease_never_expires(self):
+        self.wheel.renew("a", now=0.0)
+        self.wheel.remove("a")
+        self.wheel.remove("a")
+        self.assertEqual(self.wheel.expire(10 * LEASE), [])
+
+    def test_leases_expire_together_when_processed_late(self):
+        for i in range(10):
+            self.wheel.renew(i, now=i * TICK)
+        self.assertEqual(sorted(self.wheel.expire(100.0)), list(range(10)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from messages.message import Message, WIRE_VERSION, header_layout
+from messages.node2tracker import Node2Tracker, ORDER_SPEED
+from messages.node2node import Node2Node
+from messages.chunk_sharing import ChunkSharing
+from messages.tracker2node import Tracker2Node
+from messages.chunk_ack import ChunkAck
+from messages.tracker2tracker import Tracker2Tracker
+from messages.path_probe import PathProbe
+from messages.peer_report import PeerReport
+from messages.dht_message import DHTMessage, FIND_VALUE
+
+
+def samples() -> list:
+    '''
+    :return: (message, fields its decoding must have) of every message type
+    '''
+    owner = {'node_id': 7, 'addr': ("127.0.0.1", 4000), 'bandwidth': 1000, 'rtt': 0.25}
+    return [
+        (Node2Tracker(node_id=1, mode=2, filename="a.txt", order=ORDER_SPEED, limit=10, cursor=3),
+         {"node_id": 1, "mode": 2, "filename": "a.txt", "order": ORDER_SPEED, "limit": 10, "cursor": 3}),
+        (Node2Node(src_node_id=1, dest_node_id=2, filename="a.txt", size=1234),
+         {"src_node_id": 1, "dest_node_id": 2, "filename": "a.txt", "size": 1234}),
+        (ChunkSharing(src_node_id=1, dest_node_id=2, filename="a.txt", range=(0, 4096), idx=3,
+                      chunk=b"piece", piece_size=1024, codec=1),
+         {"src_node_id": 1, "dest_node_id": 2, "filename": "a.txt", "range": (0, 4096), "idx": 3,
+          "piece_size": 1024, "codec": 1, "chunk": b"piece"}),
+        (Tracker2Node(dest_node_id=2, search_result=[(owner, 5)], filename="a.txt", total=9, next_cursor=1),
+         {"dest_node_id": 2, "search_result": [(owner, 5)], "filename": "a.txt", "total": 9, "next_cursor": 1}),
+        (ChunkAck(src_node_id=1, dest_node_id=2, filename="a.txt", range=(0, 4096), cum_ack=2, sacks=[(4, 6)]),
+         {"src_node_id": 1, "dest_node_id": 2, "filename": "a.txt", "range": (0, 4096), "cum_ack": 2,
+          "sacks": [(4, 6)]}),
+        (Tracker2Tracker(node_id=1, mode=3, addr=("127.0.0.1", 4000)),
+         {"node_id": 1, "mode": 3, "addr": ("127.0.0.1", 4000)}),
+        (PathProbe(src_node_id=1, dest_node_id=2, probe_size=1400),
+         {"src_node_id": 1, "dest_node_id": 2, "probe_size": 1400, "received_size": 1400}),
+        (PeerReport(node_id=1, peer_id=2, bandwidth=5e6, rtt=0.01),
+         {"node_id": 1, "peer_id": 2, "bandwidth": 5000000, "rtt": 0.01}),
+        (DHTMessage(node_id=1, kind=FIND_VALUE, target=2 ** 40, filename="a.txt",
+                    contacts=[(3, ("127.0.0.1", 4000))], owners=[(4, ("10.0.0.1", 4001))]),
+         {"node_id": 1, "dht_kind": FIND_VALUE, "target": 2 ** 40, "filename": "a.txt",
+          "contacts": [(3, ("127.0.0.1", 4000))], "owners": [(4, ("10.0.0.1", 4001))]}),
+    ]
+
+
+class MessageTest(unittest.TestCase):
+    def test_every_message_type_is_covered(self):
+        self.assertEqual({type(msg).msg_type for msg, _ in samples()}, set(Message._registry))
+
+    def test_round_trip(self):
+        for msg, fields in samples():
+            with self.subTest(type(msg).__name__):
+                request = {"req_id": 42}
+                decoded = Message.decode(msg.in_reply_to(request).encode())
+                self.assertEqual(decoded["req_id"], 42)
+                self.assertTrue(decoded["is_reply"])
+                for name, value in fields.items():
+                    actual = decoded[name]
+                    self.assertEqual(bytes(actual) if isinstance(actual, memoryview) else actual, value, name)
+
+    def test_encode_parts_form_the_datagram(self):
+        for msg, _ in samples():
+            with self.subTest(type(msg).__name__):
+                self.assertEqual(b"".join(msg.encode_parts()), msg.encode())
+
+    def test_other_wire_version_is_rejected(self):
+        for msg, _ in samples():
+            data = bytearray(msg.encode())
+            data[0] = (WIRE_VERSION + 1) % 256
+            with self.subTest(type(msg).__name__), self.assertRaisesRegex(ValueError, "wire version"):
+                Message.decode(bytes(data))
+
+    def test_truncated_header_is_rejected(self):
+        data = Node2Node(src_node_id=1, dest_node_id=2, filename="a.txt").encode()
+        for size in range(header_layout.size):
+            with self.subTest(size=size), self.assertRaises(ValueError):
+                Message.decode(data[:size])
+
+    def test_truncated_fields_are_rejected(self):
+        for msg, _ in samples():
+            data = msg.encode()
+            with self.subTest(type(msg).__name__), self.assertRaises(ValueError):
+                Message.decode(data[:type(msg).layout.size - 1])
+
+    def test_unknown_type_is_rejected(self):
+        unknown = max(Message._registry) + 1
+        with self.assertRaisesRegex(ValueError, "unknown message type"):
+            Message.decode(header_layout.pack(WIRE_VERSION, unknown, False, 1) + bytes(32))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from piece_hashes import PieceManifest
+
+
+class PieceManifestTest(unittest.TestCase):
+    def test_decode_round_trip(self):
+        manifest = PieceManifest(piece_size=4, file_size=10, digests=[bytes([i]) * 32 for i in range(3)])
+        decoded = PieceManifest.decode(manifest.encode())
+        self.assertEqual((decoded.piece_size, decoded.file_size, decoded.digests),
+                         (manifest.piece_size, manifest.file_size, manifest.digests))
+
+    def test_pieces_of_0_bytes_are_rejected(self):
+        data = PieceManifest(piece_size=0, file_size=10, digests=[]).encode()
+        with self.assertRaises(ValueError):
+            PieceManifest.decode(data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shard_map import ShardMap
+
+SHARDS = [("127.0.0.1", 12345 + i) for i in range(4)]
+FILENAMES = [f"file{i}.txt" for i in range(20000)]
+
+
+def placement(shard_map: ShardMap) -> dict:
+    return {filename: shard_map.shard_of(filename) for filename in FILENAMES}
+
+
+class ShardMapTest(unittest.TestCase):
+    def test_single_shard_owns_everything(self):
+        shard_map = ShardMap(SHARDS[:1])
+        self.assertEqual(set(placement(shard_map).values()), {SHARDS[0]})
+        self.assertEqual(shard_map.registry, SHARDS[0])
+
+    def test_placement_is_the_same_everywhere(self):
+        # the nodes and every shard build their own map, they must agree
+        self.assertEqual(placement(ShardMap(SHARDS)), placement(ShardMap([list(shard) for shard in SHARDS])))
+
+    def test_files_are_spread_over_the_shards(self):
+        counts = {shard: 0 for shard in SHARDS}
+        for shard in placement(ShardMap(SHARDS)).values():
+            counts[shard] += 1
+        for count in counts.values():
+            self.assertGreater(count, len(FILENAMES) / len(SHARDS) / 2)
+
+    def test_adding_a_shard_only_moves_files_to_it(self):
+        before = placement(ShardMap(SHARDS[:3]))
+        after = placement(ShardMap(SHARDS))
+        moved = [filename for filename in FILENAMES if before[filename] != after[filename]]
+        self.assertTrue(all(after[filename] == SHARDS[3] for filename in moved))
+        # about a quarter of the files, not a reshuffle of all of them
+        self.assertLess(len(moved), len(FILENAMES) / 2)
+        self.assertGreater(len(moved), len(FILENAMES) / 8)
+
+    def test_removing_a_shard_only_moves_its_files(self):
+        before = placement(ShardMap(SHARDS))
+        after = placement(ShardMap(SHARDS[:2] + SHARDS[3:]))
+        for filename in FILENAMES:
+            if before[filename] != SHARDS[2]:
+                self.assertEqual(after[filename], before[filename])
+            else:
+                self.assertNotEqual(after[filename], SHARDS[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracker_db import TrackerDB, OWN, UPDATE, REMOVE, NODE
+
+
+def reload(db_dir: str):
+    '''
+    :return: (the database as the tracker opens it when it starts, the records it replays)
+    '''
+    db = TrackerDB(db_dir)
+    records = []
+    db.load(records.append)
+    return db, records
+
+
+class TrackerDBTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_dir = self.directory.name
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_log_is_replayed_in_order(self):
+        db, records = reload(self.db_dir)
+        self.assertEqual(records, [])
+        written = [[OWN, 1, "127.0.0.1", 4000, "a.txt"], [UPDATE, 1], [REMOVE, 1, "127.0.0.1", 4000]]
+        for record in written:
+            db.append(record)
+        db.flush()
+        db.close()
+        db, records = reload(self.db_dir)
+        db.close()
+        self.assertEqual(records, written)
+
+    def test_records_not_flushed_are_lost(self):
+        db, _ = reload(self.db_dir)
+        db.append([UPDATE, 1])
+        db.flush()
+        db.append([UPDATE, 2])
+        db.log_file.close()     # the tracker dies before its next flush
+        db, records = reload(self.db_dir)
+        db.close()
+        self.assertEqual(records, [[UPDATE, 1]])
+
+    def test_torn_last_record_is_dropped(self):
+        db, _ = reload(self.db_dir)
+        db.append([OWN, 1, "127.0.0.1", 4000, "a.txt"])
+        db.append([UPDATE, 1])
+        db.flush()
+        # the tracker stopped in the middle of a record
+        db.log_file.write('["own",2,"127.0.0.1",40')
+        db.log_file.close()
+        generation = db.generation
+        db, records = reload(self.db_dir)
+        self.assertEqual(records, [[OWN, 1, "127.0.0.1", 4000, "a.txt"], [UPDATE, 1]])
+        # nothing is ever appended after the torn record
+        self.assertEqual(db.generation, generation + 1)
+        db.append([UPDATE, 3])
+        db.close()
+        db, records = reload(self.db_dir)
+        db.close()
+        self.assertEqual(records, [[OWN, 1, "127.0.0.1", 4000, "a.txt"], [UPDATE, 1], [UPDATE, 3]])
+
+    def test_snapshot_then_log(self):
+        db, _ = reload(self.db_dir)
+        db.append([OWN, 1, "127.0.0.1", 4000, "a.txt"])
+        db.append([UPDATE, 1])
+        db.flush()
+        snapshot = [[NODE, 1, 1], [OWN, 1, "127.0.0.1", 4000, "a.txt"]]
+        asyncio.run(db.snapshot(snapshot))
+        db.append([OWN, 2, "127.0.0.1", 4001, "a.txt"])
+        db.close()
+        db, records = reload(self.db_dir)
+        db.close()
+        self.assertEqual(records, snapshot + [[OWN, 2, "127.0.0.1", 4001, "a.txt"]])
+
+    def test_snapshot_compacts_the_logs(self):
+        db, _ = reload(self.db_dir)
+        for node_id in range(100):
+            db.append([UPDATE, node_id])
+        db.flush()
+        asyncio.run(db.snapshot([[NODE, node_id, 1] for node_id in range(100)]))
+        self.assertEqual(db.unsnapshotted, 0)
+        # only the log started with the snapshot is left
+        self.assertEqual(db.log_generations(), [db.generation])
+        db.close()
+        db, records = reload(self.db_dir)
+        db.close()
+        self.assertEqual(records, [[NODE, node_id, 1] for node_id in range(100)])
+        self.assertEqual(db.unsnapshotted, 0)
+
+    def test_logs_covered_by_the_snapshot_are_not_replayed(self):
+        db, _ = reload(self.db_dir)
+        db.append([UPDATE, 1])
+        db.close()
+        covered = db.log_path(db.generation)
+        with open(covered) as f:
+            log = f.read()
+        db, _ = reload(self.db_dir)
+        asyncio.run(db.snapshot([[NODE, 1, 1]]))
+        db.close()
+        # the tracker died after the snapshot was written, before the logs it covers were deleted
+        with open(covered, "w") as f:
+            f.write(log)
+        db, records = reload(self.db_dir)
+        db.close()
+        self.assertEqual(records, [[NODE, 1, 1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+import asyncio
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from transport import CANCEL_ACK, RTOEstimator, ReceiveWindow, ReliableReceiver, ReliableSender, SendWindow
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+
+def send_all(window: SendWindow, now: float, step: float = 0.01) -> list:
+    '''
+    :return: the pieces the window lets out, the n-th one sent at now + n * step
+    '''
+    sent = []
+    while window.can_send():
+        sent.append(window.next_to_send(now + len(sent) * step))
+    return sent
+
+
+class ReceiveWindowTest(unittest.TestCase):
+    def test_cum_ack_and_sack_blocks(self):
+        window = ReceiveWindow(10)
+        for idx in (0, 1, 3, 4, 7):
+            self.assertTrue(window.on_piece(idx))
+        self.assertEqual(window.cum_ack, 2)
+        self.assertEqual(window.sack_blocks(), [(3, 5), (7, 8)])
+        # the hole is filled: the cumulative ack jumps over the pieces received out of order
+        window.on_piece(2)
+        self.assertEqual(window.cum_ack, 5)
+        self.assertEqual(window.sack_blocks(), [(7, 8)])
+
+    def test_duplicates_and_pieces_out_of_the_chunk_are_ignored(self):
+        window = ReceiveWindow(3)
+        self.assertTrue(window.on_piece(1))
+        for idx in (1, -1, 3):
+            self.assertFalse(window.on_piece(idx))
+        self.assertEqual(window.received_count, 1)
+        for idx in (0, 2):
+            window.on_piece(idx)
+        self.assertTrue(window.complete())
+        self.assertEqual(window.cum_ack, 3)
+
+    def test_sack_blocks_are_bounded(self):
+        window = ReceiveWindow(200)
+        for idx in range(1, 200, 2):
+            window.on_piece(idx)
+        self.assertEqual(len(window.sack_blocks()), config.constants.MAX_SACK_BLOCKS)
+
+
+class RTOEstimatorTest(unittest.TestCase):
+    def test_first_sample(self):
+        rtt = RTOEstimator()
+        self.assertEqual(rtt.rto, config.constants.INITIAL_RTO)
+        rtt.sample(0.1)
+        self.assertAlmostEqual(rtt.rto, max(0.1 + 4 * 0.05, config.constants.MIN_RTO))
+
+    def test_backoff_doubles_up_to_max_rto(self):
+        rtt = RTOEstimator()
+        rtt.backoff()
+        self.assertEqual(rtt.rto, 2 * config.constants.INITIAL_RTO)
+        for _ in range(10):
+            rtt.backoff()
+        self.assertEqual(rtt.rto, config.constants.MAX_RTO)
+        # a new sample ends the backoff
+        rtt.sample(0.1)
+        self.assertLess(rtt.rto, config.constants.MAX_RTO)
+
+
+class SendWindowTest(unittest.TestCase):
+    def test_slow_start(self):
+        window = SendWindow(100)
+        sent = send_all(window, now=1.0)
+        self.assertEqual(sent, list(range(config.constants.INITIAL_CWND)))
+        window.on_ack(cum_ack=4, sacks=[], now=1.2)
+        self.assertEqual(window.cwnd, config.constants.INITIAL_CWND + 4)
+        self.assertEqual(window.cum_ack, 4)
+        self.assertEqual(list(window.in_flight), list(range(4, config.constants.INITIAL_CWND)))
+
+    def test_congestion_avoidance_grows_by_one_piece_per_window(self):
+        window = SendWindow(100)
+        window.ssthresh = window.cwnd = 10.0
+        send_all(window, now=1.0)
+        window.on_ack(cum_ack=10, sacks=[], now=1.2)
+        self.assertAlmostEqual(window.cwnd, 11.0, delta=0.1)
+
+    def test_sacked_pieces_are_not_sent_again(self):
+        window = SendWindow(6)
+        send_all(window, now=1.0, step=0.0)
+        window.on_ack(cum_ack=1, sacks=[(2, 4), (5, 6)], now=1.1)
+        self.assertEqual(window.acked_count, 4)
+        self.assertEqual(window.cum_ack, 1)
+        window.on_ack(cum_ack=6, sacks=[], now=1.2)
+        self.assertTrue(window.done())
+        self.assertFalse(window.can_send())
+
+    def test_reordering_loss_is_retransmitted_and_halves_the_window_once(self):
+        window = SendWindow(100)
+        sent = send_all(window, now=1.0)
+        # pieces sent well after piece 0 and 1 are acked: both are lost
+        window.on_ack(cum_ack=0, sacks=[(2, len(sent))], now=1.3)
+        cwnd = config.constants.INITIAL_CWND + len(sent) - 2
+        self.assertEqual(list(window.lost), [0, 1])
+        self.assertEqual(window.cwnd, cwnd / 2)
+        self.assertEqual(window.ssthresh, cwnd / 2)
+        self.assertEqual(window.next_to_send(1.31), 0)
+        self.assertEqual(window.next_to_send(1.32), 1)
+        self.assertEqual(window.retransmissions_count, 2)
+        # later losses of the same window don't cut it again
+        window.on_ack(cum_ack=0, sacks=[(2, len(sent))], now=1.4)
+        self.assertEqual(window.cwnd, cwnd / 2)
+
+    def test_timeout_collapses_the_window_and_backs_off(self):
+        window = SendWindow(100)
+        send_all(window, now=1.0, step=0.0)
+        rto = window.rtt.rto
+        window.on_timeout(1.0 + rto / 2)
+        self.assertFalse(window.lost)
+        window.on_timeout(1.0 + rto)
+        self.assertEqual(list(window.lost), list(range(config.constants.INITIAL_CWND)))
+        self.assertEqual(window.cwnd, config.constants.MIN_CWND)
+        self.assertEqual(window.rtt.rto, min(2 * rto, config.constants.MAX_RTO))
+
+    def test_acks_of_retransmissions_give_no_rtt_sample(self):
+        window = SendWindow(1)
+        window.next_to_send(1.0)
+        window.on_timeout(1.0 + window.rtt.rto)
+        self.assertEqual(window.next_to_send(2.0), 0)
+        window.on_ack(cum_ack=1, sacks=[], now=2.01)
+        self.assertIsNone(window.rtt.srtt)
+        self.assertTrue(window.done())
+
+
+class Link:
+    """
+    One way of an in-memory link: it drops the first copy of the given pieces, and delays others
+    """
+    def __init__(self, inbox: asyncio.Queue, drop=(), delay=()):
+        self.inbox = inbox
+        self.drop = set(drop)
+        self.delay = set(delay)
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+        idx = msg.get("idx")
+        if idx in self.drop:
+            self.drop.discard(idx)
+        elif idx in self.delay:
+            self.delay.discard(idx)
+            asyncio.get_running_loop().call_later(0.02, self.inbox.put_nowait, msg)
+        else:
+            self.inbox.put_nowait(msg)
+
+
+class ReliableTransferTest(unittest.TestCase):
+    def transfer(self, pieces_count: int, drop=(), delay=()):
+        async def run():
+            sender_inbox, receiver_inbox = asyncio.Queue(), asyncio.Queue()
+            to_receiver = Link(receiver_inbox, drop=drop, delay=delay)
+            to_sender = Link(sender_inbox)
+            received = []
+
+            async def on_piece(msg):
+                received.append(msg["idx"])
+
+            sender = ReliableSender(send=to_receiver.send, inbox=sender_inbox, pieces_count=pieces_count,
+                                    make_piece=lambda idx: {"idx": idx, "chunk": b"x"},
+                                    make_fin=lambda: {"idx": -1, "chunk": None})
+            receiver = ReliableReceiver(send=to_sender.send, inbox=receiver_inbox, pieces_count=pieces_count,
+                                        on_piece=on_piece,
+                                        make_ack=lambda cum_ack, sacks: {"cum_ack": cum_ack, "sacks": sacks})
+
+            async def receive():
+                is_received = await receiver.run(request={"request": True})
+                await receiver.linger()
+                return is_received
+            results = await asyncio.wait_for(asyncio.gather(sender.run(), receive()), 10)
+            return results, received, sender.window
+        return asyncio.run(run())
+
+    def test_lossless(self):
+        (is_sent, is_received), received, window = self.transfer(50)
+        self.assertTrue(is_sent and is_received)
+        self.assertEqual(received, list(range(50)))
+        self.assertEqual(window.retransmissions_count, 0)
+
+    def test_loss_and_reordering(self):
+        (is_sent, is_received), received, window = self.transfer(50, drop=(3, 20, 49), delay=(10, 11))
+        self.assertTrue(is_sent and is_received)
+        self.assertEqual(sorted(received), list(range(50)))
+        self.assertGreaterEqual(window.retransmissions_count, 3)
+
+    def test_cancelled_sender_stops(self):
+        async def run():
+            inbox = asyncio.Queue()
+            sent = []
+            inbox.put_nowait({"cum_ack": CANCEL_ACK, "sacks": []})
+            sender = ReliableSender(send=sent.append, inbox=inbox, pieces_count=100,
+                                    make_piece=lambda idx: {"idx": idx}, make_fin=lambda: {"idx": -1})
+            return await sender.run(), sender, sent
+        is_sent, sender, sent = asyncio.run(run())
+        self.assertFalse(is_sent)
+        self.assertTrue(sender.cancelled)
+        # no terminator: the receiver is gone
+        self.assertNotIn({"idx": -1}, sent)
+        self.assertLessEqual(len(sent), config.constants.INITIAL_CWND)
+
+    def test_receiver_cancel_sends_cancel_ack(self):
+        sent = []
+        receiver = ReliableReceiver(send=sent.append, inbox=asyncio.Queue(), pieces_count=1, on_piece=None,
+                                    make_ack=lambda cum_ack, sacks: (cum_ack, sacks))
+        receiver.cancel()
+        self.assertEqual(sent, [(CANCEL_ACK, [])])
+
+    def test_linger_acks_retransmissions_until_the_terminator(self):
+        async def run():
+            inbox = asyncio.Queue()
+            sent = []
+            receiver = ReliableReceiver(send=sent.append, inbox=inbox, pieces_count=1, on_piece=None,
+                                        make_ack=lambda cum_ack, sacks: (cum_ack, sacks))
+            receiver.window.on_piece(0)
+            for msg in ({"idx": 0, "chunk": b"x"}, {"idx": 0, "chunk": b"x"}, {"idx": -1, "chunk": None}):
+                inbox.put_nowait(msg)
+            await asyncio.wait_for(receiver.linger(), 1)
+            return sent
+        self.assertEqual(asyncio.run(run()), [(1, []), (1, [])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import sys
+import unittest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upload_queue import UploadQueue
+
+QUANTUM = 64 * 1024
+PER_REQUESTER = 4
+
+
+class UploadQueueTest(unittest.TestCase):
+    def test_requester_at_its_cap_doesnt_hold_back_the_others(self):
+        uploads = UploadQueue(quantum=QUANTUM, per_requester=PER_REQUESTER)
+        for i in range(PER_REQUESTER + 2):
+            uploads.push("A", cost=1024 * 1024, item=f"A{i}")
+        for i in range(PER_REQUESTER):
+            self.assertEqual(uploads.pop()[0], "A")
+        uploads.push("B", cost=64 * 1024, item="B0")
+        # A is at its cap, B only needs credit: it is served at once
+        self.assertEqual(uploads.pop(), ("B", "B0"))
+        self.assertIsNone(uploads.pop())
+
+    def test_every_requester_at_its_cap(self):
+        uploads = UploadQueue(quantum=QUANTUM, per_requester=1)
+        for requester in "AB":
+            uploads.push(requester, cost=1, item=requester + "0")
+            uploads.push(requester, cost=1, item=requester + "1")
+        self.assertEqual({uploads.pop()[0], uploads.pop()[0]}, {"A", "B"})
+        self.assertIsNone(uploads.pop())
+        uploads.done("A")
+        self.assertEqual(uploads.pop(), ("A", "A1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,11 @@
 # built-in libraries
-from threading import Thread, Timer
+import argparse
+import asyncio
+import heapq
+import itertools
+import multiprocessing
+import random
 from collections import defaultdict
-import json
-import datetime
 import time
 import warnings
 warnings.filterwarnings("ignore")
@@ -10,19 +13,80 @@ warnings.filterwarnings("ignore")
 # implemented classes
 from utils import *
 from messages.message import  Message
+from messages.node2tracker import Node2Tracker, ORDER_SEND_FREQ, ORDER_SPEED
 from messages.tracker2node import Tracker2Node
+from messages.tracker2tracker import Tracker2Tracker
+from messages.peer_report import PeerReport
 from segment import UDPSegment
+from tracker_index import OwnershipIndex
+from tracker_db import TrackerDB, OWN, UPDATE, REMOVE, NODE
+from leases import LeaseWheel
+from shard_map import ShardMap
+from metrics import Metrics
+from endpoint import Endpoint
 from configs import CFG, Config
 config = Config.from_json(CFG)
-
-next_call = time.time()
+# names of the requests in the metrics
+MODE_NAMES = {mode: name.lower() for name, mode in vars(config.tracker_requests_mode).items()}
 
 class Tracker:
-    def __init__(self):
-        self.tracker_socket = set_socket(config.constants.TRACKER_ADDR[1])
-        self.file_owners_list = defaultdict(list)
+    """
+    The tracker runs on an asyncio event loop. Whenever its socket is readable,
+    it handles up to TRACKER_RECV_BATCH waiting datagrams one after another and
+    then writes their changes of the database to its log (see tracker_db.py)
+    once for all of them, so its state is only ever changed by one request at
+    a time. The socket receive buffer is its only queue: if the tracker falls
+    behind, the kernel drops the excess datagrams, and the nodes send their
+    requests again.
+
+    A tracker is one shard of the torrent (see shard_map.py) and only knows the
+    owners of its own files. The nodes renew their leases with the registry,
+    the first shard, only: when a node leaves, the registry tells the other
+    shards, which acknowledge it. Every shard also keeps a lease of the owners
+    of its files, renewed when they announce one; when it expires, the shard
+    asks the registry whether the node is still in the torrent, so an owner
+    is dropped even if the message of the registry was lost or the shard was
+    down when the node left. The shards talk to each other through an
+    Endpoint (see endpoint.py) of their own, which resends the requests until
+    they are answered.
+
+    With a metrics_port, the tracker serves its metrics (see metrics.py) on it.
+    """
+    def __init__(self, shard_index: int = 0, shard_map: ShardMap = None, metrics_port: int = None):
+        self.shard_map = shard_map or ShardMap.from_config()
+        self.shard_index = shard_index
+        self.is_registry = shard_index == 0
+        self.tracker_socket = set_socket(self.shard_map.shards[shard_index][1])
+        self.file_owners_list = OwnershipIndex()
         self.send_freq_list = defaultdict(int)
-        self.has_informed_tracker = defaultdict(bool)
+        # node_id -> [bandwidth, rtt] reported by the nodes which downloaded from it (see peer_stats.py),
+        # they are measurements of the moment so they are not kept in the database
+        self.peer_reports = {}
+        # a node leaves the torrent if it doesn't inform the tracker for one lease period
+        self.node_leases = LeaseWheel(lease=config.constants.TRACKER_TIME_INTERVAL,
+                                      tick=config.constants.TRACKER_LEASE_TICK,
+                                      now=time.monotonic())
+        db_dir = config.directory.tracker_db_dir
+        if len(self.shard_map) > 1:
+            db_dir = os.path.join(db_dir, f"shard{shard_index}")
+        self.db = TrackerDB(db_dir)
+        self.db.load(apply=self.apply)
+        # the nodes restored from the database have one lease period to tell they are still in the torrent
+        for owner in self.file_owners_list.files:
+            self.node_leases.renew(owner, now=time.monotonic())
+        self.started_at = time.monotonic()
+        self.shard_endpoint = None  # requests to the other shards, see serve()
+        self.tasks = set()
+        self.metrics_port = metrics_port
+        self.metrics = Metrics()
+        self.requests_count = self.metrics.counter("tracker_requests_total", "Requests handled, by mode", ("mode",))
+        self.metrics.gauge("tracker_files", "Files which have owners", read=lambda: len(self.file_owners_list))
+        self.metrics.gauge("tracker_owners", "Nodes which own files", read=lambda: len(self.file_owners_list.files))
+        self.metrics.gauge("tracker_ownerships", "(file, owner) pairs of the owner table",
+                           read=lambda: sum(len(owners) for _, owners in self.file_owners_list.items()))
+        self.metrics.gauge("tracker_nodes", "Nodes in the torrent (registry only)", read=lambda: len(self.node_leases))
+        self.metrics.gauge("tracker_db_unsnapshotted_records", "Records of the database log written since the last snapshot",
+                           read=lambda: self.db.unsnapshotted)
 
     def send_segment(self, sock: socket.socket, data: bytes, addr: tuple,):
         ip, dest_port = addr
@@ -30,139 +94,333 @@ class Tracker:
                              dest_port=dest_port,
                              data=data)
         encrypted_data = segment.data
-        sock.sendto(encrypted_data, addr)
+        try:
+            sock.sendto(encrypted_data, addr)
+        except (BlockingIOError, InterruptedError):
+            pass    # the socket buffer is full, the node asks again
 
     def add_file_owner(self, msg: dict, addr: tuple):
-        entry = {
-            'node_id': msg['node_id'],
-            'addr': addr
-        }
         log_content = f"Node {msg['node_id']} owns {msg['filename']} and is ready to send."
-        log(node_id=0, content=log_content, is_tracker=True)
-
-        self.file_owners_list[msg['filename']].append(json.dumps(entry))
-        self.file_owners_list[msg['filename']] = list(set(self.file_owners_list[msg['filename']]))
-        self.send_freq_list[msg['node_id']] += 1
-        self.send_freq_list[msg['node_id']] -= 1
+        log(node_id=0, content=log_content, is_tracker=True, level=DEBUG)
 
-        self.save_db_as_json()
+        self.mutate([OWN, msg['node_id'], addr[0], addr[1], msg['filename']])
 
     def update_db(self, msg: dict):
-        self.send_freq_list[msg["node_id"]] += 1
-        self.save_db_as_json()
+        self.mutate([UPDATE, msg['node_id']])
+
+    def report_peer(self, msg: dict):
+        if msg['peer_id'] not in self.send_freq_list:
+            return
+        alpha = config.constants.PEER_EWMA_ALPHA
+        report = self.peer_reports.setdefault(msg['peer_id'], [msg['bandwidth'], msg['rtt']])
+        report[0] = (1 - alpha) * report[0] + alpha * msg['bandwidth']
+        report[1] = (1 - alpha) * report[1] + alpha * msg['rtt']
+
+    def search_key(self, order: int):
+        '''
+        :return: the sort key of the (node_id, addr) owners for the order of a search, None to keep the announcement order
+        '''
+        if order == ORDER_SEND_FREQ:
+            return lambda owner: -self.send_freq_list[owner[0]]
+        if order == ORDER_SPEED:
+            # as the nodes rank their peers (see peer_stats.py), with what the other nodes reported
+            nbytes = config.constants.SCHEDULER_BLOCK_PIECES * config.constants.CHUNK_PIECES_SIZE
+            default = (config.constants.PEER_DEFAULT_BANDWIDTH, config.constants.PEER_DEFAULT_RTT)
+
+            def key(owner):
+                bandwidth, rtt = self.peer_reports.get(owner[0], default)
+                return rtt + nbytes / (bandwidth or default[0]), -self.send_freq_list[owner[0]]
+            return key
+        return None
 
     def search_file(self, msg: dict, addr: tuple):
+        '''
+        Replies with one page of the owners of the file, in the order the node asked for. A page fits in
+        TRACKER_SEARCH_REPLY_SIZE bytes, and its cursor is the rank of its first owner: only the owners up
+        to the end of the page are ranked, so the first pages of a file with many owners stay cheap.
+        '''
         log_content = f"Node{msg['node_id']} is searching for {msg['filename']}"
-        log(node_id=0, content=log_content, is_tracker=True)
+        log(node_id=0, content=log_content, is_tracker=True, level=DEBUG)
+
+        owners = self.file_owners_list.owners_of(msg['filename'])
+        limit = Tracker2Node.capacity(msg['filename'], config.constants.TRACKER_SEARCH_REPLY_SIZE)
+        if msg['limit']:
+            limit = min(limit, msg['limit'])
+        start, end = msg['cursor'], msg['cursor'] + limit
+        key = self.search_key(msg['order'])
+        if key is None:
+            ranked = itertools.islice(owners, end)
+        else:
+            ranked = heapq.nsmallest(end, owners, key=key)
 
         matched_entries = []
-        for json_entry in self.file_owners_list[msg['filename']]:
-            entry = json.loads(json_entry)
-            matched_entries.append((entry, self.send_freq_list[entry['node_id']]))
+        for node_id, node_addr in itertools.islice(ranked, start, None):
+            owner = {'node_id': node_id, 'addr': node_addr}
+            if node_id in self.peer_reports:
+                owner['bandwidth'], owner['rtt'] = self.peer_reports[node_id]
+            matched_entries.append((owner, self.send_freq_list[node_id]))
 
         tracker_response = Tracker2Node(dest_node_id=msg['node_id'],
                                         search_result=matched_entries,
-                                        filename=msg['filename'])
+                                        filename=msg['filename'],
+                                        total=len(owners),
+                                        next_cursor=end if end < len(owners) else 0).in_reply_to(msg)
 
         self.send_segment(sock=self.tracker_socket,
                           data=tracker_response.encode(),
                           addr=addr)
 
+    def bootstrap_node(self, msg: dict, addr: tuple):
+        '''
+        Gives a node which joins the DHT (see dht.py) a few nodes which are in the torrent
+        '''
+        self.node_leases.renew((msg['node_id'], addr), now=time.monotonic())
+        nodes = [(node_id, node_addr) for node_id, node_addr in self.node_leases if node_id != msg['node_id']]
+        nodes = random.sample(nodes, min(len(nodes), config.constants.DHT_BOOTSTRAP_CONTACTS))
+        tracker_response = Tracker2Node(dest_node_id=msg['node_id'],
+                                        search_result=[({'node_id': node_id, 'addr': node_addr}, 0)
+                                                       for node_id, node_addr in nodes],
+                                        filename="").in_reply_to(msg)
+        self.send_segment(sock=self.tracker_socket,
+                          data=tracker_response.encode(),
+                          addr=addr)
+
     def remove_node(self, node_id: int, addr: tuple):
-        entry = {
-            'node_id': node_id,
-            'addr': addr
-        }
-        try:
-            self.send_freq_list.pop(node_id)
-        except KeyError:
-            pass
-        self.has_informed_tracker.pop((node_id, addr))
-        node_files = self.file_owners_list.copy()
-        for nf in node_files:
-            if json.dumps(entry) in self.file_owners_list[nf]:
-                self.file_owners_list[nf].remove(json.dumps(entry))
-            if len(self.file_owners_list[nf]) == 0:
-                self.file_owners_list.pop(nf)
-
-        self.save_db_as_json()
-
-    def check_nodes_periodically(self, interval: int):
-        global next_call
-        alive_nodes_ids = set()
-        dead_nodes_ids = set()
-        try:
-            for node, has_informed in self.has_informed_tracker.items():
-                node_id, node_addr = node[0], node[1]
-                if has_informed: # it means the node has informed the tracker that is still in the torrent
-                    self.has_informed_tracker[node] = False
-                    alive_nodes_ids.add(node_id)
-                else:
-                    dead_nodes_ids.add(node_id)
-                    self.remove_node(node_id=node_id, addr=node_addr)
-        except RuntimeError: # the dictionary size maybe changed during iteration, so we check nodes in the next time step
-            pass
+        self.node_leases.remove((node_id, addr))
+        self.peer_reports.pop(node_id, None)
+        self.mutate([REMOVE, node_id, addr[0], addr[1]])
+
+    def node_left(self, node_id: int, addr: tuple):
+        '''
+        Removes a node which left the torrent, from this shard and from the other ones
+        '''
+        self.remove_node(node_id=node_id, addr=addr)
+        for shard in self.shard_map.shards[1:]:
+            self.spawn(self.tell_node_left(shard=shard, node_id=node_id, addr=addr))
+
+    async def tell_node_left(self, shard: tuple, node_id: int, addr: tuple):
+        msg = Tracker2Tracker(node_id=node_id, mode=config.tracker_requests_mode.EXIT, addr=addr)
+        # sent again until the shard acknowledges it
+        if await self.shard_endpoint.request(msg=msg, addr=shard) is None:
+            log_content = f"The shard at {shard} didn't acknowledge that node {node_id} left, its own lease of the node will expire."
+            log(node_id=0, content=log_content, is_tracker=True)
 
-        if not (len(alive_nodes_ids) == 0 and len(dead_nodes_ids) == 0):
-            log_content = f"Node(s) {list(alive_nodes_ids)} is in the torrent and node(s){list(dead_nodes_ids)} have left."
+    async def confirm_node(self, node_id: int, addr: tuple):
+        '''
+        Asks the registry whether a node whose lease expired on this shard is still in the torrent,
+        as the nodes only renew their leases with the registry. The node is kept if the registry doesn't answer.
+        '''
+        msg = Tracker2Tracker(node_id=node_id, mode=config.tracker_requests_mode.REGISTER, addr=addr)
+        reply = await self.shard_endpoint.request(msg=msg, addr=self.shard_map.registry)
+        if reply is not None and reply['mode'] == config.tracker_requests_mode.EXIT:
+            self.remove_node(node_id=node_id, addr=addr)
+            self.flush_db()
+            log_content = f"Node {node_id} has left, the registry doesn't know it anymore."
             log(node_id=0, content=log_content, is_tracker=True)
+        elif (node_id, addr) in self.file_owners_list.files:
+            self.node_leases.renew((node_id, addr), now=time.monotonic())
 
-        datetime.now()
-        next_call = next_call + interval
-        Timer(next_call - time.time(), self.check_nodes_periodically, args=(interval,)).start()
+    def handle_shard_message(self, msg: dict, addr: tuple):
+        '''
+        Answers a Tracker2Tracker message of another shard about a node
+        '''
+        modes = config.tracker_requests_mode
+        if msg['mode'] == modes.EXIT and not self.is_registry:
+            # the registry tells that the node left
+            self.remove_node(node_id=msg['node_id'], addr=msg['addr'])
+            mode = modes.EXIT
+        elif msg['mode'] == modes.REGISTER and self.is_registry:
+            # a shard asks whether the node is still in the torrent. The nodes restored from the database
+            # are only known once they inform the registry again, so they are all alive for one lease period
+            alive = ((msg['node_id'], msg['addr']) in self.node_leases
+                     or time.monotonic() - self.started_at < config.constants.TRACKER_TIME_INTERVAL)
+            mode = modes.REGISTER if alive else modes.EXIT
+        else:
+            return
+        reply = Tracker2Tracker(node_id=msg['node_id'], mode=mode, addr=msg['addr']).in_reply_to(msg)
+        self.send_segment(sock=self.tracker_socket, data=reply.encode(), addr=addr)
 
-    def save_db_as_json(self):
-        if not os.path.exists(config.directory.tracker_db_dir):
-            os.makedirs(config.directory.tracker_db_dir)
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
 
-        nodes_info_path = config.directory.tracker_db_dir + "nodes.json"
-        files_info_path = config.directory.tracker_db_dir + "files.json"
+    def apply(self, record: list) -> bool:
+        '''
+        Applies a mutation record (see tracker_db.py) to the database
 
-        # saves nodes' information as a json file
-        temp_dict = {}
-        for key, value in self.send_freq_list.items():
-            temp_dict['node'+str(key)] = value
-        nodes_json = open(nodes_info_path, 'w')
-        json.dump(temp_dict, nodes_json, indent=4, sort_keys=True)
+        :return: True if the database has changed
+        '''
+        kind = record[0]
+        if kind == OWN:
+            _, node_id, host, port, filename = record
+            if not self.file_owners_list.add(filename=filename, owner=(node_id, (host, port))):
+                return False
+            self.send_freq_list.setdefault(node_id, 0)
+        elif kind == UPDATE:
+            self.send_freq_list[record[1]] += 1
+        elif kind == REMOVE:
+            _, node_id, host, port = record
+            had_node = self.send_freq_list.pop(node_id, None) is not None
+            if not self.file_owners_list.remove_owner((node_id, (host, port))) and not had_node:
+                return False
+        elif kind == NODE:
+            _, node_id, send_freq = record
+            self.send_freq_list[node_id] = send_freq
+        return True
 
-        # saves files' information as a json file
-        files_json = open(files_info_path, 'w')
-        json.dump(self.file_owners_list, files_json, indent=4, sort_keys=True)
+    def mutate(self, record: list):
+        '''
+        Applies the record and appends it to the log, which is written by flush_db()
+        '''
+        if self.apply(record):
+            self.db.append(record)
+
+    def db_records(self) -> list:
+        '''
+        :return: records which rebuild the whole database, for a snapshot
+        '''
+        records = [[NODE, node_id, send_freq] for node_id, send_freq in self.send_freq_list.items()]
+        for filename, owners in self.file_owners_list.items():
+            records.extend([OWN, node_id, host, port, filename] for node_id, (host, port) in owners)
+        return records
+
+    async def check_nodes_periodically(self, interval: float):
+        loop = asyncio.get_running_loop()
+        next_call = loop.time()
+        while True:
+            dead_nodes_ids = set()
+            for node_id, node_addr in self.node_leases.expire(now=time.monotonic()):
+                if not self.is_registry:
+                    self.spawn(self.confirm_node(node_id=node_id, addr=node_addr))
+                    continue
+                dead_nodes_ids.add(node_id)
+                self.node_left(node_id=node_id, addr=node_addr)
+            self.flush_db()
+
+            if dead_nodes_ids:
+                log_content = f"Node(s) {list(dead_nodes_ids)} have left, {len(self.node_leases)} node(s) are in the torrent."
+                log(node_id=0, content=log_content, is_tracker=True)
+
+            next_call = next_call + interval
+            await asyncio.sleep(next_call - loop.time())
+
+    def flush_db(self):
+        self.db.flush()
+
+    async def snapshot_db_periodically(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            if self.db.unsnapshotted or self.db.pending:
+                await self.db.snapshot(self.db_records())
 
     def handle_node_request(self, data: bytes, addr: tuple):
-        msg = Message.decode(data)
-        mode = msg['mode']
-        if mode == config.tracker_requests_mode.OWN:
+        try:
+            msg = Message.decode(data)
+        except ValueError as e:
+            self.requests_count.inc(1, ("invalid",))
+            log(node_id=0, content=f"A malformed request from {addr} is dropped: {e}", is_tracker=True)
+            return
+        try:
+            self.dispatch_node_request(msg=msg, addr=addr)
+        except (KeyError, IndexError, ValueError) as e:
+            # e.g. a message of a type the tracker doesn't expect
+            self.requests_count.inc(1, ("invalid",))
+            log(node_id=0, content=f"A malformed request from {addr} is dropped: {e!r}", is_tracker=True)
+
+    def dispatch_node_request(self, msg: dict, addr: tuple):
+        mode = msg.get('mode')
+        kind = "peer_report" if 'peer_id' in msg else "shard" if 'addr' in msg else MODE_NAMES.get(mode, "unknown")
+        self.requests_count.inc(1, (kind,))
+        if 'peer_id' in msg:    # a node tells how fast another one sent it a file
+            self.report_peer(msg=msg)
+        elif 'addr' in msg:   # another shard tells or asks this one about a node
+            self.handle_shard_message(msg=msg, addr=addr)
+        elif mode == config.tracker_requests_mode.OWN:
             self.add_file_owner(msg=msg, addr=addr)
+            self.node_leases.renew((msg['node_id'], addr), now=time.monotonic())
         elif mode == config.tracker_requests_mode.NEED:
             self.search_file(msg=msg, addr=addr)
         elif mode == config.tracker_requests_mode.UPDATE:
             self.update_db(msg=msg)
-        elif mode == config.tracker_requests_mode.REGISTER:
-            self.has_informed_tracker[(msg['node_id'], addr)] = True
-        elif mode == config.tracker_requests_mode.EXIT:
-            self.remove_node(node_id=msg['node_id'], addr=addr)
+        elif mode == config.tracker_requests_mode.REGISTER and self.is_registry:
+            self.node_leases.renew((msg['node_id'], addr), now=time.monotonic())
+        elif mode == config.tracker_requests_mode.BOOTSTRAP and self.is_registry:
+            self.bootstrap_node(msg=msg, addr=addr)
+        elif mode == config.tracker_requests_mode.EXIT and self.is_registry:
+            self.node_left(node_id=msg['node_id'], addr=addr)
             log_content = f"Node {msg['node_id']} exited torrent intentionally."
             log(node_id=0, content=log_content, is_tracker=True)
 
-    def listen(self):
-        timer_thread = Thread(target=self.check_nodes_periodically, args=(config.constants.TRACKER_TIME_INTERVAL,))
-        timer_thread.setDaemon(True)
-        timer_thread.start()
+    def on_readable(self):
+        '''
+        Handles the datagrams waiting in the socket, at most TRACKER_RECV_BATCH of them
+        so that the liveness check is not held up, and logs their changes of the database once for all of them.
+        '''
+        for _ in range(config.constants.TRACKER_RECV_BATCH):
+            try:
+                data, addr = self.tracker_socket.recvfrom(config.constants.BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            self.handle_node_request(data=data, addr=addr)
+        self.flush_db()
 
-        while True:
-            data, addr = self.tracker_socket.recvfrom(config.constants.BUFFER_SIZE)
-            t = Thread(target=self.handle_node_request, args=(data, addr))
-            t.start()
+    async def serve(self):
+        try:
+            self.tracker_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, config.constants.TRACKER_RCV_BUFFER)
+        except OSError:
+            pass
+        self.tracker_socket.setblocking(False)
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.tracker_socket.fileno(), self.on_readable)
+        self.snapshot_task = loop.create_task(self.snapshot_db_periodically(interval=config.constants.TRACKER_SNAPSHOT_INTERVAL))
+        if len(self.shard_map) > 1:
+            self.shard_endpoint = Endpoint(port=generate_random_port(), on_request=lambda msg, addr: None)
+            await self.shard_endpoint.open()
+        if self.metrics_port is not None:
+            await self.metrics.serve(port=self.metrics_port)
+        try:
+            await self.check_nodes_periodically(interval=config.constants.TRACKER_LEASE_TICK)
+        finally:
+            self.metrics.close()
+            for task in list(self.tasks):
+                task.cancel()
+            if self.shard_endpoint is not None:
+                self.shard_endpoint.close()
+
+    def listen(self):
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.db.close()
 
     def run(self):
-        log_content = f"***************** Tracker program started just right now! *****************"
+        log_content = f"***************** Tracker shard {self.shard_index} started just right now! *****************"
         log(node_id=0, content=log_content, is_tracker=True)
-        t = Thread(target=self.listen())
-        t.daemon = True
-        t.start()
-        t.join()
+        self.listen()
+
+def run_shard(shard_index: int, metrics_port: int = None):
+    Tracker(shard_index=shard_index, metrics_port=metrics_port).run()
 
 if __name__ == '__main__':
-    t = Tracker()
-    t.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-shard', type=int, help='index in TRACKER_SHARDS of the only shard to run, all of them are run by default')
+    parser.add_argument('-metrics_port', type=int,
+                        help='port of the HTTP server of the metrics of the shard (see metrics.py), the next ones for the next shards')
+    args = parser.parse_args()
+
+    def metrics_port_of(shard_index: int):
+        return args.metrics_port + shard_index if args.metrics_port is not None else None
+
+    shards_count = len(config.constants.TRACKER_SHARDS)
+    if args.shard is not None:
+        run_shard(args.shard, metrics_port_of(args.shard))
+    elif shards_count == 1:
+        run_shard(0, metrics_port_of(0))
+    else:
+        processes = [multiprocessing.Process(target=run_shard, args=(i, metrics_port_of(i))) for i in range(shards_count)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
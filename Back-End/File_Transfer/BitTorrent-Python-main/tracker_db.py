@@ -0,0 +1,135 @@
+"""
+Persistence of the tracker database: an append-only log of its mutations plus periodic snapshots.
+
+Every change of the database (a node owns a file, a node uploaded a file, a
+node left) is appended to the log as one compact JSON line. The records of a
+batch of requests are written and fsynced together by ``flush()``, so a change
+costs O(1) instead of a rewrite of the whole database.
+
+Every TRACKER_SNAPSHOT_INTERVAL seconds the log is rotated and the whole
+database is written as a snapshot on a background thread, after which the
+logs it covers are deleted. At startup the tracker loads the snapshot and
+replays the logs written after it.
+"""
+import asyncio
+import json
+import os
+
+# mutation records, the lists appended to the log
+OWN = "own"         # [OWN, node_id, host, port, filename]
+UPDATE = "update"   # [UPDATE, node_id]
+REMOVE = "remove"   # [REMOVE, node_id, host, port]
+NODE = "node"       # [NODE, node_id, send_freq], only found in snapshots
+
+SNAPSHOT_FILENAME = "snapshot.json"
+
+
+class TrackerDB:
+    """
+    The logs are numbered by generation: mutations.<generation>.log. A snapshot
+    of generation g holds everything written to the logs before generation g.
+    The tracker always starts a new generation when it starts, so it never
+    appends after a record which was cut short by a crash.
+    """
+    def __init__(self, db_dir: str):
+        self.db_dir = db_dir
+        self.generation = 0
+        self.log_file = None
+        self.pending = []           # records appended but not written yet
+        self.unsnapshotted = 0      # records written since the last snapshot
+
+    def log_path(self, generation: int) -> str:
+        return os.path.join(self.db_dir, f"mutations.{generation}.log")
+
+    def log_generations(self) -> list:
+        generations = []
+        for name in os.listdir(self.db_dir):
+            parts = name.split(".")
+            if len(parts) == 3 and parts[0] == "mutations" and parts[2] == "log" and parts[1].isdigit():
+                generations.append(int(parts[1]))
+        return sorted(generations)
+
+    def load(self, apply) -> int:
+        '''
+        Replays the snapshot and then the logs written after it, and opens a new log
+
+        :param apply: called with every record, in the order they were written
+        :return: number of records replayed
+        '''
+        os.makedirs(self.db_dir, exist_ok=True)
+        replayed = 0
+        snapshot_generation = 0
+        snapshot_path = os.path.join(self.db_dir, SNAPSHOT_FILENAME)
+        if os.path.exists(snapshot_path):
+            with open(snapshot_path) as f:
+                snapshot = json.load(f)
+            snapshot_generation = snapshot["generation"]
+            for record in snapshot["records"]:
+                apply(record)
+                replayed += 1
+
+        last_generation = snapshot_generation - 1
+        for generation in self.log_generations():
+            if generation < snapshot_generation:
+                continue
+            last_generation = generation
+            with open(self.log_path(generation)) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break   # the tracker stopped in the middle of this record
+                    apply(record)
+                    replayed += 1
+                    self.unsnapshotted += 1
+
+        self.generation = last_generation + 1
+        self.log_file = open(self.log_path(self.generation), "a")
+        return replayed
+
+    def append(self, record: list):
+        self.pending.append(record)
+
+    def flush(self):
+        '''
+        Writes the records appended since the last call and waits for them to reach the disk
+        '''
+        if not self.pending:
+            return
+        self.log_file.write("".join(json.dumps(record, separators=(",", ":")) + "\n"
+                                    for record in self.pending))
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+        self.unsnapshotted += len(self.pending)
+        self.pending.clear()
+
+    async def snapshot(self, records: list):
+        '''
+        Rotates the log and writes the records, which must describe the whole
+        database as it is now, as the new snapshot on a background thread
+
+        :param records: records which rebuild the database when they are applied
+        '''
+        self.flush()
+        self.log_file.close()
+        self.generation += 1
+        self.log_file = open(self.log_path(self.generation), "a")
+        self.unsnapshotted = 0
+        await asyncio.get_running_loop().run_in_executor(None, self.write_snapshot, records, self.generation)
+
+    def write_snapshot(self, records: list, generation: int):
+        snapshot_path = os.path.join(self.db_dir, SNAPSHOT_FILENAME)
+        temp_path = snapshot_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"generation": generation, "records": records}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, snapshot_path)
+        # the snapshot is in place, the logs it covers are not needed anymore
+        for old_generation in self.log_generations():
+            if old_generation < generation:
+                os.remove(self.log_path(old_generation))
+
+    def close(self):
+        self.flush()
+        self.log_file.close()
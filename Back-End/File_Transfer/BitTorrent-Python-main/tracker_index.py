@@ -0,0 +1,66 @@
+"""
+In-memory index of which node owns which file, kept by the tracker.
+
+An owner is the tuple (node_id, addr), the same key the tracker uses for the
+liveness of the nodes. The index is kept in both directions, file -> owners
+and owner -> files, so that announcing a file, searching a file and removing
+a node each only touch the owners of the files concerned, never the whole
+torrent.
+"""
+
+
+class OwnershipIndex:
+    """
+    The owners of a file are kept in a dict used as an ordered set, so that
+    search results come back in the order the owners announced the file.
+    """
+    __slots__ = ("owners", "files")
+
+    def __init__(self):
+        self.owners = {}    # filename -> {owner: None}
+        self.files = {}     # owner -> set of filenames
+
+    def __len__(self) -> int:
+        return len(self.owners)
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self.owners
+
+    def add(self, filename: str, owner: tuple) -> bool:
+        '''
+        Records that owner has the file
+
+        :return: True if it was not known already
+        '''
+        owners = self.owners.setdefault(filename, {})
+        if owner in owners:
+            return False
+        owners[owner] = None
+        self.files.setdefault(owner, set()).add(filename)
+        return True
+
+    def owners_of(self, filename: str):
+        '''
+        :return: the owners of the file, in the order they announced it
+        '''
+        return self.owners.get(filename, {}).keys()
+
+    def remove_owner(self, owner: tuple) -> set:
+        '''
+        Forgets every file of the owner. The files left without any owner are dropped.
+
+        :return: the files the owner had
+        '''
+        filenames = self.files.pop(owner, set())
+        for filename in filenames:
+            owners = self.owners[filename]
+            del owners[owner]
+            if not owners:
+                del self.owners[filename]
+        return filenames
+
+    def items(self):
+        '''
+        :return: (filename, owners) pairs of every file in the torrent
+        '''
+        return self.owners.items()
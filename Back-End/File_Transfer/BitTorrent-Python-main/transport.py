@@ -0,0 +1,405 @@
+"""
+Reliable transfer of the pieces of a chunk over UDP.
+
+The pieces of a chunk are numbered by their idx, which is used as sequence
+number. The receiver acknowledges them with ``ChunkAck`` messages carrying a
+cumulative ack and selective ack (SACK) blocks. The sender keeps a sliding
+window of unacknowledged pieces whose size follows an AIMD congestion window,
+paces the pieces over the smoothed RTT, retransmits the pieces which are
+overtaken by later acked ones or whose retransmission timeout (RFC 6298)
+expires, and finally sends the usual ``idx = -1`` terminator. The chunk is
+received as soon as its last piece is; the receiver then lingers apart
+(``ReliableReceiver.linger()``), acking the retransmissions until the
+terminator comes. A receiver
+which gives the chunk up (e.g. another peer sent it first) tells the sender
+with an ack of ``cum_ack = CANCEL_ACK``, so it stops at once.
+
+``SendWindow`` and ``ReceiveWindow`` only keep the state of a transfer and do
+no I/O; ``ReliableSender`` and ``ReliableReceiver`` drive them as coroutines.
+They don't own a socket either: they send through a function and get the
+decoded messages of their transfer from a queue, which the node's endpoint
+fills, so any number of transfers share the socket of the node.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+CANCEL_ACK = -1     # cum_ack of the ack telling the sender that the receiver gave the chunk up
+
+
+class RTOEstimator:
+    """Retransmission timeout computed from RTT samples as in RFC 6298"""
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = config.constants.INITIAL_RTO
+
+    def sample(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.reset_backoff()
+
+    def reset_backoff(self):
+        if self.srtt is not None:
+            self.rto = min(max(self.srtt + 4 * self.rttvar, config.constants.MIN_RTO),
+                           config.constants.MAX_RTO)
+
+    def backoff(self):
+        self.rto = min(self.rto * 2, config.constants.MAX_RTO)
+
+
+class SendWindow:
+    """Sender side state of the transfer of pieces_count pieces"""
+    def __init__(self, pieces_count: int):
+        self.pieces_count = pieces_count
+        self.acked = bytearray(pieces_count)
+        self.acked_count = 0
+        self.cum_ack = 0                # every piece below it is acked
+        self.next_seq = 0               # first piece which has never been sent
+        self.in_flight = OrderedDict()  # seq -> time it was last sent, oldest first
+        self.lost = deque()             # pieces waiting to be retransmitted
+        self.retransmitted = set()      # their acks give no RTT sample (Karn's algorithm)
+        self.latest_acked_sent_at = 0.0
+        self.recovery_started_at = 0.0  # the window is cut at most once per loss episode
+        self.cwnd = float(config.constants.INITIAL_CWND)
+        self.ssthresh = float(config.constants.MAX_CWND)
+        self.rtt = RTOEstimator()
+        self.sent_count = 0
+        self.retransmissions_count = 0
+
+    def done(self) -> bool:
+        return self.acked_count == self.pieces_count
+
+    def can_send(self) -> bool:
+        return len(self.in_flight) < int(self.cwnd) and (bool(self.lost) or self.next_seq < self.pieces_count)
+
+    def next_to_send(self, now: float):
+        '''
+        :return: the piece to be sent now (a lost one first), or None
+        '''
+        while self.lost:
+            seq = self.lost.popleft()
+            if not self.acked[seq]:
+                self.retransmitted.add(seq)
+                self.retransmissions_count += 1
+                break
+        else:
+            if self.next_seq >= self.pieces_count:
+                return None
+            seq = self.next_seq
+            self.next_seq += 1
+        self.in_flight[seq] = now
+        self.sent_count += 1
+        return seq
+
+    def pacing_interval(self) -> float:
+        if self.rtt.srtt is None:
+            return 0.0
+        return self.rtt.srtt / self.cwnd
+
+    def next_deadline(self):
+        '''
+        :return: the time at which the oldest piece in flight times out, or None
+        '''
+        for sent_at in self.in_flight.values():
+            return sent_at + self.rtt.rto
+        return None
+
+    def on_ack(self, cum_ack: int, sacks: list, now: float) -> int:
+        '''
+        :return: number of pieces newly acked
+        '''
+        before = self.acked_count
+        latest_sample = None
+        for seq in range(self.cum_ack, min(cum_ack, self.pieces_count)):
+            latest_sample = self._mark_acked(seq) or latest_sample
+        for start, end in sacks:
+            for seq in range(max(start, self.cum_ack), min(end, self.pieces_count)):
+                latest_sample = self._mark_acked(seq) or latest_sample
+        while self.cum_ack < self.pieces_count and self.acked[self.cum_ack]:
+            self.cum_ack += 1
+        if latest_sample is not None:
+            self.rtt.sample(now - latest_sample)
+        elif self.acked_count > before:
+            # new data got through, so the path is alive again
+            self.rtt.reset_backoff()
+
+        newly_acked = self.acked_count - before
+        if newly_acked:
+            # additive increase (exponential while in slow start)
+            if self.cwnd < self.ssthresh:
+                self.cwnd += newly_acked
+            else:
+                self.cwnd += newly_acked / self.cwnd
+            self.cwnd = min(self.cwnd, config.constants.MAX_CWND)
+            self._detect_losses(now)
+        return newly_acked
+
+    def on_timeout(self, now: float):
+        '''
+        Every piece whose retransmission timeout expired is considered lost,
+        the window collapses to its minimum and the timeout is backed off.
+        '''
+        expired = False
+        while self.in_flight:
+            seq, sent_at = next(iter(self.in_flight.items()))
+            if sent_at + self.rtt.rto > now:
+                break
+            del self.in_flight[seq]
+            self.lost.append(seq)
+            expired = True
+        if expired:
+            self.ssthresh = max(self.cwnd / 2, config.constants.MIN_CWND)
+            self.cwnd = config.constants.MIN_CWND
+            self.recovery_started_at = now
+            self.rtt.backoff()
+
+    def _mark_acked(self, seq: int):
+        '''
+        :return: the time the piece was sent, if it gives a valid RTT sample
+        '''
+        if self.acked[seq]:
+            return None
+        self.acked[seq] = 1
+        self.acked_count += 1
+        sent_at = self.in_flight.pop(seq, None)
+        if sent_at is None:
+            return None
+        self.latest_acked_sent_at = max(self.latest_acked_sent_at, sent_at)
+        if seq in self.retransmitted:
+            return None
+        return sent_at
+
+    def _detect_losses(self, now: float):
+        # a piece is lost when a piece sent sufficiently later than it has been acked
+        reorder_window = max((self.rtt.srtt or 0) / 4, 0.001)
+        cut = False
+        while self.in_flight:
+            seq, sent_at = next(iter(self.in_flight.items()))
+            if sent_at + reorder_window >= self.latest_acked_sent_at:
+                break
+            del self.in_flight[seq]
+            self.lost.append(seq)
+            if sent_at > self.recovery_started_at:
+                cut = True
+        if cut:
+            # multiplicative decrease, once for all the losses of a window
+            self.ssthresh = max(self.cwnd / 2, config.constants.MIN_CWND)
+            self.cwnd = self.ssthresh
+            self.recovery_started_at = now
+
+
+class ReceiveWindow:
+    """Receiver side state of the transfer of pieces_count pieces"""
+    def __init__(self, pieces_count: int):
+        self.pieces_count = pieces_count
+        self.received = bytearray(pieces_count)
+        self.received_count = 0
+        self.cum_ack = 0
+        self.highest = -1
+
+    def complete(self) -> bool:
+        return self.received_count == self.pieces_count
+
+    def on_piece(self, idx: int) -> bool:
+        '''
+        :return: whether the piece is new (not a duplicate)
+        '''
+        if not 0 <= idx < self.pieces_count or self.received[idx]:
+            return False
+        self.received[idx] = 1
+        self.received_count += 1
+        self.highest = max(self.highest, idx)
+        if idx == self.cum_ack:
+            next_missing = self.received.find(0, self.cum_ack)
+            self.cum_ack = self.pieces_count if next_missing == -1 else next_missing
+        return True
+
+    def sack_blocks(self) -> list:
+        blocks = []
+        end = self.highest + 1
+        seq = self.cum_ack
+        while seq < end and len(blocks) < config.constants.MAX_SACK_BLOCKS:
+            start = self.received.find(1, seq, end)
+            if start == -1:
+                break
+            seq = self.received.find(0, start, end)
+            if seq == -1:
+                seq = end
+            blocks.append((start, seq))
+        return blocks
+
+
+def pieces_count_of(rng: tuple, piece_size: int) -> int:
+    return math.ceil((rng[1] - rng[0]) / piece_size)
+
+
+async def next_message(inbox: asyncio.Queue, timeout: float):
+    '''
+    :return: the next message of the inbox, or None if none comes within timeout
+    '''
+    if not inbox.empty():
+        return inbox.get_nowait()
+    try:
+        return await asyncio.wait_for(inbox.get(), max(timeout, 0))
+    except asyncio.TimeoutError:
+        return None
+
+
+class ReliableSender:
+    """
+    Sends pieces_count pieces reliably.
+
+    :param send: datagram (bytes or list of buffers) -> None, sends it to the receiver
+    :param inbox: queue of the decoded messages (acks) which the receiver sends back
+    :param make_piece: idx -> datagram of that piece
+    :param make_fin: () -> datagram telling the receiver that the transfer is over
+    :param send_many: list of datagrams -> None, if given the pieces which leave back-to-back are handed to it at once
+    """
+    def __init__(self, send, inbox: asyncio.Queue, pieces_count: int, make_piece, make_fin, send_many=None):
+        self.send = send
+        self.send_many = send_many
+        self.inbox = inbox
+        self.make_piece = make_piece
+        self.make_fin = make_fin
+        self.window = SendWindow(pieces_count)
+        self.cancelled = False  # the receiver gave the chunk up
+
+    async def run(self) -> bool:
+        '''
+        :return: whether every piece has been acknowledged
+        '''
+        window = self.window
+        next_send = 0.0
+        last_progress = time.monotonic()
+        while not window.done():
+            now = time.monotonic()
+            # 1. send as much as the window and the pacing allow
+            burst = []
+            while window.can_send() and now >= next_send:
+                seq = window.next_to_send(now)
+                if seq is None:
+                    break
+                burst.append(self.make_piece(seq))
+                interval = window.pacing_interval()
+                next_send = max(next_send, now - config.constants.PACING_BURST * interval) + interval
+                now = time.monotonic()
+            if self.send_many is not None:
+                self.send_many(burst)
+            else:
+                for piece in burst:
+                    self.send(piece)
+
+            # 2. wait for acks until the next pacing slot or retransmission timeout
+            wake_at = window.next_deadline()
+            if window.can_send():
+                wake_at = next_send if wake_at is None else min(wake_at, next_send)
+            timeout = config.constants.TRANSFER_IDLE_TIMEOUT if wake_at is None else wake_at - now
+            msg = await next_message(self.inbox, timeout)
+            while msg is not None:
+                if msg.get("cum_ack") == CANCEL_ACK:
+                    self.cancelled = True
+                    return False
+                if "cum_ack" in msg and window.on_ack(msg["cum_ack"], msg["sacks"], time.monotonic()):
+                    last_progress = time.monotonic()
+                msg = None if self.inbox.empty() else self.inbox.get_nowait()
+
+            # 3. retransmission timeouts
+            now = time.monotonic()
+            window.on_timeout(now)
+            if now - last_progress > config.constants.TRANSFER_IDLE_TIMEOUT:
+                return False
+
+        self.send(self.make_fin())
+        return True
+
+
+class ReliableReceiver:
+    """
+    Receives the pieces_count pieces of a chunk reliably.
+
+    :param send: datagram -> None, sends it to the sender
+    :param inbox: queue of the decoded messages (pieces) which the sender sends
+    :param on_piece: coroutine function called with the decoded ChunkSharing message of every new piece
+    :param make_ack: (cum_ack, sacks) -> datagram acknowledging them
+    """
+    def __init__(self, send, inbox: asyncio.Queue, pieces_count: int, on_piece, make_ack):
+        self.send = send
+        self.inbox = inbox
+        self.on_piece = on_piece
+        self.make_ack = make_ack
+        self.window = ReceiveWindow(pieces_count)
+
+    def send_ack(self):
+        self.send(self.make_ack(self.window.cum_ack, self.window.sack_blocks()))
+
+    def cancel(self):
+        '''
+        Tells the sender to stop sending, the chunk is not wanted anymore
+        '''
+        self.send(self.make_ack(CANCEL_ACK, []))
+
+    async def run(self, request) -> bool:
+        '''
+        Sends the request of the chunk (again, if no piece comes back) and receives it.
+
+        :return: whether every piece has been received
+        '''
+        window = self.window
+        request_timeout = config.constants.INITIAL_RTO
+        requests_sent = 1
+        self.send(request)
+        has_started = False
+        unacked = 0
+        while not window.complete():
+            if unacked:
+                timeout = config.constants.ACK_DELAY
+            elif not has_started:
+                timeout = request_timeout
+            else:
+                timeout = config.constants.TRANSFER_IDLE_TIMEOUT
+            msg = await next_message(self.inbox, timeout)
+            if msg is None:
+                if unacked:
+                    self.send_ack()
+                    unacked = 0
+                elif not has_started and requests_sent <= config.constants.REQUEST_RETRIES:
+                    self.send(request)
+                    requests_sent += 1
+                    request_timeout = min(request_timeout * 2, config.constants.MAX_RTO)
+                else:
+                    return False
+                continue
+            if msg.get("chunk") is None:
+                continue
+            has_started = True
+            in_order = msg["idx"] == window.cum_ack
+            is_new = window.on_piece(msg["idx"])
+            if is_new:
+                await self.on_piece(msg)
+            unacked += 1
+            if not (is_new and in_order) or unacked >= config.constants.ACK_EVERY:
+                self.send_ack()
+                unacked = 0
+
+        self.send_ack()
+        return True
+
+    async def linger(self):
+        '''
+        The last ack may be lost: once run() returned, keeps acking the retransmissions until the sender
+        says it is over (or none comes for MAX_RTO). It runs apart, so the caller doesn't wait for it.
+        '''
+        while True:
+            msg = await next_message(self.inbox, config.constants.MAX_RTO)
+            if msg is None or msg.get("idx") == -1:
+                return
+            self.send_ack()
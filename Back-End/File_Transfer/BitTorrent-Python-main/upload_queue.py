@@ -0,0 +1,71 @@
+"""
+Fair queue of the chunk requests a node serves.
+
+A node sends at most MAX_UPLOAD_WORKERS chunks at a time, and each requester
+at most MAX_UPLOADS_PER_REQUESTER of them, so a requester which asks for many
+chunks at once can't take the whole uplink. The requests waiting for a slot
+are queued per requester and served by deficit round robin (DRR) on their
+bytes: every requester in turn gets UPLOAD_QUANTUM bytes of credit and sends
+the requests its credit covers, so a requester of large ranges doesn't delay
+the small requests of the others by more than a quantum.
+
+The queue is used from the event loop of the node and does no I/O.
+"""
+from collections import OrderedDict, defaultdict, deque
+from configs import CFG, Config
+config = Config.from_json(CFG)
+
+
+class UploadQueue:
+    def __init__(self, quantum: int, per_requester: int):
+        self.quantum = quantum
+        self.per_requester = per_requester
+        self.queues = OrderedDict()         # requester -> deque of (cost, item), the next in turn first
+        self.deficits = defaultdict(int)    # requester -> bytes it may still send in its turn
+        self.running = defaultdict(int)     # requester -> requests of it being served
+        self.running_count = 0
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self.queues.values())
+
+    def push(self, requester, cost: int, item):
+        self.queues.setdefault(requester, deque()).append((max(cost, 0), item))
+
+    def pop(self):
+        '''
+        Takes the next request to serve, done() must be called once it is served
+
+        :return: (requester, item), or None if no requester may be served now
+        '''
+        # requesters in a row at their cap: once a whole round of them is, none may be served now. Granting
+        # credit starts the count again, as a requester under its cap is served after a few quanta
+        capped = 0
+        while self.queues and capped < len(self.queues):
+            requester, queue = next(iter(self.queues.items()))
+            if self.running[requester] >= self.per_requester:
+                self.queues.move_to_end(requester)
+                capped += 1
+                continue
+            cost, item = queue[0]
+            if cost > self.deficits[requester]:
+                # its turn is over: it gets credit for the next one
+                self.deficits[requester] += self.quantum
+                self.queues.move_to_end(requester)
+                capped = 0
+                continue
+            queue.popleft()
+            self.deficits[requester] -= cost
+            if not queue:
+                # a requester gets no credit while it has nothing to send
+                del self.queues[requester]
+                del self.deficits[requester]
+            self.running[requester] += 1
+            self.running_count += 1
+            return requester, item
+        return None
+
+    def done(self, requester):
+        self.running[requester] -= 1
+        self.running_count -= 1
+        if not self.running[requester]:
+            del self.running[requester]
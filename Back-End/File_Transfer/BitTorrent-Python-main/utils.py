@@ -2,6 +2,11 @@ import socket
 import random
 import warnings
 import os
+import sys
+import time
+import atexit
+import queue
+import threading
 from datetime import datetime
 from configs import CFG, Config
 config = Config.from_json(CFG)
@@ -33,6 +38,23 @@ def free_socket(sock: socket.socket):
     used_ports.remove(sock.getsockname()[1])
     sock.close()
 
+def send_datagram(sock: socket.socket, data, addr: tuple):
+    '''
+    This function sends a datagram which is given either as bytes or as a list of buffers
+
+    :param sock: socket
+    :param data: bytes, or a list of buffers (bytes/memoryview) which form the datagram
+    :param addr: destination address
+    :return:
+    '''
+    if isinstance(data, (bytes, bytearray)):
+        sock.sendto(data, addr)
+    elif hasattr(sock, "sendmsg"):
+        # scatter/gather: the kernel reads the buffers directly, nothing is concatenated
+        sock.sendmsg(data, [], 0, addr)
+    else:
+        sock.sendto(b"".join(data), addr)
+
 def generate_random_port() -> int:
     '''
     This function generates a new(unused) random port number
@@ -67,37 +89,160 @@ def parse_command(command: str):
         warnings.warn("INVALID COMMAND ENTERED. TRY ANOTHER!")
         return
 
-def log(node_id: int, content: str, is_tracker=False) -> None:
+# log levels
+DEBUG = 10
+INFO = 20
+WARNING = 30
+LOG_LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING}
+
+
+class BufferedLogger:
+    """
+    Logs are written by a background thread: log() only puts the line in a
+    queue, so the caller never waits for the disk or the terminal. The thread
+    takes all the lines waiting at each wakeup and writes them with one write
+    and one flush per file, through handles which stay open.
+    If the queue is full the lines are dropped, and the number of dropped lines
+    is written once there is room again.
+    """
+    def __init__(self, logs_dir: str, level: int, max_pending: int, flush_interval: float):
+        self.logs_dir = logs_dir
+        self.level = level
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.reset()
+
+    def reset(self):
+        self.pending = queue.Queue(maxsize=self.max_pending)
+        self.handles = {}       # log filename -> file object
+        self.dropped = 0
+        self.taken = []         # lines the writer thread took from the queue and hasn't written yet
+        self.lock = threading.Lock()    # guards the writer thread start, the taken lines and the handles
+        self.writer = None
+
+    def log_filename(self, node_id: int, is_tracker: bool) -> str:
+        if is_tracker:
+            return self.logs_dir + '_tracker.log'
+        return self.logs_dir + 'node' + str(node_id) + '.log'
+
+    def log(self, node_id: int, content: str, is_tracker: bool, level: int):
+        if level < self.level:
+            return
+        if self.writer is None:
+            self.start()
+        try:
+            self.pending.put_nowait((self.log_filename(node_id, is_tracker), time.time(), content))
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self.write_forever, daemon=True)
+                self.writer.start()
+                atexit.register(self.close)
+
+    def write_forever(self):
+        while True:
+            try:
+                first = self.pending.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            with self.lock:
+                self.taken.append(first)
+            # lines keep coming while a batch is written, so the writes are spaced by flush_interval
+            time.sleep(self.flush_interval)
+            self.write([])
+
+    def write(self, lines: list):
+        with self.lock:
+            lines = self.taken + lines
+            self.taken = []
+        while True:
+            try:
+                lines.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            lines.append((None, time.time(), f"{dropped} log line(s) dropped, the logger could not keep up"))
+        by_file = {}
+        console = []
+        for filename, timestamp, content in lines:
+            current_time = datetime.fromtimestamp(timestamp).strftime("%H:%M:%S")
+            line = f"[{current_time}]  {content}\n"
+            console.append(line + "\n")
+            if filename is not None:
+                by_file.setdefault(filename, []).append(line)
+        with self.lock:
+            for filename, file_lines in by_file.items():
+                handle = self.handles.get(filename)
+                if handle is None:
+                    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+                    handle = self.handles[filename] = open(filename, 'a')
+                handle.write("".join(file_lines))
+                handle.flush()
+            sys.stdout.write("".join(console))
+            sys.stdout.flush()
+
+    def flush(self):
+        '''
+        Writes the lines waiting in the queue, from the calling thread
+        '''
+        self.write([])
+
+    def close(self):
+        '''
+        Writes the lines waiting in the queue and closes the log files. It must be called
+        before the process exits without running atexit (os._exit())
+        '''
+        self.flush()
+        with self.lock:
+            for handle in self.handles.values():
+                handle.close()
+            self.handles.clear()
+
+
+logger = BufferedLogger(logs_dir=config.directory.logs_dir,
+                        level=LOG_LEVELS[config.constants.LOG_LEVEL],
+                        max_pending=config.constants.LOG_MAX_PENDING,
+                        flush_interval=config.constants.LOG_FLUSH_INTERVAL)
+# a forked process (e.g. a tracker shard) doesn't have the writer thread of its parent; there is no fork on Windows
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=logger.reset)
+
+
+def log(node_id: int, content: str, is_tracker=False, level=INFO) -> None:
     '''
-    This function is used for logging
+    This function is used for logging. It doesn't wait for the log to be
+    written, the lines are written in batches by a background thread.
 
     :param node_id: Since each node has an individual log file to be written in
     :param content: content to be written
+    :param level: the log is skipped if it is below LOG_LEVEL
     :return:
     '''
-    if not os.path.exists(config.directory.logs_dir):
-        os.makedirs(config.directory.logs_dir)
-
-    # time
-    now = datetime.now()
-    current_time = now.strftime("%H:%M:%S")
-
-    content = f"[{current_time}]  {content}\n"
-    print(content)
-
-    if is_tracker:
-        node_logs_filename = config.directory.logs_dir + '_tracker.log'
-    else:
-        node_logs_filename = config.directory.logs_dir + 'node' + str(node_id) + '.log'
-    if not os.path.exists(node_logs_filename):
-        with open(node_logs_filename, 'w') as f:
-            f.write(content)
-            f.close()
-    else:
-        with open(node_logs_filename, 'a') as f:
-            f.write(content)
-            f.close()
-
-
-
-
+    logger.log(node_id=node_id, content=content, is_tracker=is_tracker, level=level)
+
+
+class ProgressLog:
+    """
+    Logs the progress of a task made of many steps (e.g. the pieces of a chunk)
+    at most once every LOG_PROGRESS_INTERVAL seconds, instead of once per step.
+
+    :param describe: called with the number of steps done and the total, returns the log content
+    """
+    def __init__(self, node_id: int, total: int, describe, interval: float = config.constants.LOG_PROGRESS_INTERVAL):
+        self.node_id = node_id
+        self.total = total
+        self.describe = describe
+        self.interval = interval
+        self.done = 0
+        self.next_log_time = time.monotonic() + interval
+
+    def step(self, count: int = 1):
+        self.done += count
+        now = time.monotonic()
+        if now >= self.next_log_time:
+            self.next_log_time = now + self.interval
+            log(node_id=self.node_id, content=self.describe(self.done, self.total))